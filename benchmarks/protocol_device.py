@@ -0,0 +1,81 @@
+"""
+Stand-in controller for the serial link, a pyserial url handler (importing this module registers it):
+
+    device://                 answers READY once opened and "ACK <seq>" to every frame (json or binary)
+    device://?ready=0&ack=0   stays silent
+"""
+import json
+import urllib.parse as urlparse
+
+import serial
+from serial.urlhandler import protocol_loop
+
+from wire import FLAG_CRC, HEADER, MAGIC, decode_group, frame_size
+
+if __package__ not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(__package__)
+
+
+class Serial(protocol_loop.Serial):
+    """
+        Loop port whose far end parses the frames written to it and answers like the controller
+    """
+
+    def open(self):
+        self._received = bytearray()
+        self.frames = []
+        super().open()
+        if self._ready:
+            self.say("READY")
+
+    def from_url(self, url):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "device":
+            raise serial.SerialException(f"expected a string in the form \"device://[?ready=0&ack=0]\": {url}")
+        options = {k: v[0] for k, v in urlparse.parse_qs(parts.query, True).items()}
+        unknown = set(options) - {"ready", "ack"}
+        if unknown:
+            raise serial.SerialException(f"unknown options {sorted(unknown)} in {url}")
+        self._ready = options.get("ready", "1") != "0"
+        self._ack = options.get("ack", "1") != "0"
+
+    def say(self, line):
+        """
+        Sends a line from the device to the host
+        :param line:
+        :return: None
+        """
+        super().write(line.encode("ascii") + b"\n")
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        self._received += serial.to_bytes(data)
+        while self._received:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            self.frames.append(frame)
+            if self._ack:
+                self.say(f"ACK {frame['SEQ']}")
+        return len(data)
+
+    def _next_frame(self):
+        # Decodes the first complete frame of the received bytes, None until one is complete
+        buffer = self._received
+        if buffer[0] == MAGIC:
+            if len(buffer) < HEADER.size:
+                return None
+            _, _, flags, _, count = HEADER.unpack_from(buffer)
+            size = frame_size(count, flags & FLAG_CRC)
+            if len(buffer) < size:
+                return None
+            frame = decode_group(bytes(buffer[:size]))
+        else:
+            end = buffer.find(b"\n")
+            if end < 0:
+                return None
+            size = end + 1
+            frame = json.loads(bytes(buffer[:end]))
+        del buffer[:size]
+        return frame
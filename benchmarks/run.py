@@ -0,0 +1,179 @@
+"""
+Benchmark suite of the detection, composition, serialization and serial I/O paths.
+Runs on synthetic frames and a tiny stand-in network, no yolo weights needed:
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --compare bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import benchmarks.protocol_device  # noqa: F401 registers device://, the stand-in controller
+from benchmarks.tiny_model import write_frames, write_tiny_model
+from link import SerialLink
+from processors import generate_img, render_scan
+from services import send_json
+from vc.detector import Group, Image
+from vc.registry import registry
+from wire import encode_group
+
+
+def timed(fn, repeat, warmup=1, setup=None):
+    """
+    Runs fn warmup + repeat times
+    :param fn:
+    :param repeat:
+    :param warmup:
+    :param setup: called (untimed) before every run, e.g. to restore inputs fn modifies
+    :return: samples[]: seconds
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+
+def summarise(samples):
+    ms = np.array(samples) * 1000
+    return {
+        "N": len(samples),
+        "MEAN_MS": float(ms.mean()),
+        "P50_MS": float(np.percentile(ms, 50)),
+        "P95_MS": float(np.percentile(ms, 95)),
+        "MIN_MS": float(ms.min()),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "COMMIT": commit or None,
+        "PYTHON": platform.python_version(),
+        "OPENCV": cv2.__version__,
+        "NUMPY": np.__version__,
+        "MACHINE": platform.machine(),
+        "CPUS": os.cpu_count(),
+    }
+
+
+def run_benchmarks(repeat=20, lanes=4, size=64, workdir=None):
+    """
+    Runs every benchmark
+    :param repeat: timed runs per benchmark
+    :param lanes: synthetic frames per group
+    :param size: input size of the stand-in network
+    :param workdir: where the model and frames are written (temporary directory by default, removed afterwards)
+    :return: results: dict
+    """
+    if workdir is None:
+        with tempfile.TemporaryDirectory(prefix="vc_bench_") as workdir:
+            return run_benchmarks(repeat=repeat, lanes=lanes, size=size, workdir=workdir)
+    weights, cfg = write_tiny_model(os.path.join(workdir, "model"), size=size)
+    paths = write_frames(os.path.join(workdir, "frames"), count=lanes)
+    detector = registry.get_detector(weights=weights, cfg=cfg, size=(size, size))
+
+    group = Group("bench", detector=detector)
+    for path in paths:
+        Image(path, group)
+    images = group.get_images()
+    # Copies, the images themselves get drawn on
+    frames = [img.get_img().copy() for img in images]
+    data = group.serialise()
+
+    def restore_images():
+        # render_scan draws on the images, every run starts from the pristine frames
+        for img, frame in zip(images, frames):
+            np.copyto(img.get_img(), frame)
+
+    def image_construction():
+        g = Group("bench", detector=detector)
+        for p in paths:
+            Image(p, g)
+
+    benchmarks = {
+        "image_construction": image_construction,
+        "detect_vehicles": lambda: detector.detect_vehicles(frames[0]),
+        "detect_vehicles_batch": lambda: detector.detect_vehicles_batch(frames),
+        "group_sort": lambda: group.sort(reverse=True),
+        "render_scan": lambda: render_scan(images[0], images),
+        "generate_img": lambda: generate_img(images, len(images) // 2),
+        "group_serialise": group.serialise,
+        "encode_binary": lambda: encode_group(data),
+    }
+    setups = {"render_scan": restore_images}
+    results = {}
+    # The processors print their progress, kept off the terminal while timing
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, fn in benchmarks.items():
+            results[name] = summarise(timed(fn, repeat, setup=setups.get(name)))
+        link = SerialLink.open("device://", ack_timeout=1.0)
+        try:
+            results["send_json_loopback"] = summarise(timed(lambda: send_json(link, data, read=True), repeat))
+        finally:
+            link.close()
+    return {"ENVIRONMENT": environment(), "PARAMS": {"REPEAT": repeat, "LANES": lanes, "SIZE": size},
+            "RESULTS": results}
+
+
+def compare(previous, current):
+    """
+    Prints the mean time of every benchmark against a previous run
+    :param previous: results dict of an earlier run
+    :param current:
+    :return: None
+    """
+    print(f"{'benchmark':<24}{'before ms':>12}{'after ms':>12}{'ratio':>8}")
+    for name, result in current["RESULTS"].items():
+        before = previous["RESULTS"].get(name)
+        if before is None:
+            print(f"{name:<24}{'-':>12}{result['MEAN_MS']:>12.3f}{'-':>8}")
+            continue
+        ratio = result["MEAN_MS"] / before["MEAN_MS"] if before["MEAN_MS"] else float("nan")
+        print(f"{name:<24}{before['MEAN_MS']:>12.3f}{result['MEAN_MS']:>12.3f}{ratio:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--lanes", type=int, default=4)
+    parser.add_argument("--size", type=int, default=64, help="input size of the stand-in network")
+    parser.add_argument("--output", help="writes the results to this json file (stdout otherwise)")
+    parser.add_argument("--compare", help="results json of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(repeat=args.repeat, lanes=args.lanes, size=args.size)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
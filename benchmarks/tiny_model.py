@@ -0,0 +1,87 @@
+import os.path
+
+import numpy as np
+
+# A two layer yolo network with the coco head (80 classes), small enough to run anywhere.
+# Its detections are meaningless but it exercises the same code paths as yolov4.
+TINY_CFG = """[net]
+batch=1
+width={size}
+height={size}
+channels=3
+
+[convolutional]
+batch_normalize=0
+filters=8
+size=3
+stride=2
+pad=1
+activation=leaky
+
+[convolutional]
+batch_normalize=0
+filters=255
+size=1
+stride=1
+pad=1
+activation=linear
+
+[yolo]
+mask=0,1,2
+anchors=10,13,16,30,33,23
+classes=80
+num=3
+"""
+
+# (input channels, filters, kernel size) of the convolutions above
+LAYERS = [(3, 8, 3), (8, 255, 1)]
+
+
+def write_tiny_model(directory, size=64, seed=0):
+    """
+    Writes tiny.cfg and tiny.weights (darknet format) to directory
+    :param directory:
+    :param size: network input size
+    :param seed:
+    :return: weights, cfg: paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    cfg = os.path.join(directory, "tiny.cfg")
+    weights = os.path.join(directory, "tiny.weights")
+    with open(cfg, "w") as f:
+        f.write(TINY_CFG.format(size=size))
+    rng = np.random.default_rng(seed)
+    with open(weights, "wb") as f:
+        # major, minor, revision, images seen
+        np.array([0, 2, 0], dtype=np.int32).tofile(f)
+        np.array([0], dtype=np.int64).tofile(f)
+        for c_in, filters, k in LAYERS:
+            rng.standard_normal(filters).astype(np.float32).tofile(f)  # biases
+            (rng.standard_normal(filters * c_in * k * k) * 0.5).astype(np.float32).tofile(f)
+    return weights, cfg
+
+
+def write_frames(directory, count=4, shape=(720, 1280, 3), seed=0):
+    """
+    Writes count synthetic lane frames (lane_1.jpg ...) to directory
+    :param directory:
+    :param count:
+    :param shape:
+    :param seed:
+    :return: paths[]
+    """
+    import cv2
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        img = rng.integers(0, 255, shape, dtype=np.uint8)
+        # A few solid "vehicles" so the frames aren't pure noise
+        for _ in range(5 + i):
+            x, y = int(rng.integers(0, shape[1] - 200)), int(rng.integers(0, shape[0] - 100))
+            cv2.rectangle(img, (x, y), (x + 200, y + 100), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        path = os.path.join(directory, f"lane_{i + 1}.jpg")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
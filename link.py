@@ -0,0 +1,435 @@
+import json
+import queue
+import sys
+import threading
+import time
+
+import serial
+
+from vc.metrics import metrics
+from wire import encode_group
+
+FORMATS = ("json", "binary")
+# Lines understood by the link, everything else is handed to the line handlers
+READY = "READY"
+ACK = "ACK"
+
+
+def encode_frame(seq, data: dict):
+    """
+    Newline delimited frame: the payload json with its sequence number
+    :param seq:
+    :param data:
+    :return: frame: bytes
+    """
+    return json.dumps(dict(data, SEQ=seq), separators=(",", ":")).encode("ascii") + b"\n"
+
+
+def parse_ack(line):
+    """
+    Returns the sequence number acknowledged by a line ("ACK <seq>")
+    :param line:
+    :return: seq: int or None
+    """
+    if line.startswith(ACK + " "):
+        try:
+            return int(line[len(ACK) + 1:])
+        except ValueError:
+            return None
+    return None
+
+
+class SerialLink:
+    """
+        Framed, acknowledged link to the microcontroller.
+        Frames are newline delimited json carrying a SEQ number, the device answers "ACK <seq>".
+        The device announces itself with a "READY" line once its setup ran (replaces the fixed sleeps),
+        a reader thread blocks on readline and dispatches lines as they arrive.
+    """
+
+    def __init__(self, connection: serial.Serial, ack_timeout=1.0, on_line=None, fmt="json", crc=True):
+        """
+        :param connection: opened serial port (serial.Serial or serial.serial_for_url)
+        :param ack_timeout: seconds to wait for an acknowledgement
+        :param on_line: callable receiving every other line sent by the device
+        :param fmt: json (newline delimited) | binary (wire.encode_group, seq wraps at 256)
+        :param crc: appends a crc16 to binary frames
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown link format {fmt}, expected one of {FORMATS}")
+        self.connection = connection
+        self.ack_timeout = ack_timeout
+        self.fmt = fmt
+        self.crc = crc
+        self._handlers = [on_line] if on_line is not None else []
+        self._ready = threading.Event()
+        self._closed = threading.Event()
+        self._write_lock = threading.Lock()
+        self._pending = {}
+        self._seq = 0
+        self.last_rtt = None
+        self._reader = threading.Thread(target=self._read_loop, name="serial-reader", daemon=True)
+
+    @classmethod
+    def open(cls, port, baudrate=9600, ack_timeout=1.0, on_line=None, fmt="json", crc=True):
+        """
+        Opens the port (a device path or any pyserial url such as loop://) and starts the reader
+        :param port:
+        :param baudrate:
+        :param ack_timeout:
+        :param on_line:
+        :param fmt:
+        :param crc:
+        :return: link: SerialLink
+        """
+        # Short read timeout, the reader thread only uses it to notice close()
+        connection = serial.serial_for_url(port, baudrate=baudrate, timeout=0.1, parity=serial.PARITY_NONE,
+                                           bytesize=serial.EIGHTBITS, stopbits=serial.STOPBITS_ONE)
+        return cls(connection, ack_timeout=ack_timeout, on_line=on_line, fmt=fmt, crc=crc).start()
+
+    def add_handler(self, on_line):
+        self._handlers.append(on_line)
+
+    def start(self):
+        self._reader.start()
+        return self
+
+    def handshake(self, timeout=3.0):
+        """
+        Waits for the device's READY line
+        :param timeout:
+        :return: ready: bool
+        """
+        return self._ready.wait(timeout)
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def is_open(self):
+        return not self._closed.is_set() and self.connection.is_open
+
+    def send(self, data: dict, wait_ack=True):
+        """
+        Sends a frame and optionally waits for its acknowledgement
+        :param data:
+        :param wait_ack:
+        :return: seq: int, acked: bool
+        """
+        with self._write_lock:
+            self._seq += 1
+            seq = self._seq
+            if self.fmt == "binary":
+                # The device acknowledges the 8 bit sequence number carried by the frame
+                seq &= 0xFF
+                frame = encode_group(data, seq=seq, crc=self.crc)
+            else:
+                frame = encode_frame(seq, data)
+            event = threading.Event()
+            if wait_ack:
+                # Registered before writing, the acknowledgement may arrive right away
+                self._pending[seq] = (event, time.perf_counter())
+            try:
+                with metrics.span("send"):
+                    self.connection.write(frame)
+                    self.connection.flush()
+            except Exception:
+                self._pending.pop(seq, None)
+                raise
+        if not wait_ack:
+            return seq, False
+        acked = event.wait(self.ack_timeout)
+        self._pending.pop(seq, None)
+        return seq, acked
+
+    def wait_closed(self, timeout=None):
+        return self._closed.wait(timeout)
+
+    def close(self):
+        self._closed.set()
+        if self._reader.is_alive() and self._reader is not threading.current_thread():
+            self._reader.join(1.0)
+        self.connection.close()
+
+    def _read_loop(self):
+        while not self._closed.is_set():
+            try:
+                raw = self.connection.read(1)
+                if raw:
+                    raw += self.connection.readline()
+            except (serial.SerialException, OSError, TypeError) as e:
+                if not self._closed.is_set():
+                    sys.stderr.write(f"{e}\n")
+                    self._closed.set()
+                break
+            if raw:
+                self._dispatch(raw.decode("utf-8", errors="replace").strip())
+
+    def _acknowledge(self, seq):
+        pending = self._pending.get(seq)
+        if pending is not None:
+            event, sent = pending
+            self.last_rtt = time.perf_counter() - sent
+            event.set()
+
+    def _dispatch(self, line):
+        if not line:
+            return
+        if line == READY:
+            self._ready.set()
+            return
+        seq = parse_ack(line)
+        if seq is not None:
+            self._acknowledge(seq)
+            return
+        for handler in self._handlers:
+            try:
+                handler(line)
+            except Exception as e:
+                # A failing handler must not stop the reader
+                sys.stderr.write(f"{e}\n")
+
+
+class LinkManager:
+    """
+        Long-lived owner of a serial port: every group sends through its queue, a single writer thread
+        keeps the link open, reconnects with exponential backoff and measures the round trip of each frame
+    """
+
+    def __init__(self, port, baudrate=9600, ack_timeout=1.0, handshake_timeout=3.0, wait_ack=True,
+                 backoff=0.5, max_backoff=30.0, queue_size=64, fmt="json", crc=True, max_retries=5):
+        """
+        :param port:
+        :param baudrate:
+        :param ack_timeout:
+        :param handshake_timeout: seconds to wait for READY after each (re)connect
+        :param wait_ack: waits for the acknowledgement of every frame before sending the next one
+        :param backoff: first reconnect delay, doubled on each failure up to max_backoff
+        :param max_backoff:
+        :param queue_size: capacity of the send queue, send blocks when full
+        :param fmt: wire format, see SerialLink
+        :param crc:
+        :param max_retries: failed attempts after which a frame is dropped (counted as failed), None retries forever
+        """
+        self.port = port
+        self.fmt = fmt
+        self.crc = crc
+        self.baudrate = baudrate
+        self.ack_timeout = ack_timeout
+        self.handshake_timeout = handshake_timeout
+        self.wait_ack = wait_ack
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._handlers = []
+        self._link = None
+        self._connect_lock = threading.Lock()
+        self._closed = threading.Event()
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.reconnects = 0
+        self._rtt_total = 0.0
+        self._writer = threading.Thread(target=self._write_loop, name=f"link-{port}", daemon=True)
+        self._writer.start()
+
+    def __repr__(self):
+        return repr((self.port, self._queue.qsize(), self.sent))
+
+    def add_handler(self, on_line):
+        self._handlers.append(on_line)
+
+    def remove_handler(self, on_line):
+        if on_line in self._handlers:
+            self._handlers.remove(on_line)
+
+    def send(self, data: dict, block=True, timeout=None):
+        """
+        Queues data for the device
+        :param data:
+        :param block:
+        :param timeout:
+        :return: None
+        """
+        if self._closed.is_set():
+            raise ValueError(f"Link manager for {self.port} is closed")
+        self._queue.put(data, block=block, timeout=timeout)
+
+    def connect(self):
+        """
+        Opens the port (and waits for READY) ahead of the first frame, a failure is retried on the next send
+        :return: connected: bool
+        """
+        try:
+            self._connect()
+            return True
+        except (serial.SerialException, OSError) as e:
+            sys.stderr.write(f"{self.port}: {e}\n")
+            return False
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every queued frame has been handled, or the timeout
+        :param timeout: seconds, None waits as long as needed
+        :return: flushed: bool
+        """
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def close(self, flush=True, timeout=10.0):
+        """
+        Stops the writer (after sending the queued frames when flush is set) and closes the port.
+        Always returns: frames still queued after timeout seconds are dropped and counted as failed
+        :param flush:
+        :param timeout: seconds given to the flush
+        :return: None
+        """
+        if flush and self._writer.is_alive():
+            self.flush(timeout)
+        self._closed.set()
+        # The writer gives up the frame it is retrying, the ones behind it are dropped here
+        while True:
+            try:
+                data = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if data is not None:
+                self.failed += 1
+            self._queue.task_done()
+        self._queue.put(None)
+        self._writer.join(self.ack_timeout + 1.0)
+        if self._link is not None:
+            self._link.close()
+
+    def stats(self):
+        """
+        Returns the queue depth, counters and round trip latency of the link
+        :return: stats: dict
+        """
+        link = self._link
+        return {
+            "PORT": self.port,
+            "CONNECTED": link is not None and link.is_open(),
+            "QUEUE_DEPTH": self._queue.qsize(),
+            "SENT": self.sent,
+            "ACKED": self.acked,
+            "FAILED": self.failed,
+            "RECONNECTS": self.reconnects,
+            "RTT_LAST": None if link is None else link.last_rtt,
+            "RTT_MEAN": self._rtt_total / self.acked if self.acked else None,
+        }
+
+    def _dispatch(self, line):
+        for handler in list(self._handlers):
+            handler(line)
+
+    def _connect(self):
+        # The writer and connect() may both open the port
+        with self._connect_lock:
+            if self._link is not None and self._link.is_open():
+                return self._link
+            if self._link is not None:
+                # Closed by the reader after an I/O error
+                self._link.close()
+                self.reconnects += 1
+            self._link = None
+            link = SerialLink.open(self.port, baudrate=self.baudrate, ack_timeout=self.ack_timeout,
+                                   on_line=self._dispatch, fmt=self.fmt, crc=self.crc)
+            if not link.handshake(self.handshake_timeout):
+                sys.stderr.write(f"No READY from {self.port}, sending anyway\n")
+            self._link = link
+            return link
+
+    def _write_loop(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                self._queue.task_done()
+                break
+            try:
+                if not self._deliver(data):
+                    self.failed += 1
+            except Exception as e:
+                # A frame that cannot be sent (e.g. not encodable) is dropped, the writer keeps serving
+                sys.stderr.write(f"{self.port}: dropping frame, {type(e).__name__}: {e}\n")
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, data):
+        # Sends a frame, reconnecting on I/O errors until max_retries or close()
+        delay, attempts = self.backoff, 0
+        while not self._closed.is_set() and (self.max_retries is None or attempts <= self.max_retries):
+            try:
+                link = self._connect()
+                _, acked = link.send(data, wait_ack=self.wait_ack)
+                self.sent += 1
+                if acked:
+                    self.acked += 1
+                    self._rtt_total += link.last_rtt or 0.0
+                return True
+            except (serial.SerialException, OSError) as e:
+                sys.stderr.write(f"{self.port}: {e}, reconnecting in {delay}s\n")
+                if self._link is not None:
+                    self._link.close()
+                    self._link = None
+                self.reconnects += 1
+                attempts += 1
+                self._closed.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+        return False
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(port, **kwargs):
+    """
+    Returns the process wide manager of a port, creating it on first use
+    :param port:
+    :param kwargs: LinkManager arguments (used on creation only)
+    :return: manager: LinkManager
+    """
+    with _managers_lock:
+        manager = _managers.get(port)
+        if manager is None or manager._closed.is_set():
+            manager = LinkManager(port, **kwargs)
+            _managers[port] = manager
+        return manager
+
+
+def find_manager(port):
+    """
+    Returns the open manager of a port without creating one
+    :param port:
+    :return: manager: LinkManager or None
+    """
+    with _managers_lock:
+        manager = _managers.get(port)
+    return None if manager is None or manager._closed.is_set() else manager
+
+
+def manager_from_conf(arduino_conf: dict):
+    """
+    Returns the manager described by the ARDUINO_CONFIGURATION section of conf.json
+    :param arduino_conf:
+    :return: manager: LinkManager
+    """
+    conf = arduino_conf["conf"]
+    return get_manager(conf["port"], baudrate=conf["baudrate"], ack_timeout=conf.get("ack_timeout", 1.0),
+                       handshake_timeout=conf.get("handshake_timeout", 3.0),
+                       fmt=arduino_conf.get("format", "json"), crc=arduino_conf.get("crc", True),
+                       max_retries=conf.get("max_retries", 5))
+
+
+def close_managers():
+    """
+    Flushes and closes every manager
+    :return: None
+    """
+    with _managers_lock:
+        managers = list(_managers.values())
+        _managers.clear()
+    for manager in managers:
+        manager.close()
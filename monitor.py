@@ -0,0 +1,268 @@
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+SINKS = ("files", "memmap")
+# Header of the memmap sink: frame sequence number (doubled, odd while a frame is being written), height, width
+MEMMAP_HEADER = 3
+
+
+def _file_name(window_name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", window_name).strip("_") or "monitor"
+
+
+class MemmapSink:
+    """
+        Keeps the latest frame of a window in a memory mapped file: 3 uint64 (seq, height, width)
+        followed by the pixels, readers poll seq (see read_memmap). seq works as a seqlock: it is odd while
+        the pixels are being overwritten and even (twice the frame count) once they are complete.
+    """
+
+    def __init__(self, path, shape):
+        self.path = path
+        self.shape = tuple(shape)
+        size = MEMMAP_HEADER * 8 + int(np.prod(self.shape))
+        self._map = np.memmap(path, dtype=np.uint8, mode="w+", shape=(size,))
+        self._header = self._map[:MEMMAP_HEADER * 8].view(np.uint64)
+        self._pixels = self._map[MEMMAP_HEADER * 8:].reshape(self.shape)
+        self._header[1:] = self.shape[:2]
+        self.seq = 0
+
+    def write(self, image):
+        if image.shape != self.shape:
+            image = cv2.resize(image, (self.shape[1], self.shape[0]))
+        self._header[0] = 2 * self.seq + 1
+        self._pixels[...] = image
+        self.seq += 1
+        # Written last, a reader seeing the same even value before and after its copy has a whole frame
+        self._header[0] = 2 * self.seq
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        del self._map
+
+
+def read_memmap(path, timeout=1.0):
+    """
+    Reads the latest frame written by a MemmapSink, copied again when the writer replaced it meanwhile
+    :param path:
+    :param timeout: seconds to wait for a frame that is not being written
+    :return: seq: int, image: np.ndarray
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    header = data[:MEMMAP_HEADER * 8].view(np.uint64)
+    height, width = int(header[1]), int(header[2])
+    deadline = time.monotonic() + timeout
+    while True:
+        seq = int(header[0])
+        if not seq % 2:
+            image = np.array(data[MEMMAP_HEADER * 8:]).reshape(height, width, 3)
+            if int(header[0]) == seq:
+                return seq // 2, image
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"No complete frame in {path}")
+        time.sleep(0.001)
+
+
+class Monitor(threading.Thread):
+    """
+        Displays the latest image of every window from its own thread.
+        show() never blocks: images go through a bounded queue that drops the oldest one when full,
+        the monitor keeps the latest image per window and refreshes at most fps times per second.
+        Headless monitors write the images to disk (jpg files or memory mapped buffers) instead.
+    """
+
+    def __init__(self, fps=10.0, queue_size=2, headless=False, output="monitor", sink="files"):
+        """
+        :param fps: refresh rate
+        :param queue_size: images waiting for the monitor, the oldest are dropped
+        :param headless: no window, images are written to output
+        :param output: directory of the headless images
+        :param sink: files (<window>.jpg) | memmap (<window>.rgb, see MemmapSink)
+        """
+        threading.Thread.__init__(self, name="monitor", daemon=True)
+        if sink not in SINKS:
+            raise ValueError(f"Unknown monitor sink {sink}, expected one of {SINKS}")
+        self.fps = fps
+        self.headless = headless
+        self.output = output
+        self.sink = sink
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._latest = {}
+        self._seen = set()
+        self._sinks = {}
+        self._windows = set()
+        self._closed = threading.Event()
+        self._dismissed = threading.Event()
+        self._clear = threading.Event()
+        self.shown = 0
+        self.dropped = 0
+        self.refreshed = 0
+
+    def show(self, window_name, image, copy=True):
+        """
+        Queues an image for a window without waiting for the monitor
+        :param window_name:
+        :param image:
+        :param copy: copies the image (needed when the caller reuses its buffer, e.g. a compositor canvas)
+        :return: None
+        """
+        item = (window_name, image.copy() if copy else image)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+        self.shown += 1
+
+    def clear(self):
+        """
+        Closes every window (from the monitor thread, the only one touching the gui)
+        :return: None
+        """
+        self._clear.set()
+
+    def wait_dismissed(self, timeout=None):
+        """
+        Waits for the user to close the windows (esc), or the timeout
+        :param timeout:
+        :return: dismissed: bool
+        """
+        if self.headless:
+            return True
+        return self._dismissed.wait(timeout)
+
+    def close(self):
+        self._closed.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(1.0 + 1 / self.fps)
+
+    def stats(self):
+        return {"SHOWN": self.shown, "DROPPED": self.dropped, "REFRESHED": self.refreshed,
+                "WINDOWS": sorted(self._seen)}
+
+    def run(self) -> None:
+        period = 1 / self.fps
+        try:
+            while not self._closed.is_set():
+                tick = time.perf_counter()
+                self._drain(period)
+                if self._clear.is_set():
+                    self._clear.clear()
+                    self._latest.clear()
+                    self._destroy()
+                for window_name, image in list(self._latest.items()):
+                    self._refresh(window_name, image)
+                self._latest.clear()
+                if not self.headless:
+                    key = cv2.waitKey(1)
+                    if key == 27:  # esc closes the windows
+                        self._destroy()
+                        self._dismissed.set()
+                # Refreshes at most fps times per second
+                self._closed.wait(max(0.0, period - (time.perf_counter() - tick)))
+            # Images queued before close are still shown
+            self._drain(0)
+            for window_name, image in self._latest.items():
+                self._refresh(window_name, image)
+        except Exception as e:
+            sys.stderr.write(f"{e}\n")  # propagating the error to the standard error handler
+        finally:
+            self._destroy()
+            for sink in self._sinks.values():
+                sink.close()
+
+    def _drain(self, timeout):
+        # Keeps the latest image of every window
+        try:
+            window_name, image = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            self._latest[window_name] = image
+            while True:
+                window_name, image = self._queue.get_nowait()
+                self._latest[window_name] = image
+        except queue.Empty:
+            pass
+
+    def _refresh(self, window_name, image):
+        self.refreshed += 1
+        self._seen.add(window_name)
+        if not self.headless:
+            if window_name not in self._windows:
+                cv2.namedWindow(window_name, cv2.WINDOW_AUTOSIZE)
+                self._windows.add(window_name)
+            cv2.imshow(window_name, image)
+            return
+        os.makedirs(self.output, exist_ok=True)
+        path = os.path.join(self.output, _file_name(window_name))
+        if self.sink == "memmap":
+            sink = self._sinks.get(window_name)
+            if sink is None or sink.shape != image.shape:
+                sink = self._sinks[window_name] = MemmapSink(path + ".rgb", image.shape)
+            sink.write(image)
+        else:
+            # Written aside and renamed, readers never see a partial image
+            cv2.imwrite(path + ".tmp.jpg", image)
+            os.replace(path + ".tmp.jpg", path + ".jpg")
+
+    def _destroy(self):
+        if self._windows:
+            try:
+                cv2.destroyAllWindows()
+            except cv2.error:
+                pass
+            self._windows.clear()
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def start_monitor(**kwargs):
+    """
+    Starts the process wide monitor (settings.display in conf.json), once
+    :param kwargs: Monitor arguments
+    :return: monitor: Monitor
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None or not _monitor.is_alive():
+            _monitor = Monitor(**kwargs)
+            _monitor.start()
+        return _monitor
+
+
+def get_monitor():
+    """
+    Returns the running monitor
+    :return: monitor: Monitor or None
+    """
+    return _monitor
+
+
+def stop_monitor(linger=0.0):
+    """
+    Stops the monitor, after the user closed the windows or linger seconds
+    :param linger:
+    :return: stats: dict or None
+    """
+    global _monitor
+    with _monitor_lock:
+        monitor, _monitor = _monitor, None
+    if monitor is None:
+        return None
+    if linger:
+        monitor.wait_dismissed(linger)
+    monitor.close()
+    return monitor.stats()
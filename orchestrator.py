@@ -0,0 +1,350 @@
+import asyncio
+import inspect
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from link import manager_from_conf
+from vc.detector import read_image
+from vc.history import get_history
+from vc.metrics import metrics
+from vc.registry import get_detector
+from vc.scheduler import LaneScheduler
+from vc.sources import open_source
+
+
+class _Request:
+    __slots__ = ("client", "frames", "lanes", "future", "queued")
+
+    def __init__(self, client, frames, lanes, future):
+        self.client = client
+        self.frames = frames
+        self.lanes = lanes
+        self.future = future
+        self.queued = time.perf_counter()
+
+
+class DetectorPool:
+    """
+        Single inference backend shared by every intersection. Each intersection queues the frames of a cycle
+        as one batch, a dispatcher hands the batches to the inference threads in deficit round robin order:
+        every turn an intersection may send up to quantum * weight frames, so a busy one cannot starve the others.
+    """
+
+    def __init__(self, detector=None, workers=1, quantum=4, nmsThreshold=0.3):
+        """
+        :param detector: VehicleDetector (defaults to the registry's)
+        :param workers: inference threads (the network itself is locked, more threads overlap the blob
+                        preparation and the post processing of other batches)
+        :param quantum: frames an intersection of weight 1 may send per turn
+        :param nmsThreshold:
+        """
+        self.detector = detector if detector is not None else get_detector()
+        self.workers = workers
+        self.quantum = quantum
+        self.nmsThreshold = nmsThreshold
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._queues = {}
+        self._weights = {}
+        self._deficit = {}
+        self._ring = deque()
+        self._stats = {}
+        self._pending = None
+        self._slots = None
+        self._dispatcher = None
+
+    def __repr__(self):
+        return repr((len(self._ring), self.workers, self.quantum))
+
+    def register(self, client, weight=1):
+        """
+        Adds an intersection to the round robin
+        :param client: name
+        :param weight: share of the inference relative to the other intersections, at least 1
+        :return: None
+        """
+        if not weight >= 1:
+            # A weight below 1 may never earn the deficit of a batch, the dispatcher would spin
+            raise ValueError(f"Weight of {client} must be at least 1, got {weight}")
+        if client in self._queues:
+            return
+        self._queues[client] = deque()
+        self._weights[client] = weight
+        self._deficit[client] = 0
+        self._ring.append(client)
+        self._stats[client] = {"REQUESTS": 0, "FRAMES": 0, "WAIT": 0.0}
+
+    async def detect(self, client, frames, lanes=None):
+        """
+        Detects the vehicles of the frames of a cycle, waiting for the turn of the intersection
+        :param client: registered name
+        :param frames:
+        :param lanes: metrics label of every frame
+        :return: [(vehicle_boxes, vehicle_count)]
+        """
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None:
+            self._pending = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._dispatcher = loop.create_task(self._dispatch())
+        request = _Request(client, frames, lanes, loop.create_future())
+        self._queues[client].append(request)
+        self._pending.set()
+        return await request.future
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        Returns the batches, frames and mean queueing time of every intersection
+        :return: stats: dict
+        """
+        return {client: dict(s, WAIT=s["WAIT"] / s["REQUESTS"] if s["REQUESTS"] else 0.0)
+                for client, s in self._stats.items()}
+
+    # Helpers
+    def _next(self):
+        # Deficit round robin, only called while some queue holds a request
+        while True:
+            client = self._ring[0]
+            queue = self._queues[client]
+            if queue and self._deficit[client] >= len(queue[0].frames):
+                self._deficit[client] -= len(queue[0].frames)
+                return queue.popleft()
+            if not queue:
+                self._deficit[client] = 0  # Idle intersections do not save up turns
+            self._ring.rotate(-1)
+            client = self._ring[0]
+            if self._queues[client]:
+                self._deficit[client] += self.quantum * self._weights[client]
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._pending.wait()
+            if not any(self._queues.values()):
+                self._pending.clear()
+                continue
+            await self._slots.acquire()
+            request = self._next()
+            stats = self._stats[request.client]
+            stats["REQUESTS"] += 1
+            stats["FRAMES"] += len(request.frames)
+            stats["WAIT"] += time.perf_counter() - request.queued
+            task = loop.run_in_executor(self._executor, self._run, request)
+            task.add_done_callback(lambda done, r=request: self._done(done, r))
+
+    def _run(self, request):
+        return self.detector.detect_vehicles_batch(request.frames, nmsThreshold=self.nmsThreshold,
+                                                   lanes=request.lanes)
+
+    def _done(self, done, request):
+        self._slots.release()
+        if request.future.cancelled():
+            return
+        if done.exception() is not None:
+            request.future.set_exception(done.exception())
+        else:
+            request.future.set_result(done.result())
+
+
+class Intersection:
+    """
+        Lanes of one intersection: every cycle reads a frame per lane, detects them through the shared pool,
+        picks the green lane with its own scheduler and sends the decision to its own controller
+    """
+
+    def __init__(self, name, sources: dict, pool: DetectorPool, send=None, scheduler=None, weight=1,
+                 interval=0.0, cycles=None, size=(1200, 640)):
+        """
+        :param name:
+        :param sources: lane -> FrameSource
+        :param pool: shared DetectorPool
+        :param send: callable receiving every decision (Group.serialise format)
+        :param scheduler: LaneScheduler arguments
+        :param weight: share of the pool
+        :param interval: minimum seconds between two cycles
+        :param cycles: stops after that many decisions, None runs until a source is exhausted
+        :param size: working resolution of the frames
+        """
+        self.name = name
+        self.sources = sources
+        self.lanes = list(sources)
+        self.pool = pool
+        self.send = send
+        self.scheduler = LaneScheduler(self.lanes, **(scheduler or {}))
+        self.interval = interval
+        self.cycles = cycles
+        self.size = size
+        self.decisions = 0
+        self.latency = 0.0
+        self._iterators = {lane: iter(source) for lane, source in sources.items()}
+        self._locks = {lane: threading.Lock() for lane in sources}
+        pool.register(name, weight)
+
+    def __repr__(self):
+        return repr((self.name, self.lanes, self.decisions))
+
+    @classmethod
+    def from_conf(cls, name, spec: dict, pool, send_to_arduino=False):
+        """
+        Builds an intersection from an INTERSECTIONS entry of conf.json
+        :param name:
+        :param spec: {"streams": {lane: source spec}, "controller": ARDUINO_CONFIGURATION like, "scheduler",
+                     "weight", "interval", "cycles"}
+        :param pool:
+        :param send_to_arduino:
+        :return: intersection: Intersection
+        """
+        send = None
+        if send_to_arduino and spec.get("controller"):
+            # Every intersection has its own port, hence its own long-lived manager
+            send = manager_from_conf(spec["controller"]).send
+        return cls(name, {lane: open_source(lane, source) for lane, source in spec["streams"].items()}, pool,
+                   send=send, scheduler=spec.get("scheduler"), weight=spec.get("weight", 1),
+                   interval=spec.get("interval", 0.0), cycles=spec.get("cycles"))
+
+    async def run(self):
+        """
+        Runs cycles until a source is exhausted, cycles decisions were made or the task is cancelled
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while self.cycles is None or self.decisions < self.cycles:
+                start = loop.time()
+                if await self.cycle() is None:
+                    break
+                await asyncio.sleep(max(0.0, self.interval - (loop.time() - start)))
+        finally:
+            for lane, source in self.sources.items():
+                source.close()
+                # Waits for a read still running in the executor, then releases the capture
+                with self._locks[lane]:
+                    iterator = self._iterators[lane]
+                    if inspect.getgeneratorstate(iterator) == inspect.GEN_CREATED:
+                        source._release()  # Never read, closing the generator does not run its body
+                    iterator.close()
+
+    async def cycle(self):
+        """
+        Reads, decodes and detects a frame per lane, then decides
+        :return: decision: dict or None when a source is exhausted
+        """
+        loop = asyncio.get_running_loop()
+        t = time.perf_counter()
+        # Sources and decoding block, they run in the default executor, the lanes concurrently
+        frames = await asyncio.gather(*(loop.run_in_executor(None, self._read, lane) for lane in self.lanes))
+        if any(frame is None for frame in frames):
+            return None
+        results = await self.pool.detect(self.name, [frame.img for frame in frames], lanes=self.lanes)
+        for frame, (boxes, count) in zip(frames, results):
+            frame.vehicle_boxes, frame.vehicle_count = boxes, count
+            self.scheduler.update(frame.lane, count)
+        self.scheduler.decide()
+        latest = dict(zip(self.lanes, frames))
+        decision = {
+            "DATA": [
+                {
+                    "PATH": latest[lane].name,
+                    "VEHICLE_COUNT": latest[lane].vehicle_count,
+                    "INDEX": self.lanes.index(lane),
+                    "POSITION": position,
+                } for position, lane in enumerate(self.scheduler.ranking())
+            ],
+            "COUNT": len(self.lanes),
+        }
+        history = get_history()
+        if history is not None:
+            now = time.time()
+            history.append(self.name, decision, lanes=self.lanes, timestamp=now,
+                           latencies=[now - frame.timestamp for frame in frames], since=t)
+        if self.send is not None:
+            # The manager's queue may be full, the loop never waits on a serial port
+            await loop.run_in_executor(None, self.send, decision)
+        self.decisions += 1
+        self.latency += time.perf_counter() - t
+        return decision
+
+    def stats(self):
+        return {
+            "DECISIONS": self.decisions,
+            "CYCLE_TIME": self.latency / self.decisions if self.decisions else None,
+            "SCHEDULER": self.scheduler.stats(),
+        }
+
+    def _read(self, lane):
+        with self._locks[lane]:
+            frame = next(self._iterators[lane], None)
+        if frame is None:
+            return None
+        with metrics.span("decode", lane):
+            if frame.img is None:
+                frame.img = read_image(frame.path, self.size)
+            if frame.img is not None and frame.img.shape[1::-1] != self.size:
+                frame.img = cv2.resize(frame.img, self.size)
+        return frame if frame.img is not None else None
+
+
+class Orchestrator:
+    """
+        Runs every intersection of the site concurrently on one event loop, sharing a single DetectorPool
+    """
+
+    def __init__(self, intersections, pool: DetectorPool):
+        self.intersections = intersections
+        self.pool = pool
+
+    @classmethod
+    def from_conf(cls, conf: dict, send_to_arduino=False, detector=None):
+        """
+        Builds the orchestrator of the INTERSECTIONS section, settings.pool sets up the DetectorPool
+        :param conf:
+        :param send_to_arduino:
+        :param detector:
+        :return: orchestrator: Orchestrator
+        """
+        pool = DetectorPool(detector, **conf["settings"].get("pool", {}))
+        return cls([Intersection.from_conf(name, spec, pool, send_to_arduino=send_to_arduino)
+                    for name, spec in conf["INTERSECTIONS"].items()], pool)
+
+    async def serve(self):
+        """
+        Runs the intersections until they all stop, a failing intersection does not stop the others
+        :return: None
+        """
+        try:
+            results = await asyncio.gather(*(i.run() for i in self.intersections), return_exceptions=True)
+            for intersection, result in zip(self.intersections, results):
+                if isinstance(result, Exception):
+                    sys.stderr.write(f"{intersection.name}: {result}\n")
+        finally:
+            await self.pool.close()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    def stats(self):
+        """
+        Returns the decisions of every intersection and its share of the pool
+        :return: stats: dict
+        """
+        return {
+            "INTERSECTIONS": {i.name: i.stats() for i in self.intersections},
+            "POOL": self.pool.stats(),
+        }
@@ -0,0 +1,300 @@
+import queue
+import sys
+import threading
+import time
+from functools import partial
+
+import cv2
+
+from vc.compositor import Compositor, grid
+from vc.detector import read_image
+from vc.gate import FrameGate
+from vc.history import get_history
+from vc.metrics import metrics
+from vc.registry import get_detector
+from vc.scheduler import LaneScheduler
+from vc.sources import open_source
+from vc.tracker import LaneTracker
+
+# Marks the end of the stream on every queue
+STOP = object()
+
+
+class LaneEnd:
+    """
+        Marks the end of a lane's source, travels behind its last frame
+    """
+    __slots__ = ("lane",)
+
+    def __init__(self, lane):
+        self.lane = lane
+
+    def __repr__(self):
+        return repr(("LaneEnd", self.lane))
+
+
+class Stage(threading.Thread):
+    """
+        A pipeline stage: takes items from inbox, applies fn and puts the results in outbox.
+        fn may return None to drop an item, outbox.put blocks when full which gives backpressure upstream.
+        LaneEnd markers are handed to on_end when given, else passed on.
+    """
+
+    def __init__(self, name, fn, inbox: queue.Queue, outbox: queue.Queue = None, on_end=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_end = on_end
+        self.processed = 0
+        self.dropped = 0
+
+    def run(self) -> None:
+        while True:
+            item = self.inbox.get()
+            if item is STOP:
+                if self.outbox is not None:
+                    self.outbox.put(STOP)
+                break
+            if isinstance(item, LaneEnd) and self.on_end is None:
+                if self.outbox is not None:
+                    self.outbox.put(item)
+                continue
+            try:
+                result = self.on_end(item.lane) if isinstance(item, LaneEnd) else self.fn(item)
+            except Exception as e:
+                sys.stderr.write(f"{self.name}: {e}\n")
+                self.dropped += 1
+                continue
+            self.processed += 1
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+
+class Pipeline:
+    """
+        Continuous per lane pipeline: source -> decode -> resize -> detect -> decide -> send
+    """
+
+    def __init__(self, sources: dict, detector=None, send=None, queue_size=4, size=(1200, 640), gate=None,
+                 scheduler=None, monitor=None, tracker=None, stall=None):
+        """
+        :param sources: lane -> FrameSource
+        :param detector: VehicleDetector (defaults to the registry's)
+        :param send: callable receiving every decision (Group.serialise format)
+        :param queue_size: capacity of every inter-stage queue
+        :param size: working resolution of the frames
+        :param gate: FrameGate arguments ({"threshold": ..., "max_skips": ...}), None detects every frame
+        :param scheduler: LaneScheduler arguments ({"min_green": ..., "max_wait": ...})
+        :param monitor: Monitor receiving the mosaic of the lanes after every decision
+        :param tracker: LaneTracker arguments ({"keyframe_interval": ..., "line": ...}), None detects every frame
+        :param stall: seconds a new frame waits for the other lanes before deciding without them,
+                      None waits for every lane whose source is still running
+        """
+        self.sources = sources
+        self.lanes = list(sources)
+        self.detector = detector if detector is not None else get_detector()
+        self.send = send
+        self.size = size
+        self.gates = {lane: FrameGate(**gate) for lane in sources} if gate is not None else {}
+        self.trackers = {lane: LaneTracker(**tracker) for lane in sources} if tracker is not None else {}
+        self.scheduler = LaneScheduler(self.lanes, **(scheduler or {}))
+        self.monitor = monitor
+        self.stall = stall
+        self._compositor = Compositor(rows=grid(len(self.lanes))) if monitor is not None else None
+        self._latest = {}
+        self._signals = {}  # lane -> queue length and flow rate of its tracker
+        self._decided = set()
+        self._waiting_since = None  # time.monotonic() of the oldest frame not decided on yet
+        self._live = set(self.lanes)  # lanes whose source is not exhausted
+        self.decisions = 0
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(5)]
+        q_decode, q_resize, q_detect, q_decide, q_send = self._queues
+        self._stages = [
+            Stage("decode", self.decode, q_decode, q_resize),
+            Stage("resize", self.resize, q_resize, q_detect),
+            Stage("detect", self.detect, q_detect, q_decide),
+            Stage("decide", self.decide, q_decide, q_send, on_end=self.lane_ended),
+            Stage("send", self._send, q_send),
+        ]
+        self._feeders = [threading.Thread(target=self._feed, args=(lane, source), name=f"source-{lane}", daemon=True)
+                         for lane, source in sources.items()]
+        self._closer = threading.Thread(target=self._close_when_exhausted, name="source-closer", daemon=True)
+
+    @classmethod
+    def from_conf(cls, streams: dict, detector=None, send=None, queue_size=4, gate=None, scheduler=None,
+                  monitor=None, tracker=None, stall=None):
+        """
+        Builds a pipeline from the STREAMS section of conf.json
+        :param streams: lane -> source spec
+        :param detector:
+        :param send:
+        :param queue_size:
+        :param gate:
+        :param scheduler:
+        :param monitor:
+        :param tracker:
+        :param stall:
+        :return: pipeline: Pipeline
+        """
+        return cls({lane: open_source(lane, spec) for lane, spec in streams.items()},
+                   detector=detector, send=send, queue_size=queue_size, gate=gate, scheduler=scheduler,
+                   monitor=monitor, tracker=tracker, stall=stall)
+
+    # Stages
+    def decode(self, frame):
+        if frame.img is None:
+            with metrics.span("decode", frame.lane):
+                # Large JPEGs are decoded at a reduced scale, still at least the working resolution
+                frame.img = read_image(frame.path, self.size)
+        return frame if frame.img is not None else None
+
+    def resize(self, frame):
+        if frame.img.shape[1::-1] != self.size:
+            with metrics.span("resize", frame.lane):
+                frame.img = cv2.resize(frame.img, self.size)
+        return frame
+
+    def detect(self, frame):
+        gate = self.gates.get(frame.lane)
+        if gate is None:
+            detect = partial(self.detector.detect_vehicles, lane=frame.lane)
+        else:
+            detect = partial(gate.detect, self.detector, lane=frame.lane)
+        tracker = self.trackers.get(frame.lane)
+        if tracker is None:
+            frame.vehicle_boxes, frame.vehicle_count = detect(frame.img)
+        else:
+            # The network only sees the keyframes, the tracks carry the boxes in between
+            with metrics.span("track", frame.lane):
+                frame.vehicle_boxes, frame.vehicle_count = tracker.update(detect, frame.img, frame.timestamp)
+                # Read here, the tracker belongs to this stage's thread
+                self._signals[frame.lane] = {"QUEUE_LENGTH": tracker.queue_length(),
+                                             "FLOW_RATE": tracker.flow_rate()}
+        return frame
+
+    def decide(self, frame):
+        """
+        Feeds the count to the scheduler and emits a decision once every running lane reported a new frame
+        (or the oldest new frame waited stall seconds), the green lane first (POSITION 0) and the others by count.
+        Lanes without a new frame are listed with their last one.
+        :param frame:
+        :return: decision: dict or None
+        """
+        self._latest[frame.lane] = frame
+        self.scheduler.update(frame.lane, frame.vehicle_count)
+        if not self._decided:
+            self._waiting_since = time.monotonic()
+        self._decided.add(frame.lane)
+        return self._decide_if_ready()
+
+    def lane_ended(self, lane):
+        """
+        Stops waiting for a lane whose source is exhausted, its last frame still counts
+        :param lane:
+        :return: decision: dict or None when the other lanes have no new frame either
+        """
+        self._live.discard(lane)
+        return self._decide_if_ready()
+
+    def _decide_if_ready(self):
+        if not self._decided:
+            return None
+        if not self._live <= self._decided and (
+                self.stall is None or time.monotonic() - self._waiting_since < self.stall):
+            return None
+        self._decided.clear()
+        self.scheduler.decide()
+        # Lanes that never delivered a frame are left out
+        ranked = [self._latest[lane] for lane in self.scheduler.ranking() if lane in self._latest]
+        self.decisions += 1
+        if self.monitor is not None:
+            # Only the lanes with a new frame are redrawn
+            with metrics.span("compose"):
+                for i, lane in enumerate(self.lanes):
+                    if lane in self._latest:
+                        self._compositor.draw(i, self._latest[lane].img, self._latest[lane].seq)
+            self.monitor.show("__Vehicle Detection Stream__", self._compositor.canvas)
+        data = [
+            {
+                "PATH": f.name,
+                "VEHICLE_COUNT": f.vehicle_count,
+                "INDEX": self.lanes.index(f.lane),
+                "POSITION": position,
+            } for position, f in enumerate(ranked)
+        ]
+        for lane in data:
+            lane.update(self._signals.get(self.lanes[lane["INDEX"]], {}))
+        decision = {"DATA": data, "COUNT": len(ranked)}
+        history = get_history()
+        if history is not None:
+            now = time.time()
+            latencies = {d["INDEX"]: now - f.timestamp for d, f in zip(data, ranked)}
+            # Spans of the frames being decided on, started at most the oldest latency ago
+            history.append("stream", decision, lanes=self.lanes, timestamp=now, latencies=latencies,
+                           since=time.perf_counter() - max(latencies.values()))
+        return decision
+
+    def _send(self, decision):
+        if self.send is not None:
+            self.send(decision)
+
+    # Lifecycle
+    def _feed(self, lane, source):
+        try:
+            for frame in source:
+                self._queues[0].put(frame)
+        finally:
+            # Behind the lane's last frame, the decide stage stops waiting for it
+            self._queues[0].put(LaneEnd(lane))
+
+    def _close_when_exhausted(self):
+        for feeder in self._feeders:
+            feeder.join()
+        self._queues[0].put(STOP)
+
+    def start(self):
+        for stage in self._stages:
+            stage.start()
+        for feeder in self._feeders:
+            feeder.start()
+        self._closer.start()
+        return self
+
+    def stop(self):
+        """
+        Closes every source, the pipeline drains and stops
+        :return: None
+        """
+        for source in self.sources.values():
+            source.close()
+
+    def join(self, timeout=None):
+        self._stages[-1].join(timeout)
+
+    def run(self):
+        """
+        Runs the pipeline until every source is exhausted (or stop is called)
+        :return: None
+        """
+        self.start()
+        try:
+            while self._stages[-1].is_alive():
+                self.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+
+    def stats(self):
+        """
+        Returns processed/dropped frames per stage and the current queue depths
+        :return: stats: dict
+        """
+        return {
+            "STAGES": {s.name: {"PROCESSED": s.processed, "DROPPED": s.dropped} for s in self._stages},
+            "QUEUES": [q.qsize() for q in self._queues],
+            "DECISIONS": self.decisions,
+            "GATES": {lane: gate.stats() for lane, gate in self.gates.items()},
+            "TRACKERS": {lane: tracker.stats() for lane, tracker in self.trackers.items()},
+            "SCHEDULER": self.scheduler.stats(),
+        }
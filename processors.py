@@ -1,55 +1,197 @@
-import datetime
+import atexit
 import glob
+import multiprocessing
+import os.path
 import pathlib
 import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List
 
 import cv2
-import numpy as np
 
-from vc.detector import Image, Group, print_timestamp
+from vc.detector import Image, Group, load_frame
+from vc.metrics import metrics
+from vc.cache import configure_cache, get_cache
+from vc.compositor import get_compositor
+from vc.registry import get_detector
+from vc.ringbuffer import FrameRing
+
+EXECUTION_MODES = ("serial", "thread", "process")
+
+_executors = {}
+_executors_lock = threading.Lock()
+_rings = {}
+_worker_detector = None
+_worker_rings = {}
+
+
+def _init_worker(params, cache_conf=None, thresholds=None):
+    """
+    Preloads the detector once per inference worker process
+    :param params:
+    :param cache_conf: (path, max_entries) of the parent's detection cache
+    :param thresholds: class thresholds of the parent's detector
+    :return: None
+    """
+    global _worker_detector
+    if cache_conf is not None:
+        configure_cache(*cache_conf)
+    _worker_detector = get_detector(**params)
+    if thresholds is not None:
+        _worker_detector.set_thresholds(thresholds)
+
+
+def _detect_in_worker(img, roi=None):
+    if roi is not None:
+        return roi.detect(_worker_detector, img)
+    return _worker_detector.detect_vehicles(img)
+
+
+def _detect_slot_in_worker(ring_name, seq, roi=None):
+    # The frame is read in place from the parent's ring, only the detection is pickled back
+    ring = _worker_rings.get(ring_name)
+    if ring is None:
+        ring = _worker_rings[ring_name] = FrameRing.attach(ring_name)
+    return _detect_in_worker(ring.view(seq), roi)
+
+
+def get_ring(shape, capacity):
+    """
+    Returns the frame ring of the calling thread (a ring has a single writer), kept for the process lifetime
+    so that workers attach it once
+    :param shape: frame shape
+    :param capacity:
+    :return: ring: FrameRing
+    """
+    key = (threading.get_ident(), tuple(shape), capacity)
+    with _executors_lock:
+        ring = _rings.get(key)
+        if ring is None:
+            ring = _rings[key] = FrameRing.create(capacity=capacity, shape=shape, readers=1)
+            atexit.register(ring.close)
+        return ring
+
+
+def detect_in_processes(executor, frames, rois, workers):
+    """
+    Detects frames in worker processes, handing them over through a shared memory ring (see vc.ringbuffer)
+    instead of pickling every frame, at most 2 frames per worker are in flight
+    :param executor: process pool (see get_executor)
+    :param frames: frames of the same shape
+    :param rois: Roi or None of every frame
+    :param workers:
+    :return: detections[]: in the order of the frames
+    """
+    if not frames:
+        return []
+    ring = get_ring(frames[0].shape, 2 * workers)
+    reader = ring.add_reader()
+    detections, pending = [], deque()
+    try:
+        for frame, roi in zip(frames, rois):
+            if len(pending) == ring.capacity:
+                seq, future = pending.popleft()
+                detections.append(future.result())
+                ring.release(reader, seq)
+            seq = ring.put(frame)
+            pending.append((seq, executor.submit(_detect_slot_in_worker, ring.name, seq, roi)))
+        for seq, future in pending:
+            detections.append(future.result())
+            ring.release(reader, seq)
+    finally:
+        ring.remove_reader(reader)
+    return detections
+
+
+def get_executor(execution, workers, params=None, thresholds=None):
+    """
+    Returns the shared pool for the execution mode, creating it on first use
+    :param execution: thread | process
+    :param workers:
+    :param params: detector parameters preloaded by process workers
+    :param thresholds: class thresholds of the process workers' detector
+    :return: executor: Executor
+    """
+    key = (execution, workers, None if params is None else tuple(sorted(params.items())),
+           None if thresholds is None else tuple(sorted(thresholds.items())))
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if execution == "process":
+                cache = get_cache()
+                cache_conf = None if cache is None else (cache.path, cache.max_entries)
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=_init_worker, initargs=(params, cache_conf, thresholds))
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+            _executors[key] = executor
+        return executor
 
 
 # Function that scans the folder for images
-def scan_folder(folder_path, group: Group, render=False):
+def scan_folder(folder_path, group: Group, render=False, batch_size=0, execution="serial", workers=1, lazy=False):
     """
     Reads folder for images and detects the vehicles
     :param folder_path:
     :param group:
     :param render:
+    :param batch_size: detect batch_size images per forward pass (0 detects each image on load)
+    :param execution: serial | thread (threaded decode) | process (threaded decode, inference in worker processes)
+    :param workers:
+    :param lazy: images keep only their detections, rendering is left to the display (see compare_all_images)
     :return: image[]: List[Image], group: Group
     """
+    if execution not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode {execution}, expected one of {EXECUTION_MODES}")
     if pathlib.Path(folder_path).exists():
-        images = np.array([], dtype=Image)  # Empty image list
+        start = len(group)  # Images of this scan are appended after the group's current ones
 
-        print_timestamp(f"Task 1a: scanning images in {folder_path}", 0, 1)
         images_folder = glob.glob(f"{folder_path}/*.jpg")  # scanning the folder for images with the jpeg extension
         images_folder.sort(key=lambda f: int(re.sub('\D', '', f)))
-        print_timestamp(f"Task 1b: image scan 'jpeg' completed for {folder_path}... count={len(images_folder)}", 0, 1)
-        print_timestamp(f"Task 2: reading images and detecting vehicles...", 0, 1)
         # images_folder.sort()
 
-        # Looping over image path found in the images folder
+        # Decoding and detecting ahead in the pools, results keep the folder order
+        frames = [None] * len(images_folder)
+        detections = [None] * len(images_folder)
+        # Lazy images are rendered when (and only if) they get displayed
+        render = render and not lazy
+        # Lazy images decode the same working frame as the others (same detections), only not keeping it
+        # (batched lazy images are decoded by Group.detect)
+        if execution != "serial" and not (lazy and batch_size):
+            frames = list(get_executor("thread", workers).map(
+                lambda path: load_frame(path, lane=os.path.basename(path)), images_folder))
+        if execution == "process" and not batch_size:
+            rois = [group.get_roi(os.path.basename(path)) for path in images_folder]
+            executor = get_executor("process", workers, group.detector.params, group.detector.thresholds)
+            detections = detect_in_processes(executor, frames, rois, workers)
+
+        # Looping over image path found in the images folder (stage timings are recorded in vc.metrics)
         for i, img_path in enumerate(images_folder):
-            # Getting the current system time
-            t = datetime.datetime.now()
-            print_timestamp(f"Task 2-{i}a: beginning detection for {img_path}....", 0, 1)
-            img = Image(img_path, group)  # Loading the image as our Image Class
-            print_timestamp(f"Task 2-{i}b: completed detection for {img.name}....", 0, 1)
-
-            if render:
-                print_timestamp(f"Task 3a: Rendering detection for {img_path}....", 0, 1)
+            if lazy and frames[i] is not None:
+                # The decoded input is used for the detection only, never kept by the image
+                img = Image(img_path, group, detect=False, lazy=True)
+                if detections[i] is None:
+                    detections[i] = group.detect_frame(frames[i], img.name)
+                img.set_detection(*detections[i], shape=frames[i].shape)
+            else:
+                # Loading the image as our Image Class
+                img = Image(img_path, group, detect=not batch_size and detections[i] is None, img=frames[i],
+                            lazy=lazy)
+                if detections[i] is not None:
+                    img.set_detection(*detections[i])
+            frames[i] = None
+
+            if render and not batch_size:
                 img.append_boxes()  # Rendering the boxes unto the processed image
-                print_timestamp(f"Task 3b: Completed rendering for {img.name}....", 0, 1)
-
-            # Getting the duration
-            dt = t - datetime.datetime.now()
-            run_time = -1 * dt.total_seconds()  # Converting into seconds
 
-            images = np.append(images, [img])
-            # images.append(img)  # Append image to Images list
-            print("\n\t\t%s : %f seconds\n" % (images[i], run_time))  # Printing the duration
-            # print('\a')
+        images = group.get_images()[start:]
+        if batch_size:
+            group.detect(batch_size=batch_size)  # Single forward pass per batch of images
+            if render:
+                for img in images:
+                    img.append_boxes()  # Rendering the boxes unto the processed image
 
         return images, group  # Returning the Images List and the Group(wrapper) class
     else:
@@ -59,20 +201,25 @@ def scan_folder(folder_path, group: Group, render=False):
 # Function that compares the vehicle counts of the images provided
 def compare_all_images(images_folder, group: Group,
                        sort_images=False, render_boxes=True,
-                       sort_key=lambda image: image.vehicle_count, reverse=False):
+                       sort_key=None, reverse=False, batch_size=0,
+                       execution="serial", workers=1, display=True, lazy=False):
     """
     Renders sorted image according to scan comparison. A sort key must be provided
     :param images_folder:
     :param group:
     :param sort_images:
     :param render_boxes:
-    :param sort_key:
+    :param sort_key: None sorts by vehicle count (fast path of Group.sort)
     :param reverse:
+    :param batch_size:
+    :param execution:
+    :param workers:
+    :param display: renders and composes the final image (None is returned otherwise)
+    :param lazy: images are decoded again for the display only and their pixels dropped once composed
     :return: image
     """
-    __images, __group = scan_folder(images_folder, group, render_boxes)
-
-    print_timestamp(f"Task 4a: Starting analyses on processed images....", 0, 1)
+    __images, __group = scan_folder(images_folder, group, render_boxes and display, batch_size=batch_size,
+                                    execution=execution, workers=workers, lazy=lazy)
 
     # Getting the sorted and unsorted processed images from the Group
     p_sorted_images, p_unsorted_images = __group.sort(key=sort_key, reverse=reverse)
@@ -80,27 +227,35 @@ def compare_all_images(images_folder, group: Group,
     # Selecting the format of according to  sort_images value
     processed_images = p_sorted_images if sort_images is True else p_unsorted_images
 
-    print_timestamp(f"Sorted: {sort_images}, {processed_images} \n {p_unsorted_images}", 0, 1)
-
-    # Getting position of the highest vehicle count image
-    max_pos = processed_images.tolist().index(max(processed_images, key=sort_key))
+    if sort_key is None:
+        # Lane picked by the group's scheduler (kept up to date as the counts arrived)
+        s_img = __group.get_image(__group.scheduler.decide().lane)
+        max_pos = s_img.get_position() if sort_images is True else s_img.get_index()
+    else:
+        # Getting position of the highest vehicle count image
+        max_pos = processed_images.tolist().index(max(processed_images, key=sort_key))
+        s_img = processed_images[max_pos]  # Getting the image with the highest vehicle count
     # Getting the mid-position of the images list
-    mid_pos = int(len(processed_images.tolist()) / 2)
+    mid_pos = int(len(processed_images) / 2)
 
-    s_img = processed_images[max_pos]  # Getting the image with the highest vehicle count
-    print_timestamp(f"Task 4: Analyses on processed images completed....", 0, 1)
+    # Nothing is rendered when no monitor shows the result
+    if not display:
+        return None, processed_images
 
-    print_timestamp(f"mid_pos: {mid_pos}, max_pos:{max_pos}", 0, 1)
+    if lazy and render_boxes:
+        for image in processed_images:
+            image.append_boxes()  # Deferred rendering of the boxes (decodes the image again)
 
     # Comparing Vehicle count for the two images and selecting the greatest count
-    print_timestamp("Task 5: Rendering final result....", 0, 1)
-    render_scan(s_img, processed_images)  # Rendering the final sorting
-    print_timestamp("Task 5: Rendering completed....", 0, 1)
-
-    print_timestamp("Task 6: Setting final image environment....", 0, 1)
+    with metrics.span("render", group.name):
+        render_scan(s_img, processed_images)  # Rendering the final sorting
 
     img = generate_img(processed_images=processed_images, mid_pos=mid_pos)
 
+    if lazy:
+        for image in processed_images:
+            image.release()  # Only the composed image is kept
+
     return img, processed_images  # Return Final Processed
 
 
@@ -119,29 +274,18 @@ def re_select(i, images):
     return generate_img(images, int(len(images.tolist()) / 2))
 
 
-def generate_img(processed_images, mid_pos):
-    print_timestamp("Task 7: Generating image....", 0, 1)
-    print("\n\t", "P: ", processed_images, "\n")
-    count = len(processed_images.tolist())
-    # concatenate image Horizontally
-    if count > 2:
-        T = np.concatenate(tuple([img.get_img() for img in processed_images][:mid_pos]), axis=1)  # Top Row
-        D = np.concatenate(tuple([img.get_img() for img in processed_images][mid_pos:]), axis=1)  # Bottom  Row
-        # concatenate image Vertically
-        V = np.concatenate((T, D), axis=0)  # Adding Rows (Top & Bottom)
-    elif count == 2:
-        V = np.concatenate((processed_images[0], processed_images[1]), axis=0)
-    else:
-        V = processed_images[0]
-    print_timestamp("Task 8: Image generation completed! 100%....", 0, 1)
-
-    print_timestamp("Task 9: Resizing generated image to 1360 * 600....", 0, 1)
-    # Resizing final image
-    img = cv2.resize(V, (1360, 600))
-
-    print_timestamp("Task 10: Image processing completed...", 0, 1)
-
-    return img
+def generate_img(processed_images, mid_pos, key=None):
+    """
+    Composes the monitor mosaic: mid_pos images on the top row, the others below
+    :param processed_images:
+    :param mid_pos:
+    :param key: compositor reused across cycles (defaults to the images' group)
+    :return: image (canvas of the compositor, overwritten by its next mosaic)
+    """
+    with metrics.span("compose"):
+        key = key if key is not None else processed_images[0].get_group().name
+        compositor = get_compositor(key, len(processed_images), mid_pos)
+        return compositor.compose([img.get_img() for img in processed_images])
 
 
 # Function that render's vehicle position and state unto the images
@@ -1,8 +1,15 @@
 # importing the modules needed to run the program
+from concurrent.futures import ThreadPoolExecutor
 
-from services import process_images_with_conf
+from link import close_managers
+from monitor import start_monitor, stop_monitor
+from services import process_folder, run_intersections, run_stream
 from setup import load_conf, communicate_with_arduino, display_on_pc
-from vc.detector import Group
+from vc.cache import configure_cache
+from vc.history import configure_history
+from vc.metrics import configure_metrics
+from vc.registry import configure_model, registry
+
 
 if __name__ == '__main__':
     # Loading configurations from config file
@@ -11,20 +18,78 @@ if __name__ == '__main__':
     settings = conf['settings']
     # Processing images (Vehicle detection and rendering is included)
     print(conf['settings'])
-    for i, (name, folder_conf) in enumerate(conf["FOLDER_DETAILS"].items()):
-        group = Group(name)
-        if folder_conf["run"]:
-            (img, _images), wn, __conf = process_images_with_conf(grp=group, conf=folder_conf, i=i)
+    # Model, input size and dnn backend used by every detector
+    if "MODEL" in conf:
+        print(configure_model(conf["MODEL"]))
+    # Persistent detection results, replays of the same frames skip the network
+    cache = configure_cache(**settings["cache"]) if "cache" in settings else None
+    # Per stage latency histograms, exported when the program ends
+    metrics = configure_metrics(**settings["metrics"]) if "metrics" in settings else None
+    if metrics is not None and not metrics.enabled:
+        metrics = None  # Nothing recorded, nothing exported
+    # Append-only log of every lane result
+    history = configure_history(**settings["history"]) if "history" in settings else None
+    # Display thread, detection and the controller never wait for it
+    display = dict(settings.get("display", {}))
+    linger = display.pop("linger", 0)
+    monitor = start_monitor(**display) if settings["monitor"] is True else None
+    if settings.get("mode", "batch") == "daemon":
+        # Long running process with a warm model, work is submitted over a local socket (see runners.py)
+        from runners import Daemon
+        Daemon(conf, conf_path='conf.json', linger=linger).run()
+        exit(0)
+    if settings.get("mode", "batch") == "stream":
+        # Continuous cycle over the configured STREAMS
+        print(run_stream(conf, send_to_arduino=settings['controller'] is True, monitor=monitor))
+        close_managers()
+        print(stop_monitor(linger))
+        print(registry.metrics())
+        if metrics is not None:
+            metrics.export()
+        if history is not None:
+            history.close()
+        exit(0)
+    if settings.get("mode", "batch") == "intersections":
+        # Every intersection of the INTERSECTIONS section on one event loop, sharing the detector
+        print(run_intersections(conf, send_to_arduino=settings['controller'] is True))
+        close_managers()
+        print(registry.metrics())
+        if metrics is not None:
+            metrics.export()
+        if history is not None:
+            history.close()
+        exit(0)
+    folders = [(i, name, folder_conf) for i, (name, folder_conf) in enumerate(conf["FOLDER_DETAILS"].items())
+               if folder_conf["run"]]
+    # Folders are processed concurrently when workers are available, results are handled in folder order
+    folder_workers = max(1, min(settings.get("workers", 1), len(folders))) \
+        if settings.get("execution", "serial") != "serial" else 1
+    c_threads = []
+    with ThreadPoolExecutor(max_workers=folder_workers, thread_name_prefix="folder") as pool:
+        futures = [pool.submit(process_folder, i, name, folder_conf, settings) for i, name, folder_conf in folders]
+        for future in futures:
+            group, ((img, _images), wn, __conf) = future.result()
             # Checking if arduino communication is enabled(all values and conf are in the conf file)
-            c_thread = None
             if settings['controller'] is True and __conf["send"]:
-                c_thread = communicate_with_arduino(conf=conf, data=group.serialise(), ims=_images, wn=wn)
+                c_threads.append(communicate_with_arduino(conf=conf, data=group.serialise(), ims=_images, wn=wn))
             # Checking if display is enabled
             if settings["monitor"] is True and __conf["show"] is True:
                 display_on_pc(window_name=wn, image=img)
-            # while c_thread and c_thread.is_alive():
-            #     pass
-            # else:
-            #     break
+    # Waiting for the controller threads, then flushing and closing the serial port
+    for c_thread in c_threads:
+        if c_thread is not None:
+            c_thread.join()
+    close_managers()
+    # Keeping the windows until dismissed (esc) or linger seconds
+    print(stop_monitor(linger))
+    # Printing model load time and memory usage
+    print(registry.metrics())
+    if cache is not None:
+        print(cache.stats())
+    if metrics is not None:
+        metrics.export()
+    if history is not None:
+        print(history.stats())
+        history.close()
     # Finally, exiting program
     exit(0)
@@ -0,0 +1,343 @@
+"""
+Daemon mode of run.py (settings.mode "daemon"): the model, the serial link and the monitor are set up once and
+kept warm, work is submitted over a local socket (settings.daemon.address) as one json object per line:
+
+    python runners.py status --wait 60
+    python runners.py process "Folder 1"
+    python runners.py process "Folder 1" --path src/demo_images/set_2
+    python runners.py reload
+    python runners.py shutdown
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+
+from link import close_managers, find_manager, manager_from_conf
+from monitor import stop_monitor
+from services import process_folder
+from setup import display_on_pc
+from vc.cache import configure_cache, get_cache
+from vc.detector import FRAME_SHAPE
+from vc.history import configure_history, get_history
+from vc.metrics import configure_metrics, metrics
+from vc.registry import configure_model, get_detector, registry
+
+DEFAULT_ADDRESS = "/tmp/vehicle_detector.sock"
+COMMANDS = ("status", "process", "reload", "shutdown")
+
+
+def parse_address(address):
+    """
+    Socket address of the daemon: "host:port" listens on tcp, anything else is a unix socket path
+    :param address:
+    :return: (family, address)
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def read_conf(file_path):
+    """
+    Reads the configuration file, raising instead of exiting (a bad reload keeps the daemon running)
+    :param file_path:
+    :return: configuration: dict
+    """
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # One json response line per request line, until the client closes the connection
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.daemon.dispatch(line)
+            self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Daemon:
+    """
+        Long running detector: answers status queries right away and processes folders only once the model
+        has run a warm-up frame and the serial port is open, so no decision pays the cold start.
+        Folders are processed one at a time, a reload swaps the configuration between two of them.
+    """
+
+    def __init__(self, conf, conf_path="conf.json", address=None, linger=0.0):
+        """
+        :param conf: configuration already applied by run.py (model, cache, metrics, monitor)
+        :param conf_path: file read again on reload
+        :param address: defaults to settings.daemon.address
+        :param linger: seconds the monitor is kept after shutdown
+        """
+        self.conf = conf
+        self.conf_path = conf_path
+        self.address = address or conf["settings"].get("daemon", {}).get("address", DEFAULT_ADDRESS)
+        self.linger = linger
+        self.ready = threading.Event()
+        self.started = time.monotonic()
+        self.processed = 0
+        self.reloads = 0
+        self.warmup_time = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __repr__(self):
+        return repr((self.address, self.ready.is_set(), self.processed))
+
+    # Commands
+    def status(self):
+        # Looked up only, a status query never opens a link (None until the warm-up connected it)
+        manager = find_manager(self.conf["ARDUINO_CONFIGURATION"]["conf"]["port"])
+        cache = get_cache()
+        return {
+            "READY": self.ready.is_set(),
+            "UPTIME": time.monotonic() - self.started,
+            "WARMUP_TIME": self.warmup_time,
+            "PROCESSED": self.processed,
+            "RELOADS": self.reloads,
+            "FOLDERS": list(self.conf["FOLDER_DETAILS"]),
+            "MODELS": registry.metrics(),
+            "LINK": None if manager is None else manager.stats(),
+            "CACHE": None if cache is None else cache.stats(),
+        }
+
+    def process(self, folder=None, path=None, timeout=None):
+        """
+        Detects a folder of the configuration, sends its data to the controller and shows it
+        :param folder: name in FOLDER_DETAILS (defaults to the first one)
+        :param path: frames to process instead of the folder's own path
+        :param timeout: seconds to wait for the warm-up
+        :return: result: dict
+        """
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"Not ready after {timeout}s")
+        with self._lock:
+            conf = self.conf
+            settings = conf["settings"]
+            folders = conf["FOLDER_DETAILS"]
+            name = folder if folder is not None else next(iter(folders))
+            if name not in folders:
+                raise KeyError(f"Unknown folder {name}, expected one of {list(folders)}")
+            folder_conf = dict(folders[name])
+            if path is not None:
+                folder_conf["path"] = path
+            t = time.perf_counter()
+            group, ((img, _images), wn, __conf) = process_folder(list(folders).index(name), name, folder_conf,
+                                                                 settings)
+            data = group.serialise()
+            # No one answers a prompt here, only auto_send controllers are fed
+            arduino_conf = conf["ARDUINO_CONFIGURATION"]
+            sent = settings["controller"] is True and __conf["send"] and arduino_conf["auto_send"] is True
+            if sent:
+                manager_from_conf(arduino_conf).send(data)
+            if settings["monitor"] is True and __conf["show"] is True and img is not None:
+                display_on_pc(window_name=wn, image=img)
+            self.processed += 1
+            return {"FOLDER": name, "DATA": data, "SENT": sent, "ELAPSED": time.perf_counter() - t}
+
+    def reload(self):
+        """
+        Reads the configuration file again, applies it and warms the (possibly new) model up.
+        The monitor keeps its settings, a new display section needs a restart
+        :return: status: dict
+        """
+        conf = read_conf(self.conf_path)
+        with self._lock:
+            self.ready.clear()
+            self.configure(conf)
+            self.conf = conf
+            self.warmup()
+            self.reloads += 1
+        return self.status()
+
+    def shutdown(self):
+        # Answered first, the server stops from another thread
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, name="daemon-shutdown", daemon=True).start()
+        return {"PROCESSED": self.processed}
+
+    # Lifecycle
+    @staticmethod
+    def configure(conf):
+        """
+        Applies the model, cache and metrics sections of a configuration
+        :param conf:
+        :return: None
+        """
+        settings = conf["settings"]
+        if "MODEL" in conf:
+            configure_model(conf["MODEL"])
+            # The detector of an unchanged model is reused, its thresholds may have changed
+            get_detector().set_thresholds(registry.thresholds)
+        if "cache" in settings:
+            configure_cache(**settings["cache"])
+        if "metrics" in settings:
+            configure_metrics(**settings["metrics"])
+        if "history" in settings:
+            configure_history(**settings["history"])
+
+    def warmup(self):
+        """
+        Loads the model and runs one frame through it (the first forward pass allocates the network buffers),
+        then opens the serial port and waits for the controller
+        :return: None
+        """
+        t = time.perf_counter()
+        detector = get_detector()
+        frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+        # Both paths, folders are detected per image or (with a batch_size) in batches.
+        # Past the cache: a cached warm-up frame would leave the network cold
+        detector._detect(frame, 0.3)
+        detector._detect_batch([frame], 0.3, detector.min_threshold())
+        if self.conf["settings"]["controller"] is True:
+            manager_from_conf(self.conf["ARDUINO_CONFIGURATION"]).connect()
+        self.warmup_time = time.perf_counter() - t
+        self.ready.set()
+        print(f"READY {self.address} (warm-up {self.warmup_time:.2f}s)", flush=True)
+
+    def dispatch(self, line):
+        """
+        Runs a request line
+        :param line: {"cmd": "status" | "process" | "reload" | "shutdown", ...arguments}
+        :return: response: {"OK": bool, "RESULT": ...} or {"OK": False, "ERROR": str}
+        """
+        try:
+            request = json.loads(line)
+            cmd = request.pop("cmd", None)
+            if cmd not in COMMANDS:
+                raise ValueError(f"Unknown command {cmd}, expected one of {COMMANDS}")
+            return {"OK": True, "RESULT": getattr(self, cmd)(**request)}
+        except Exception as e:
+            sys.stderr.write(f"{e}\n")  # the daemon keeps serving
+            return {"OK": False, "ERROR": f"{type(e).__name__}: {e}"}
+
+    def bind(self):
+        family, address = parse_address(self.address)
+        if family == socket.AF_INET:
+            server = _TCPServer(address, _Handler)
+        else:
+            if os.path.exists(address):
+                try:
+                    request(self.address, {"cmd": "status"}, timeout=1.0)
+                    raise OSError(f"A daemon is already listening on {address}")
+                except (ConnectionError, FileNotFoundError, socket.timeout):
+                    os.unlink(address)  # Left by a daemon that did not shut down
+            server = _UnixServer(address, _Handler)
+        server.daemon = self
+        return server
+
+    def run(self):
+        """
+        Serves until a shutdown command (or ctrl-c), the warm-up runs while status queries are answered
+        :return: None
+        """
+        self._server = self.bind()
+        print(f"Listening on {self.address}, warming up...", flush=True)
+        threading.Thread(target=self._warmup, name="daemon-warmup", daemon=True).start()
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+            if parse_address(self.address)[0] == socket.AF_UNIX and os.path.exists(self.address):
+                os.unlink(self.address)
+            self.close()
+
+    def close(self):
+        close_managers()
+        print(stop_monitor(self.linger))
+        print(registry.metrics())
+        cache = get_cache()
+        if cache is not None:
+            print(cache.stats())
+        if "metrics" in self.conf["settings"] and metrics.enabled:
+            metrics.export()
+        history = get_history()
+        if history is not None:
+            history.close()
+
+    def _warmup(self):
+        with self._lock:
+            try:
+                self.warmup()
+            except Exception as e:
+                sys.stderr.write(f"Warm-up failed: {e}\n")  # status stays not READY, a reload retries
+
+
+def request(address, payload, timeout=None):
+    """
+    Sends a request to the daemon and returns its response
+    :param address: see parse_address
+    :param payload: {"cmd": ..., ...}
+    :param timeout: seconds
+    :return: response: dict
+    """
+    family, address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(json.dumps(payload).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"No response from {address}")
+    return json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cmd", choices=COMMANDS)
+    parser.add_argument("folder", nargs="?", help="FOLDER_DETAILS entry to process (the first one by default)")
+    parser.add_argument("--path", help="frames to process instead of the folder's path")
+    parser.add_argument("--conf", default="conf.json", help="gives the address when --address is not set")
+    parser.add_argument("--address")
+    parser.add_argument("--wait", type=float, help="seconds to wait for the daemon to be ready")
+    args = parser.parse_args(argv)
+
+    address = args.address
+    if address is None:
+        try:
+            address = read_conf(args.conf)["settings"].get("daemon", {}).get("address", DEFAULT_ADDRESS)
+        except (OSError, ValueError):
+            address = DEFAULT_ADDRESS
+    payload = {"cmd": args.cmd}
+    if args.cmd == "process":
+        payload.update(folder=args.folder, path=args.path, timeout=args.wait)
+    deadline = time.monotonic() + (args.wait or 0)
+    while True:
+        # Polling until the daemon listens (and is warm, for status)
+        try:
+            response = request(address, payload)
+            waiting = args.cmd == "status" and response["OK"] and not response["RESULT"]["READY"]
+        except OSError as e:
+            response, waiting = {"OK": False, "ERROR": str(e)}, True
+        if not waiting or time.monotonic() >= deadline:
+            break
+        time.sleep(0.2)
+    print(json.dumps(response, indent=2, default=str))
+    return 0 if response["OK"] and not waiting else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,46 +2,55 @@ import json
 import sys
 import time
 
-from serial import Serial
-
+from link import SerialLink, manager_from_conf
+from orchestrator import Orchestrator
+from pipeline import Pipeline
 from processors import compare_all_images
 from vc.detector import Group
+from vc.history import get_history
+from vc.roi import rois_from_conf
 
 
 # For sending data to arduino
-def send_json(connection: Serial, data: dict, read=False):
+def send_json(connection, data: dict, read=False):
     """
-    Convert python dic to json
-    :param connection:
+    Convert python dic to json and writes it as a newline terminated frame
+    :param connection: SerialLink (framed, acknowledged) or a raw Serial port
     :param data:
-    :param read:
+    :param read: waits for the acknowledgement (SerialLink) or reads one line back (Serial)
     :return: None:
     :author: NKS
     """
-    data = json.dumps(data)
+    if isinstance(connection, SerialLink):
+        if not connection.is_open():
+            sys.stderr.write("Opening error\n")
+            return
+        seq, acked = connection.send(data, wait_ack=read)
+        if read and not acked:
+            sys.stderr.write(f"No acknowledgement for frame {seq}\n")
+        print(f"\nSending data successful: {seq} {data}")
+        return
+    data = json.dumps(data, separators=(",", ":"))
     if connection.isOpen():
-        time.sleep(2)
-        msg = data.encode('ascii')
+        msg = data.encode('ascii') + b"\n"
         connection.write(msg)
-        time.sleep(2)
         connection.flush()
     else:
-        sys.stderr.write("Opening error")
+        sys.stderr.write("Opening error\n")
         return
     if read:
         try:
-            time.sleep(3)
+            # Bounded by the port's read timeout
             incoming = connection.readline().decode("utf-8")
             print("Adds ", incoming)
         except Exception as e:
             sys.stderr.write(str(e))
     print(f"\nSending data successful: {data}")
-    # time.sleep(1)
-    # connection.close()
 
 
 # Link between configuration and processors.py
-def run(__path: str, __group: Group, __wn: str, sort=False, reverse=True, render_boxes=True, __conf=None):
+def run(__path: str, __group: Group, __wn: str, sort=False, reverse=True, render_boxes=True, __conf=None,
+        batch_size=0, execution="serial", workers=1, display=True, lazy=False):
     """
     Passes data to the processor module(processors.py)
     :param __path:
@@ -51,25 +60,96 @@ def run(__path: str, __group: Group, __wn: str, sort=False, reverse=True, render
     :param reverse:
     :param render_boxes:
     :param __conf:
+    :param batch_size:
+    :param execution:
+    :param workers:
+    :param display: renders the final image (img is None otherwise)
+    :param lazy: lazy images, see vc.detector.Image
     :return: (img, images), __wn, __group, __conf
     """
 
     return compare_all_images(images_folder=__path, group=__group, sort_images=sort, render_boxes=render_boxes,
-                              sort_key=lambda image: image.get_vehicle_count(),
-                              # sorting images by their vehicle count
-                              reverse=reverse), __wn, __conf
+                              sort_key=None,  # sorting images by their vehicle count
+                              reverse=reverse, batch_size=batch_size,
+                              execution=execution, workers=workers, display=display, lazy=lazy), __wn, __conf
 
 
 # Refer to the compare_all_images module in processors.py
-def process_images_with_conf(conf, grp: Group, i=0):
+def process_images_with_conf(conf, grp: Group, i=0, execution="serial", workers=1, display=True, lazy=False):
     """
     Processes images with the given config using the processors' module(processors.py)
     NB (Parses configuration and send data to the run function)
     :param i:
     :param grp:
     :param conf:
+    :param execution:
+    :param workers:
+    :param display:
+    :param lazy:
     :return: (img, images), __wn, __group, __conf
     """
     return run(__path=conf['path'], __group=grp, __wn=f"__Vehicle Detection Module {i}__",
                sort=conf['sort'], reverse=conf['reverse'], render_boxes=conf['render_boxes'],
-               __conf=conf["conf"])
+               __conf=conf["conf"], batch_size=conf.get("batch_size", 0),
+               execution=execution, workers=workers, display=display, lazy=lazy)
+
+
+def process_folder(i, name, folder_conf, settings):
+    """
+    Detects and renders a single folder of the configuration
+    :param i:
+    :param name:
+    :param folder_conf:
+    :param settings:
+    :return: group, ((img, images), wn, conf)
+    """
+    # Lanes with a region of interest only detect (and count) inside it
+    group = Group(name, rois=rois_from_conf(folder_conf.get("roi")))
+    # Images that are never shown are neither rendered nor kept in memory
+    display = settings["monitor"] is True and folder_conf["conf"]["show"] is True
+    started, since = time.time(), time.perf_counter()
+    result = process_images_with_conf(grp=group, conf=folder_conf, i=i, execution=settings.get("execution", "serial"),
+                                      workers=settings.get("workers", 1), display=display,
+                                      lazy=settings.get("lazy", False))
+    # Lane counts are kept for later analysis (see vc/history.py)
+    history = get_history()
+    if history is not None:
+        decision = group.serialise()
+        # Every image of the folder is read when processing starts
+        latency = time.time() - started
+        history.append(name, decision, latencies={d["INDEX"]: latency for d in decision["DATA"]}, since=since)
+    return group, result
+
+
+# Continuous mode, refer to pipeline.py
+def run_stream(conf, send_to_arduino=False, monitor=None):
+    """
+    Runs the streaming pipeline over the STREAMS of the configuration until the sources are exhausted
+    :param conf:
+    :param send_to_arduino:
+    :param monitor: Monitor showing the lanes of every decision
+    :return: stats: dict
+    """
+    send = None
+    if send_to_arduino:
+        # Decisions are queued on the port's long-lived manager (see link.py)
+        send = manager_from_conf(conf["ARDUINO_CONFIGURATION"]).send
+    pipeline = Pipeline.from_conf(conf["STREAMS"], send=send, queue_size=conf["settings"].get("queue_size", 4),
+                                  gate=conf["settings"].get("gate"), scheduler=conf["settings"].get("scheduler"),
+                                  monitor=monitor, tracker=conf["settings"].get("tracker"),
+                                  stall=conf["settings"].get("stall"))
+    pipeline.run()
+    return pipeline.stats()
+
+
+# Several intersections from one process, refer to orchestrator.py
+def run_intersections(conf, send_to_arduino=False):
+    """
+    Runs every intersection of the INTERSECTIONS section concurrently, sharing one detector pool
+    :param conf:
+    :param send_to_arduino: sends every decision to the controller of its intersection
+    :return: stats: dict
+    """
+    orchestrator = Orchestrator.from_conf(conf, send_to_arduino=send_to_arduino)
+    orchestrator.run()
+    return orchestrator.stats()
@@ -4,10 +4,9 @@ import threading
 import time
 
 import cv2
-import serial
 
-from services import send_json
-from vc.detector import print_timestamp
+from link import manager_from_conf
+from monitor import get_monitor, start_monitor
 
 
 class aConnection(threading.Thread):
@@ -17,6 +16,7 @@ class aConnection(threading.Thread):
         self.data = data
         self._ims = ims
         self._wn = wn
+        self._ended = threading.Event()
 
     def run(self) -> None:
         _conf = self.conf
@@ -34,56 +34,40 @@ class aConnection(threading.Thread):
                 return
         print("auto_send: ", auto_send)
         if auto_send is True:
-            arduino_connection = serial.Serial(
-                port=port,
-                baudrate=baudrate,
-                timeout=timeout,
-                parity=serial.PARITY_NONE,
-                bytesize=serial.EIGHTBITS,
-                stopbits=serial.STOPBITS_ONE
-            )
+            # The port is owned by a long-lived manager shared by every group
+            manager = manager_from_conf(arduino_conf)
+            manager.add_handler(self.on_line)
             try:
-                print_timestamp(f"\n Sending data to arduino at::\n\tport:: {port}\n\tbaudrate:: {baudrate}\n"
-                                f"\ttimeout:: {timeout}\n", 0, 1)
-                send_json(connection=arduino_connection, data=self.data, read=False)
+                print(f"Sending data to arduino at {port}, baudrate: {baudrate}, timeout: {timeout}")
+                manager.send(self.data)
 
                 if keep_connection is True:
-                    while True:
-                        if arduino_connection.isOpen():
-                            data = arduino_connection.readline().decode("utf-8")
-                            if len(data) > 0:
-                                # print(type(data))
-                                i = None
-                                if data.strip() == '--end--':
-                                    print_timestamp(f"\n\tConnection made at: ", 0, 1)
-                                elif data.strip() == '__loop_ended__':
-                                    print_timestamp(f"{data} hence terminating thread", 0, 1)
-                                    arduino_connection.close()
-                                    cv2.destroyAllWindows()
-                                    break
-                                # elif data.strip() == "lane_1.jpg":
-                                #     i = re_select(0, self._ims)
-                                # elif data.strip() == "lane_2.jpg":
-                                #     i = re_select(1, self._ims)
-                                # elif data.strip() == "lane_3.jpg":
-                                #     i = re_select(2, self._ims)
-                                # elif data.strip() == "lane_4.jpg":
-                                #     i = re_select(2, self._ims)
-                                # else:
-                                #     print("\narduino:: ", data)
-                                # if i is not None:
-                                #     try:
-                                #         cv2.destroyAllWindows()
-                                #         display_on_pc(self._wn, i)
-                                #     except Exception as e:
-                                #         sys.stderr.write(str(e))
-                                else:
-                                    print("\narduino:: ", data)
-                            time.sleep(1)
-            except serial.SerialException as s:
-                sys.stderr.write(str(s))
+                    # Lines are dispatched to on_line by the manager's link as they arrive
+                    self._ended.wait()
+                else:
+                    manager.flush()
             finally:
-                arduino_connection.close()
+                manager.remove_handler(self.on_line)
+
+    def on_line(self, data):
+        """
+        Handles a line sent by the arduino
+        :param data:
+        :return: None
+        """
+        if data == '--end--':
+            print(f"Connection made at {time.ctime()}")
+        elif data == '__loop_ended__':
+            print(f"{data} hence terminating thread")
+            self._ended.set()
+            # Windows belong to the monitor thread
+            monitor = get_monitor()
+            if monitor is not None:
+                monitor.clear()
+            else:
+                cv2.destroyAllWindows()
+        else:
+            print("\narduino:: ", data)
 
 
 def communicate_with_arduino(conf, data, ims, wn):
@@ -110,28 +94,20 @@ def communicate_with_arduino(conf, data, ims, wn):
 
 def display_on_pc(window_name, image):
     """
-    Responsible for displaying processed image on computer screen
+    Responsible for displaying processed image on computer screen.
+    The image is handed to the monitor thread (see monitor.py), this never waits for the display
     :param window_name:
     :param image:
     :return: None
     """
-    print("\nStarting image thread...")
     try:
-        # cv2.namedWindow(wn, cv2.WINDOW_NORMAL)
-        # cv2.resizeWindow(wn, 1360, 600)
-        cv2.startWindowThread()
-        cv2.namedWindow(window_name, cv2.WINDOW_AUTOSIZE)
-        cv2.imshow(window_name, image)  # Displaying the processed images
-        cv2.waitKey(0)
-        # while True:
-        #     key = cv2.waitKey(0)
-        #     if key == 27:
-        #         print('esc is pressed closing all windows')
-        #         cv2.destroyAllWindows()
-        #         break
+        monitor = get_monitor()
+        if monitor is None:
+            print("\nStarting image thread...")
+            monitor = start_monitor()
+        monitor.show(window_name, image)  # Displaying the processed images
     except Exception as e:
         sys.stderr.write(str(e))  # propagating the error to the standard error handler
-        cv2.destroyAllWindows()  # closing any cv2 window if exist
 
 
 def load_conf(file_path='conf.json'):
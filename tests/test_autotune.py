@@ -0,0 +1,35 @@
+import pytest
+
+from benchmarks.tiny_model import write_frames, write_tiny_model
+from vc.autotune import agreement, autotune
+from vc.detector import VehicleDetector, load_frame
+from vc.registry import registry
+
+THRESHOLDS = {2: 0.5, 3: 0.5}
+
+
+@pytest.fixture
+def restore_registry():
+    defaults, thresholds = dict(registry.defaults), dict(registry.thresholds)
+    yield
+    registry.defaults, registry.thresholds = defaults, thresholds
+
+
+def test_agreement():
+    result = agreement([3, 1, 2], [3, 2, 1])
+    assert result["MAE"] == pytest.approx(2 / 3)
+    assert result["EXACT"] == pytest.approx(1 / 3)
+    assert result["ORDER"] == pytest.approx(2 / 3)
+
+
+def test_uses_configured_thresholds(tmp_path, restore_registry):
+    weights, cfg = write_tiny_model(str(tmp_path / "model"), size=64)
+    paths = write_frames(str(tmp_path / "frames"), count=3)
+    model_conf = {"name": "tiny", "size": [64, 64], "thresholds": {str(c): s for c, s in THRESHOLDS.items()},
+                  "models": {"tiny": {"weights": weights, "cfg": cfg}}}
+    results = autotune(model_conf, paths, repeat=1)
+    detector = VehicleDetector(weights=weights, cfg=cfg, size=(64, 64), thresholds=THRESHOLDS)
+    expected = [detector.detect_vehicles(load_frame(path))[1] for path in paths]
+    assert results["REFERENCE"]["COUNTS"] == expected
+    assert results["RESULTS"][0]["COUNTS"] == expected
+    assert results["RECOMMENDED"]["MODEL"] == "tiny"
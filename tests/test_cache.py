@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from vc.cache import DetectionCache
+
+BOXES = [[1, 2, 3, 4], [5, 6, 7, 8]]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DetectionCache(str(tmp_path / "detections.sqlite3"), max_entries=10)
+    yield cache
+    cache.close()
+
+
+def test_key_depends_on_pixels_and_params():
+    img = np.zeros((4, 4, 3), dtype=np.uint8)
+    key = DetectionCache.make_key(img, {"nms": 0.3})
+    assert key == DetectionCache.make_key(img.copy(), {"nms": 0.3})
+    assert key != DetectionCache.make_key(img, {"nms": 0.4})
+    img[0, 0, 0] = 1
+    assert key != DetectionCache.make_key(img, {"nms": 0.3})
+
+
+def test_get_put(cache):
+    assert cache.get("a") is None
+    cache.put("a", BOXES, 2)
+    boxes, count = cache.get("a")
+    assert count == 2 and boxes.tolist() == BOXES
+    assert cache.stats()["HITS"] == 1 and cache.stats()["MISSES"] == 1
+
+
+def test_replacing_a_key_counts_once(cache):
+    cache.put("a", BOXES, 2)
+    cache.put("a", BOXES[:1], 1)
+    assert cache.stats()["ENTRIES"] == 1
+    assert cache.get("a")[1] == 1
+
+
+def test_evicts_least_recently_used(cache):
+    for i in range(10):
+        cache.put(str(i), BOXES, i)
+    # Read hits only update the access times in memory, they are written on the next put
+    assert cache.get("0") is not None
+    cache.put("10", BOXES, 10)
+    assert cache.stats()["EVICTIONS"] == 2
+    assert cache.stats()["ENTRIES"] == 9
+    assert cache.get("0") is not None
+    assert cache.get("1") is None and cache.get("2") is None
+
+
+def test_persists_access_times_on_close(tmp_path):
+    path = str(tmp_path / "detections.sqlite3")
+    cache = DetectionCache(path, max_entries=10)
+    for i in range(10):
+        cache.put(str(i), BOXES, i)
+    cache.get("0")
+    cache.close()
+    cache.close()
+    cache = DetectionCache(path, max_entries=10)
+    try:
+        assert cache.stats()["ENTRIES"] == 10
+        cache.put("10", BOXES, 10)
+        assert cache.get("0") is not None and cache.get("1") is None
+    finally:
+        cache.close()
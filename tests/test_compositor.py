@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+import pytest
+
+from vc.compositor import MOSAIC_SIZE, Compositor, get_compositor, grid
+
+
+def _frames(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 255, (640, 1200, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def _old_mosaic(frames, mid_pos):
+    # Mosaic of processors.generate_img before the compositor: rows concatenated, then one resize
+    if len(frames) > 2:
+        mosaic = np.concatenate((np.concatenate(frames[:mid_pos], axis=1), np.concatenate(frames[mid_pos:], axis=1)))
+    elif len(frames) == 2:
+        mosaic = np.concatenate(frames)
+    else:
+        mosaic = frames[0]
+    return cv2.resize(mosaic, MOSAIC_SIZE)
+
+
+def test_grid():
+    assert grid(0) == (1,) and grid(1) == (1,)
+    assert grid(2) == (1, 1)
+    assert grid(4) == (2, 2) and grid(4, 2) == (2, 2)
+    assert grid(5) == (2, 3) and grid(3, 1) == (1, 2)
+    # A top row holding none or every lane leaves a single row
+    assert grid(5, 0) == (5,) and grid(5, 5) == (5,)
+
+
+# Lane counts whose tiles fall on whole pixels of the canvas, as the rows of the old mosaic did
+@pytest.mark.parametrize("count", [1, 2, 4, 8])
+def test_matches_the_old_mosaic(count):
+    frames = _frames(count)
+    compositor = Compositor(rows=grid(count, count // 2))
+    canvas = compositor.compose(frames)
+    old = _old_mosaic(frames, count // 2)
+    assert canvas.shape == old.shape
+    x0, y0, x1, y1 = compositor._tiles[0]
+    assert np.array_equal(canvas[y0:y1, x0:x1], old[y0:y1, x0:x1])
+    # Tiles are resized on their own, away from the origin the fixed point interpolation weights
+    # may round one level apart from those of the single resize
+    assert np.abs(canvas.astype(np.int16) - old).max() <= 1
+
+
+@pytest.mark.parametrize("count, mid_pos", [(3, 1), (5, 2), (7, 3)])
+def test_odd_lane_counts(count, mid_pos):
+    frames = _frames(count)
+    compositor = Compositor(rows=grid(count, mid_pos))
+    canvas = compositor.compose(frames)
+    assert len(compositor) == count
+    covered = np.zeros(canvas.shape[:2], dtype=int)
+    for i, frame in enumerate(frames):
+        x0, y0, x1, y1 = compositor._tiles[i]
+        covered[y0:y1, x0:x1] += 1
+        assert np.array_equal(compositor.tile(i), cv2.resize(frame, (x1 - x0, y1 - y0)))
+    # The tiles cover the canvas exactly once
+    assert (covered == 1).all()
+
+
+def test_tokens_skip_redraws():
+    frames = _frames(4)
+    compositor = Compositor(rows=(2, 2))
+    compositor.compose(frames, tokens=[1, 1, 1, 1])
+    assert compositor.drawn == 4
+    frames[2] = np.zeros_like(frames[2])
+    canvas = compositor.compose(frames, tokens=[1, 1, 1, 1])
+    # Same tokens, the stale tile is kept
+    assert compositor.drawn == 4 and compositor.skipped == 4
+    assert compositor.tile(2).any()
+    canvas = compositor.compose(frames, tokens=[1, 1, 2, 1])
+    assert compositor.drawn == 5 and not compositor.tile(2).any()
+    compositor.invalidate()
+    compositor.compose(frames, tokens=[1, 1, 2, 1])
+    assert compositor.drawn == 9
+    # No tokens always redraw
+    compositor.compose(frames)
+    assert compositor.drawn == 13 and canvas is compositor.canvas
+
+
+def test_frame_count_must_match():
+    with pytest.raises(ValueError):
+        Compositor(rows=(2, 2)).compose(_frames(3))
+
+
+def test_get_compositor_rebuilds_on_layout_change():
+    compositor = get_compositor("test", 4)
+    assert get_compositor("test", 4, mid_pos=2) is compositor
+    assert get_compositor("other", 4) is not compositor
+    rebuilt = get_compositor("test", 5)
+    assert rebuilt is not compositor and rebuilt.rows == (2, 3)
+    resized = get_compositor("test", 5, size=(680, 300))
+    assert resized is not rebuilt and resized.canvas.shape == (300, 680, 3)
+    assert get_compositor("test", 5, mid_pos=1).rows == (1, 4)
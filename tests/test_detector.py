@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from benchmarks.tiny_model import write_frames, write_tiny_model
+from vc.detector import VehicleDetector, load_frame
+
+
+@pytest.fixture(scope="module")
+def detector(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("model")
+    weights, cfg = write_tiny_model(str(directory), size=64)
+    return VehicleDetector(weights=weights, cfg=cfg, size=(64, 64))
+
+
+@pytest.fixture(scope="module")
+def frames(tmp_path_factory):
+    return [load_frame(path) for path in write_frames(str(tmp_path_factory.mktemp("frames")), count=3)]
+
+
+def _sorted(boxes):
+    return np.unique(np.asarray(boxes, dtype=np.int64).reshape(-1, 4), axis=0)
+
+
+@pytest.mark.parametrize("thresholds", [None, {2: 0.5, 3: 0.5, 5: 0.5, 6: 0.5, 7: 0.5}])
+def test_batch_matches_single(detector, frames, thresholds):
+    if thresholds is not None:
+        detector.set_thresholds(thresholds)
+    batch = detector.detect_vehicles_batch(frames)
+    for frame, (boxes, count) in zip(frames, batch):
+        single_boxes, single_count = detector.detect_vehicles(frame)
+        assert count == single_count
+        assert np.array_equal(_sorted(boxes), _sorted(single_boxes))
+
+
+def test_explicit_zero_threshold(detector):
+    assert detector.cache_params(0.3, confThreshold=0.0)["conf"] == 0.0
+    assert detector.cache_params(0.3)["conf"] == detector.min_threshold()
+
+
+@pytest.mark.parametrize("batch_size", [0, 2])
+def test_lazy_images_detect_like_loaded_ones(detector, tmp_path, batch_size):
+    from processors import scan_folder
+    from vc.detector import Group
+
+    write_frames(str(tmp_path), count=3, shape=(1080, 1920, 3))
+    counts = []
+    for lazy in (False, True):
+        images, _ = scan_folder(str(tmp_path), Group("lanes", detector=detector), batch_size=batch_size, lazy=lazy)
+        counts.append([img.get_vehicle_count() for img in images])
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.parametrize("thresholds", [{}, {-1: 0.5}])
+def test_invalid_thresholds_are_rejected(detector, thresholds):
+    before = dict(detector.thresholds)
+    with pytest.raises(ValueError):
+        detector.set_thresholds(thresholds)
+    # The detector keeps filtering with its previous thresholds
+    assert detector.thresholds == before
+    boxes, count = detector.filter_vehicles([2, 0], [0.9, 0.9], [[0, 0, 1, 1], [1, 1, 1, 1]])
+    assert count == 1 and boxes.tolist() == [[0, 0, 1, 1]]
+
+
+def test_filter_by_class_threshold(detector):
+    detector.set_thresholds({"7": 0.8, 2: 0.4})
+    try:
+        boxes, count = detector.filter_vehicles([2, 7, 7, 9, 1], [0.5, 0.5, 0.9, 0.99, 0.99],
+                                                [[i, 0, 1, 1] for i in range(5)])
+        # Classes 9 (beyond the table) and 1 (below the largest id) are not vehicles
+        assert count == 2 and boxes[:, 0].tolist() == [0, 2]
+    finally:
+        detector.set_thresholds({2: 0.5, 3: 0.5, 5: 0.5, 6: 0.5, 7: 0.5})
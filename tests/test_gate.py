@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from vc.gate import FrameGate
+
+
+class _Detector:
+    """
+        Stand-in detector counting its calls, the count of a frame is its first pixel
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def detect_vehicles(self, img, nmsThreshold=0.3, lane=None):
+        self.calls += 1
+        count = int(img[0, 0, 0])
+        return np.zeros((count, 4), dtype=np.int32), count
+
+
+def _frame(value, noise=0, seed=0):
+    img = np.full((360, 640, 3), value, dtype=np.int16)
+    if noise:
+        img += np.random.default_rng(seed).integers(-noise, noise + 1, img.shape, dtype=np.int16)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def detector():
+    return _Detector()
+
+
+def test_first_frame_is_detected(detector):
+    gate = FrameGate()
+    assert gate.check(_frame(10)) is None
+    assert gate.detect(detector, _frame(10))[1] == 10 and detector.calls == 1
+
+
+def test_similar_frame_reuses_the_detection(detector):
+    gate = FrameGate(threshold=4.0)
+    first = gate.detect(detector, _frame(100))
+    # Sensor noise averages out in the thumbnail
+    second = gate.detect(detector, _frame(102, noise=8, seed=1))
+    assert second is first and detector.calls == 1
+    assert gate.stats() == {"FRAMES": 2, "SKIPS": 1, "SKIP_RATE": 0.5}
+
+
+def test_changed_frame_is_detected_again(detector):
+    gate = FrameGate(threshold=4.0)
+    gate.detect(detector, _frame(100))
+    changed = _frame(100)
+    # A vehicle entering a quarter of the frame
+    changed[:180, :320] = 30
+    boxes, count = gate.detect(detector, changed)
+    assert detector.calls == 2 and count == 30
+    # The changed frame is the new keyframe
+    assert gate.detect(detector, changed.copy())[1] == 30 and detector.calls == 2
+
+
+def test_skips_are_measured_against_the_keyframe(detector):
+    gate = FrameGate(threshold=4.0)
+    gate.detect(detector, _frame(100))
+    # Slow drift: each frame is close to the previous one but not to the keyframe
+    for value in (103, 106, 109):
+        gate.detect(detector, _frame(value))
+    assert detector.calls == 2 and gate.skips == 2
+
+
+def test_max_skips_forces_a_detection(detector):
+    gate = FrameGate(max_skips=2)
+    for _ in range(7):
+        gate.detect(detector, _frame(50))
+    # Detected, skipped twice, detected, skipped twice, detected
+    assert detector.calls == 3 and gate.skips == 4
+
+
+def test_kwargs_reach_the_detector():
+    seen = {}
+
+    class Detector(_Detector):
+        def detect_vehicles(self, img, nmsThreshold=0.3, lane=None):
+            seen.update(nmsThreshold=nmsThreshold, lane=lane)
+            return super().detect_vehicles(img)
+
+    FrameGate().detect(Detector(), _frame(1), nmsThreshold=0.4, lane="north")
+    assert seen == {"nmsThreshold": 0.4, "lane": "north"}
+
+
+def test_skip_rate_without_frames():
+    assert FrameGate().skip_rate() == 0.0
@@ -0,0 +1,160 @@
+import os.path
+import time
+
+import numpy as np
+import pytest
+
+from vc.history import COLUMNS, LaneHistory, grouped_percentiles, read_segment
+from vc.metrics import metrics
+
+
+def _decision(*counts):
+    return {"DATA": [{"PATH": f"lane_{i}.jpg", "VEHICLE_COUNT": c, "INDEX": i, "POSITION": p}
+                     for p, (i, c) in enumerate(sorted(enumerate(counts), key=lambda e: -e[1]))]}
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = LaneHistory(str(tmp_path / "history"), segment_rows=8, rotate=None)
+    yield history
+    history.close()
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    metrics.enabled = True
+    yield metrics
+    metrics.enabled = False
+    metrics.reset()
+
+
+def test_grouped_percentiles_match_numpy():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 7, 500)
+    values = rng.random(500) * 100
+    qs = (0, 25, 50, 95, 99, 100)
+    unique, sizes, results = grouped_percentiles(keys, values, qs)
+    for i, key in enumerate(unique):
+        group = values[keys == key]
+        assert sizes[i] == len(group)
+        for q in qs:
+            assert results[q][i] == pytest.approx(np.percentile(group, q))
+
+
+def test_grouped_percentiles_single_value_groups():
+    unique, sizes, results = grouped_percentiles(np.array([3, 1]), np.array([5.0, 2.0]), (50, 99))
+    assert unique.tolist() == [1, 3] and sizes.tolist() == [1, 1]
+    assert results[99].tolist() == [2.0, 5.0]
+
+
+def test_append_and_load(history):
+    assert history.append("north", _decision(3, 7), timestamp=100.0, latencies=[0.5, 0.25]) == 2
+    rows = history.load()
+    assert set(rows) == set(COLUMNS)
+    assert sorted(rows["vehicle_count"].tolist()) == [3, 7]
+    assert rows["latency"][rows["vehicle_count"] == 7].tolist() == [0.25]
+    assert history.load(lane="lane_1.jpg")["vehicle_count"].tolist() == [7]
+    assert len(history.load(intersection="south")["timestamp"]) == 0
+    assert history.append("north", {"DATA": []}) == 0
+
+
+def test_rotates_on_size(history):
+    for t in range(10):
+        history.append("north", _decision(t, t), timestamp=float(t))
+    # 8 rows a segment, 2 rows a decision
+    assert len(history.segments()) == 3 and history.rotations == 2
+    assert [len(read_segment(path)["timestamp"]) for path in history.segments()] == [8, 8, 4]
+    assert len(history.load()["timestamp"]) == 20
+
+
+def test_rotates_on_time(tmp_path):
+    history = LaneHistory(str(tmp_path / "history"), segment_rows=100, rotate=60.0)
+    for t in (0.0, 30.0, 59.0, 60.0, 90.0, 130.0):
+        history.append("north", _decision(1), timestamp=t)
+    history.close()
+    assert [read_segment(path)["timestamp"].tolist() for path in history.segments()] == \
+        [[0.0, 30.0, 59.0], [60.0, 90.0], [130.0]]
+
+
+def test_load_skips_segments_outside_the_range(history):
+    for t in range(10):
+        history.append("north", _decision(t, t), timestamp=float(t))
+    assert sorted(set(history.load(start=3.0, end=6.0)["timestamp"].tolist())) == [3.0, 4.0, 5.0]
+
+
+def test_retention_keeps_the_newest_segments(tmp_path):
+    history = LaneHistory(str(tmp_path / "history"), segment_rows=2, rotate=None, max_segments=2)
+    for t in range(5):
+        history.append("north", _decision(t), timestamp=float(t))
+    history.close()
+    assert [os.path.basename(path) for path in history.segments()] == ["segment_000002", "segment_000003"]
+    assert history.load()["timestamp"].tolist() == [2.0, 3.0, 4.0]
+
+
+def test_reopens_the_last_segment(tmp_path):
+    history = LaneHistory(str(tmp_path / "history"), segment_rows=8, rotate=None)
+    history.append("north", _decision(1), timestamp=1.0)
+    history.close()
+    history = LaneHistory(str(tmp_path / "history"), segment_rows=8, rotate=None)
+    history.append("north", _decision(2), timestamp=2.0)
+    history.close()
+    assert len(history.segments()) == 1
+    assert history.load()["vehicle_count"].tolist() == [1, 2]
+
+
+def test_aggregate_windows(history):
+    for t, counts in ((0.0, (2, 4)), (10.0, (4, 8)), (65.0, (10, 0))):
+        history.append("north", _decision(*counts), timestamp=t)
+    results = history.aggregate("vehicle_count", window=60.0, percentiles=(50,))
+    rows = sorted(zip(results["LANE"], results["WINDOW"], results["ROWS"], results["MEAN"], results["P50"]))
+    assert rows == [("lane_0.jpg", 0.0, 2, 3.0, 3.0), ("lane_0.jpg", 60.0, 1, 10.0, 10.0),
+                    ("lane_1.jpg", 0.0, 2, 6.0, 6.0), ("lane_1.jpg", 60.0, 1, 0.0, 0.0)]
+
+
+def test_aggregate_ignores_unknown_latencies(history):
+    history.append("north", _decision(1), timestamp=0.0)
+    history.append("north", _decision(1), timestamp=1.0, latencies=[0.5])
+    results = history.aggregate("latency", window=60.0)
+    assert results["ROWS"].tolist() == [1] and results["MEAN"].tolist() == [0.5]
+
+
+def test_stage_latencies_come_from_the_spans(history, enabled_metrics):
+    metrics.observe("decode", 0.25, lane="lane_0.jpg")
+    # Spans up to here belong to an earlier decision
+    since = time.perf_counter()
+    metrics.observe("decode", 0.5, lane="lane_0.jpg")
+    # One forward pass for the batch, no lane
+    metrics.observe("infer", 0.125)
+    history.append("north", _decision(1, 2), since=since)
+    lane_0 = history.load(("decode", "infer", "resize"), lane="lane_0.jpg")
+    lane_1 = history.load(("decode", "infer"), lane="lane_1.jpg")
+    assert lane_0["decode"].tolist() == [0.5] and lane_0["infer"].tolist() == [0.125]
+    assert np.isnan(lane_0["resize"][0])
+    # No decode span for lane 1
+    assert np.isnan(lane_1["decode"][0]) and lane_1["infer"].tolist() == [0.125]
+
+
+def test_stale_stage_spans_are_not_recorded(history, enabled_metrics):
+    metrics.observe("infer", 0.125, lane="lane_0.jpg")
+    history.append("north", _decision(1), since=float("inf"))
+    assert np.isnan(history.load(("infer",))["infer"][0])
+
+
+def test_stage_latencies_are_unknown_without_metrics(history):
+    history.append("north", _decision(1))
+    rows = history.load()
+    assert all(np.isnan(rows[stage][0]) for stage in ("decode", "resize", "infer", "nms_filter", "track"))
+
+
+def test_reads_segments_without_the_stage_columns(history):
+    history.append("north", _decision(1), timestamp=1.0)
+    history.close()
+    path = history.segments()[0]
+    os.remove(os.path.join(path, "infer.bin"))
+    assert np.isnan(read_segment(path, ("infer",))["infer"]).all()
+    # Reopened for appending, the missing column is recreated
+    history.append("north", _decision(2), timestamp=2.0)
+    history.close()
+    infer = read_segment(path, ("infer",))["infer"]
+    assert len(infer) == 2 and np.isnan(infer).all()
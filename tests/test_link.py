@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+import serial
+
+import benchmarks.protocol_device  # noqa: F401 registers device://
+from link import LinkManager, SerialLink, close_managers, find_manager, get_manager, parse_ack
+
+DATA = {"DATA": [{"PATH": "lane_1.jpg", "VEHICLE_COUNT": 3, "INDEX": 0, "POSITION": 0}], "COUNT": 1}
+
+
+def _device(url="device://"):
+    # Stand-in controller: READY once opened, "ACK <seq>" for every frame it decodes
+    return serial.serial_for_url(url, timeout=0.1)
+
+
+def test_parse_ack():
+    assert parse_ack("ACK 7") == 7
+    assert parse_ack("ACK x") is None
+    # Frames are not acknowledgements, a loop back of the host's own frames must not pass for one
+    assert parse_ack('{"COUNT":1,"SEQ":4}') is None
+    assert parse_ack("lane 1 green") is None
+
+
+def test_ready_handshake():
+    link = SerialLink(_device(), ack_timeout=0.5).start()
+    try:
+        assert link.handshake(1.0) and link.is_ready()
+    finally:
+        link.close()
+    link = SerialLink(_device("device://?ready=0"), ack_timeout=0.5).start()
+    try:
+        assert not link.handshake(0.2)
+        link.connection.say("READY")
+        assert link.handshake(1.0)
+    finally:
+        link.close()
+
+
+def test_other_lines_go_to_the_handlers():
+    lines = []
+    received = threading.Event()
+    link = SerialLink(_device(), on_line=lambda line: (lines.append(line), received.set())).start()
+    try:
+        link.connection.say("lane 1 green")
+        assert received.wait(1.0)
+        assert lines == ["lane 1 green"]
+    finally:
+        link.close()
+
+
+@pytest.mark.parametrize("fmt", ["json", "binary"])
+def test_device_acknowledges(fmt):
+    link = SerialLink(_device(), ack_timeout=1.0, fmt=fmt).start()
+    try:
+        assert link.send(DATA) == (1, True)
+        assert link.send(DATA) == (2, True)
+        assert link.last_rtt is not None
+        frames = link.connection.frames
+        assert [frame["SEQ"] for frame in frames] == [1, 2]
+        assert frames[0]["DATA"][0]["VEHICLE_COUNT"] == 3
+    finally:
+        link.close()
+
+
+def test_binary_sequence_wraps():
+    link = SerialLink(_device(), ack_timeout=1.0, fmt="binary").start()
+    try:
+        link._seq = 255
+        # The device acknowledges the 8 bit sequence number carried by the frame
+        assert link.send(DATA) == (0, True)
+    finally:
+        link.close()
+
+
+def test_no_acknowledgement():
+    link = SerialLink(_device("device://?ack=0"), ack_timeout=0.1).start()
+    try:
+        assert link.send(DATA) == (1, False)
+        for _ in range(100):
+            link.send(DATA, wait_ack=False)
+        # Nothing awaited is left pending
+        assert not link._pending
+    finally:
+        link.close()
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        SerialLink(_device(), fmt="xml")
+
+
+def test_manager_sends_to_the_device():
+    manager = LinkManager("device://", ack_timeout=1.0, handshake_timeout=1.0)
+    try:
+        for _ in range(3):
+            manager.send(DATA)
+        assert manager.flush(5.0)
+        stats = manager.stats()
+        assert stats["ACKED"] == 3 and stats["FAILED"] == 0
+    finally:
+        manager.close()
+
+
+def test_manager_close_returns_without_port():
+    manager = LinkManager("/dev/does-not-exist", handshake_timeout=0.0, max_retries=1)
+    manager.send(DATA)
+    manager.close(timeout=5.0)
+    assert manager.stats()["FAILED"] == 1
+
+
+def test_find_manager_does_not_create():
+    assert find_manager("device://") is None
+    manager = get_manager("device://", handshake_timeout=1.0)
+    try:
+        assert find_manager("device://") is manager
+    finally:
+        close_managers()
+    assert find_manager("device://") is None
+
+
+def test_manager_survives_a_frame_that_cannot_be_encoded():
+    manager = LinkManager("device://", ack_timeout=1.0, handshake_timeout=1.0, fmt="binary")
+    try:
+        bad = {"DATA": [{"PATH": "lane_1.jpg", "VEHICLE_COUNT": 3, "INDEX": 0, "POSITION": None}], "COUNT": 1}
+        manager.send(bad)
+        manager.send(DATA)
+        assert manager.flush(5.0)
+        stats = manager.stats()
+        assert stats["FAILED"] == 1 and stats["ACKED"] == 1
+    finally:
+        manager.close(timeout=1.0)
@@ -0,0 +1,106 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+from vc.metrics import Histogram, Metrics
+
+
+@pytest.fixture
+def metrics():
+    return Metrics(enabled=True, window=8)
+
+
+def test_percentiles_match_numpy():
+    histogram = Histogram(window=100)
+    samples = np.random.default_rng(0).random(50)
+    for seconds in samples:
+        histogram.observe(seconds)
+    p = histogram.percentiles((50, 95, 99))
+    assert [p[q] for q in (50, 95, 99)] == pytest.approx(np.percentile(samples, (50, 95, 99)).tolist())
+
+
+def test_percentiles_cover_the_latest_window_only():
+    histogram = Histogram(window=4)
+    for seconds in (10.0, 10.0, 1.0, 2.0, 3.0, 4.0):
+        histogram.observe(seconds)
+    assert histogram.percentiles((100,))[100] == 4.0
+    summary = histogram.summary()
+    # Totals count every sample since start
+    assert summary["COUNT"] == 6 and summary["MAX"] == 10.0 and summary["MEAN"] == 5.0
+
+
+def test_empty_histogram():
+    assert Histogram().summary() == {"COUNT": 0, "MEAN": 0.0, "P50": 0.0, "P95": 0.0, "P99": 0.0, "MAX": 0.0}
+
+
+def test_span_times_the_block(metrics):
+    with metrics.span("infer", lane="lane_1.jpg"):
+        time.sleep(0.01)
+    [s] = metrics.snapshot()
+    assert (s["STAGE"], s["LANE"], s["COUNT"]) == ("infer", "lane_1.jpg", 1)
+    assert s["MAX"] >= 0.01
+
+
+def test_spans_are_kept_per_stage_and_lane(metrics):
+    for lane in ("a", "b", "a"):
+        with metrics.span("decode", lane):
+            pass
+    with metrics.span("infer"):
+        pass
+    counts = {(s["STAGE"], s["LANE"]): s["COUNT"] for s in metrics.snapshot()}
+    assert counts == {("decode", "a"): 2, ("decode", "b"): 1, ("infer", None): 1}
+
+
+def test_disabled_records_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.span("infer") as first, metrics.span("decode") as second:
+        pass
+    # One shared no-op context
+    assert first is second
+    metrics.observe("infer", 1.0)
+    assert metrics.snapshot() == []
+
+
+def test_latest(metrics):
+    assert metrics.latest("infer", "a") is None
+    metrics.observe("infer", 0.5)
+    # Falls back to the span shared by every lane
+    assert metrics.latest("infer", "a") == 0.5
+    metrics.observe("infer", 0.25, lane="a")
+    assert metrics.latest("infer", "a") == 0.25
+    assert metrics.latest("infer", "a", since=time.perf_counter()) is None
+
+
+def test_export_json(metrics, tmp_path):
+    metrics.observe("infer", 0.5, lane="a")
+    path = metrics.export(str(tmp_path / "out" / "metrics.json"))
+    with open(path) as f:
+        [s] = json.load(f)
+    assert s["STAGE"] == "infer" and s["LANE"] == "a" and s["P99"] == 0.5
+    assert not (tmp_path / "out" / "metrics.json.tmp").exists()
+
+
+def test_export_prometheus(metrics, tmp_path):
+    metrics.observe("infer", 0.5, lane="a")
+    metrics.observe("infer", 0.25, lane="a")
+    metrics.observe("send", 0.125)
+    path = metrics.export(str(tmp_path / "metrics.prom"), fmt="prometheus")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert "# TYPE vc_stage_seconds summary" in lines
+    assert 'vc_stage_seconds{stage="infer",lane="a",quantile="0.99"} 0.497500000' in lines
+    assert 'vc_stage_seconds_sum{stage="infer",lane="a"} 0.750000000' in lines
+    assert 'vc_stage_seconds_count{stage="infer",lane="a"} 2' in lines
+    assert 'vc_stage_seconds_count{stage="send"} 1' in lines
+
+
+def test_export_without_a_path(metrics):
+    assert metrics.export() is None
+
+
+def test_reset(metrics):
+    metrics.observe("infer", 0.5)
+    metrics.reset()
+    assert metrics.snapshot() == []
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from monitor import MEMMAP_HEADER, MemmapSink, Monitor, get_monitor, read_memmap, start_monitor, stop_monitor
+
+
+def _image(value, shape=(36, 64, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_show_drops_the_oldest_images():
+    # Not started: nothing consumes the queue
+    monitor = Monitor(queue_size=2, headless=True)
+    for value in range(5):
+        monitor.show(f"lane_{value}", _image(value))
+    assert monitor.shown == 5 and monitor.dropped == 3
+    queued = [monitor._queue.get_nowait() for _ in range(2)]
+    assert [name for name, _ in queued] == ["lane_3", "lane_4"]
+
+
+def test_show_copies_unless_told_otherwise():
+    monitor = Monitor(queue_size=2, headless=True)
+    image = _image(1)
+    monitor.show("a", image)
+    monitor.show("b", image, copy=False)
+    image[...] = 9
+    (_, copied), (_, shared) = monitor._queue.get_nowait(), monitor._queue.get_nowait()
+    assert copied.max() == 1 and shared is image
+
+
+def test_unknown_sink():
+    with pytest.raises(ValueError):
+        Monitor(sink="printer")
+
+
+def test_headless_files(tmp_path):
+    monitor = Monitor(fps=100, headless=True, output=str(tmp_path))
+    monitor.start()
+    monitor.show("__Vehicle Detection Module 1__", _image(200))
+    monitor.close()
+    image = cv2.imread(str(tmp_path / "Vehicle_Detection_Module_1.jpg"))
+    assert image.shape == (36, 64, 3) and abs(int(image.mean()) - 200) <= 2
+    assert not list(tmp_path.glob("*.tmp.jpg"))
+    assert monitor.stats()["WINDOWS"] == ["__Vehicle Detection Module 1__"] and not monitor.is_alive()
+
+
+def test_headless_memmap_keeps_the_latest_frame(tmp_path):
+    monitor = Monitor(fps=100, queue_size=8, headless=True, output=str(tmp_path), sink="memmap")
+    monitor.start()
+    for value in (10, 20, 30):
+        monitor.show("north", _image(value))
+        time.sleep(0.05)
+    monitor.close()
+    seq, image = read_memmap(str(tmp_path / "north.rgb"))
+    assert np.array_equal(image, _image(30))
+    # Every refresh of the window is a frame of the sink
+    assert seq == monitor.refreshed
+
+
+def test_latest_image_per_window(tmp_path):
+    monitor = Monitor(fps=100, queue_size=8, headless=True, output=str(tmp_path), sink="memmap")
+    for value in (1, 2, 3):
+        monitor.show("north", _image(value))
+    monitor.show("south", _image(7))
+    # Queued before the monitor runs: only the latest image of each window is drawn
+    monitor.start()
+    monitor.close()
+    assert monitor.refreshed == 2
+    seq, image = read_memmap(str(tmp_path / "north.rgb"))
+    assert seq == 1 and image.max() == 3
+    assert read_memmap(str(tmp_path / "south.rgb"))[1].max() == 7
+
+
+def test_memmap_sink_resizes(tmp_path):
+    sink = MemmapSink(str(tmp_path / "lane.rgb"), (18, 32, 3))
+    sink.write(_image(5))
+    seq, image = read_memmap(str(tmp_path / "lane.rgb"))
+    sink.close()
+    assert seq == 1 and image.shape == (18, 32, 3) and image.max() == 5
+
+
+def test_read_memmap_waits_for_a_frame_being_written(tmp_path):
+    path = str(tmp_path / "lane.rgb")
+    sink = MemmapSink(path, (18, 32, 3))
+    sink.write(_image(1))
+    # The writer is half way through the second frame
+    sink._header[0] = 3
+    sink._pixels[:9] = 2
+    sink._map.flush()
+    finish = threading.Timer(0.05, sink.write, (_image(2),))
+    finish.start()
+    seq, image = read_memmap(path)
+    finish.join()
+    sink.close()
+    # Neither the torn frame nor the first one once the second was being written
+    assert seq == 2 and np.array_equal(image, _image(2, (18, 32, 3)))
+
+
+def test_read_memmap_times_out_on_an_unfinished_frame(tmp_path):
+    path = str(tmp_path / "lane.rgb")
+    sink = MemmapSink(path, (18, 32, 3))
+    sink._header[0] = 1
+    sink._map.flush()
+    with pytest.raises(TimeoutError):
+        read_memmap(path, timeout=0.01)
+    sink.close()
+
+
+def test_process_wide_monitor(tmp_path):
+    monitor = start_monitor(fps=100, headless=True, output=str(tmp_path))
+    try:
+        assert start_monitor() is monitor and get_monitor() is monitor
+        monitor.show("north", _image(1))
+    finally:
+        stats = stop_monitor()
+    assert stats["SHOWN"] == 1 and get_monitor() is None and stop_monitor() is None
+
+
+def test_header_layout(tmp_path):
+    sink = MemmapSink(str(tmp_path / "lane.rgb"), (18, 32, 3))
+    sink.write(_image(1))
+    sink.close()
+    header = np.fromfile(str(tmp_path / "lane.rgb"), dtype=np.uint64, count=MEMMAP_HEADER)
+    assert header.tolist() == [2, 18, 32]
@@ -0,0 +1,105 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from benchmarks.tiny_model import write_tiny_model
+from orchestrator import DetectorPool, Intersection
+from vc.detector import VehicleDetector
+from vc.sources import FrameSource
+
+
+class _Source(FrameSource):
+    def __init__(self, lane, frames):
+        super().__init__(lane)
+        self.frames = frames
+        self.released = 0
+
+    def read(self):
+        if not self.frames:
+            return None
+        self.frames -= 1
+        return f"{self.lane}_{self._seq + 1}", None, np.zeros((640, 1200, 3), dtype=np.uint8)
+
+    def _release(self):
+        self.released += 1
+
+
+@pytest.fixture(scope="module")
+def detector(tmp_path_factory):
+    weights, cfg = write_tiny_model(str(tmp_path_factory.mktemp("model")), size=64)
+    return VehicleDetector(weights=weights, cfg=cfg, size=(64, 64))
+
+
+@pytest.mark.parametrize("weight", [0, -1, 0.5])
+def test_weight_below_one(detector, weight):
+    with pytest.raises(ValueError):
+        DetectorPool(detector).register("a", weight)
+
+
+@pytest.mark.parametrize("cycles", [0, 2, None])
+def test_sources_released(detector, cycles):
+    async def run():
+        pool = DetectorPool(detector)
+        sources = {"north": _Source("north", 5), "south": _Source("south", 3)}
+        intersection = Intersection("a", sources, pool, cycles=cycles)
+        try:
+            await intersection.run()
+        finally:
+            await pool.close()
+        return intersection, sources
+
+    intersection, sources = asyncio.run(run())
+    assert intersection.decisions == (3 if cycles is None else cycles)
+    assert all(source.released == 1 for source in sources.values())
+
+
+class _Recorder:
+    """
+        Stand-in detector remembering which intersection each forward pass served
+    """
+
+    def __init__(self):
+        self.passes = []
+
+    def detect_vehicles_batch(self, frames, nmsThreshold=0.3, lanes=None):
+        self.passes.append((lanes[0], len(frames)))
+        return [(np.zeros((0, 4), dtype=np.int32), 0)] * len(frames)
+
+
+@pytest.mark.parametrize("weights, batches", [
+    ({"a": 1, "b": 1}, {"a": 4, "b": 4}),
+    ({"a": 1, "b": 3}, {"a": 4, "b": 4}),
+    ({"a": 2, "b": 1}, {"a": 4, "b": 4}),
+    # Smaller batches do not earn a larger share of the frames
+    ({"a": 1, "b": 1}, {"a": 2, "b": 4}),
+])
+def test_pool_shares_frames_by_weight(weights, batches):
+    recorder = _Recorder()
+
+    async def run():
+        pool = DetectorPool(recorder, workers=1, quantum=4)
+        for client, weight in weights.items():
+            pool.register(client, weight)
+        # Every intersection has far more work queued than the pool serves in the measured window
+        requests = [pool.detect(client, [None] * batches[client], lanes=[client] * batches[client])
+                    for client in weights for _ in range(60)]
+        try:
+            await asyncio.gather(*requests)
+        finally:
+            await pool.close()
+        return pool
+
+    pool = asyncio.run(run())
+    # Frames served while every queue is still busy, up to the last pass of the first one to drain
+    last = {client: i for i, (client, _) in enumerate(recorder.passes)}
+    contended = recorder.passes[:min(last.values()) + 1]
+    frames = {client: sum(n for c, n in contended if c == client) for client in weights}
+    assert sum(frames.values()) >= 60 * min(batches.values())
+    total = sum(frames.values())
+    for client, weight in weights.items():
+        expected = total * weight / sum(weights.values())
+        # Up to one turn of difference where the window ends
+        assert abs(frames[client] - expected) <= 4 * weight
+    assert {client: s["FRAMES"] for client, s in pool.stats().items()} == \
+        {client: 60 * batches[client] for client in weights}
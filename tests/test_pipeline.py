@@ -0,0 +1,198 @@
+import queue
+import threading
+
+import numpy as np
+import pytest
+
+from pipeline import STOP, LaneEnd, Pipeline, Stage
+from vc.sources import Frame, FrameSource
+
+SIZE = (64, 48)
+
+
+class _Source(FrameSource):
+    """
+        In-memory lane: frames whose pixel value is their vehicle count
+    """
+
+    def __init__(self, lane, counts, interval=0.0, hold=None):
+        super().__init__(lane, interval)
+        self.counts = list(counts)
+        self.hold = hold  # event the source waits for once its counts are read (a stalled camera)
+        self.released = 0
+
+    def read(self):
+        if not self.counts:
+            if self.hold is not None:
+                self.hold.wait()
+            return None
+        count = self.counts.pop(0)
+        return f"{self.lane}_{self._seq + 1}", None, np.full((SIZE[1], SIZE[0], 3), count, dtype=np.uint8)
+
+    def _release(self):
+        self.released += 1
+
+
+class _Detector:
+    def detect_vehicles(self, img, nmsThreshold=0.3, lane=None):
+        count = int(img[0, 0, 0])
+        return np.zeros((count, 4), dtype=np.int32), count
+
+
+class _Monitor:
+    def __init__(self):
+        self.shown = 0
+
+    def show(self, name, canvas):
+        self.shown += 1
+
+
+def _run(sources, timeout=10, **kwargs):
+    decisions = []
+    pipeline = Pipeline(sources, detector=_Detector(), send=decisions.append, size=SIZE, **kwargs)
+    pipeline.start()
+    pipeline.join(timeout)
+    assert not pipeline._stages[-1].is_alive(), "the pipeline did not drain"
+    return pipeline, decisions
+
+
+def test_stage_applies_drops_and_stops(capsys):
+    inbox, outbox = queue.Queue(), queue.Queue()
+    stage = Stage("half", lambda n: 10 // n or None, inbox, outbox)
+    for item in (1, 0, 20, 2, STOP):
+        inbox.put(item)
+    stage.start()
+    stage.join(5)
+    assert [outbox.get_nowait() for _ in range(3)] == [10, 5, STOP]
+    # 0 raised, 20 was filtered out
+    assert stage.processed == 3 and stage.dropped == 1
+    assert "half: integer division or modulo by zero\n" in capsys.readouterr().err
+
+
+def test_stage_passes_or_handles_lane_ends():
+    inbox, middle, outbox = queue.Queue(), queue.Queue(), queue.Queue()
+    ended = []
+    first = Stage("first", lambda n: n, inbox, middle)
+    second = Stage("second", lambda n: n, middle, outbox, on_end=lambda lane: ended.append(lane) or "ended")
+    for item in (1, LaneEnd("a"), 2, STOP):
+        inbox.put(item)
+    first.start(), second.start()
+    second.join(5)
+    assert [outbox.get_nowait() for _ in range(4)] == [1, "ended", 2, STOP]
+    assert ended == ["a"] and first.processed == 2
+
+
+def _frame(lane, seq, count):
+    frame = Frame(lane, seq, f"{lane}_{seq}")
+    frame.vehicle_count = count
+    return frame
+
+
+def test_decide_waits_for_every_lane():
+    pipeline = Pipeline({"north": _Source("north", []), "south": _Source("south", [])}, detector=_Detector())
+    assert pipeline.decide(_frame("north", 1, 1)) is None
+    # A newer frame of the same lane replaces the previous one
+    assert pipeline.decide(_frame("north", 2, 5)) is None
+    decision = pipeline.decide(_frame("south", 1, 3))
+    assert decision["DATA"] == [
+        {"PATH": "north_2", "VEHICLE_COUNT": 5, "INDEX": 0, "POSITION": 0},
+        {"PATH": "south_1", "VEHICLE_COUNT": 3, "INDEX": 1, "POSITION": 1},
+    ]
+    assert decision["COUNT"] == 2 and pipeline.decisions == 1
+
+
+def test_decide_stops_waiting_for_an_ended_lane():
+    pipeline = Pipeline({"north": _Source("north", []), "south": _Source("south", [])}, detector=_Detector())
+    pipeline.decide(_frame("north", 1, 1))
+    pipeline.decide(_frame("south", 1, 9))
+    assert pipeline.decide(_frame("north", 2, 2)) is None
+    # The pending north frame is decided on as soon as south ends, south keeps its last frame
+    decision = pipeline.lane_ended("south")
+    assert {d["PATH"]: d["VEHICLE_COUNT"] for d in decision["DATA"]} == {"north_2": 2, "south_1": 9}
+    assert pipeline.decide(_frame("north", 3, 3)) is not None
+    # Nothing new to decide on
+    assert pipeline.lane_ended("north") is None
+
+
+def test_decide_leaves_out_lanes_without_frames():
+    pipeline = Pipeline({"north": _Source("north", []), "south": _Source("south", [])}, detector=_Detector())
+    assert pipeline.lane_ended("south") is None
+    decision = pipeline.decide(_frame("north", 1, 1))
+    assert decision["DATA"] == [{"PATH": "north_1", "VEHICLE_COUNT": 1, "INDEX": 0, "POSITION": 0}]
+    assert decision["COUNT"] == 1
+
+
+def test_runs_every_source_to_the_end():
+    sources = {"north": _Source("north", [1, 5, 2]), "south": _Source("south", [3, 4, 2])}
+    pipeline, decisions = _run(sources)
+    assert 1 <= len(decisions) == pipeline.decisions <= 3
+    assert {d["PATH"] for d in decisions[-1]["DATA"]} == {"north_3", "south_3"}
+    assert all(d["POSITION"] == i for decision in decisions for i, d in enumerate(decision["DATA"]))
+    assert all(source.released == 1 for source in sources.values())
+    stats = pipeline.stats()
+    assert stats["STAGES"]["detect"]["PROCESSED"] == 6 and stats["QUEUES"] == [0] * 5
+
+
+def test_short_source_does_not_stop_the_decisions():
+    sources = {"north": _Source("north", [1, 2, 3, 4, 5]), "south": _Source("south", [9])}
+    _, decisions = _run(sources, monitor=_Monitor())
+    # The longer lane is decided on to its last frame, the exhausted lane keeps its last count
+    assert {d["PATH"]: d["VEHICLE_COUNT"] for d in decisions[-1]["DATA"]} == {"north_5": 5, "south_1": 9}
+
+
+def test_lane_without_frames_is_left_out():
+    monitor = _Monitor()
+    sources = {"north": _Source("north", [1, 2]), "south": _Source("south", [])}
+    _, decisions = _run(sources, monitor=monitor)
+    assert [d["PATH"] for d in decisions[-1]["DATA"]] == ["north_2"]
+    assert monitor.shown == len(decisions)
+
+
+def test_stalled_lane_is_not_waited_for_past_stall():
+    hold = threading.Event()
+    sources = {"north": _Source("north", [1] * 20, interval=0.01), "south": _Source("south", [2], hold=hold)}
+    decisions = []
+    pipeline = Pipeline(sources, detector=_Detector(), send=decisions.append, size=SIZE, stall=0.03)
+    pipeline.start()
+    try:
+        pipeline._feeders[0].join(5)
+    finally:
+        hold.set()
+    pipeline.join(5)
+    assert not pipeline._stages[-1].is_alive()
+    # Without stall the north lane would wait for south after the first decision
+    assert len(decisions) > 2
+    assert "north_20" in {d["PATH"] for d in decisions[-1]["DATA"]}
+
+
+def test_waits_for_a_stalled_lane_without_stall():
+    hold = threading.Event()
+    sources = {"north": _Source("north", [1] * 5), "south": _Source("south", [2], hold=hold)}
+    decisions = []
+    pipeline = Pipeline(sources, detector=_Detector(), send=decisions.append, size=SIZE)
+    pipeline.start()
+    pipeline._feeders[0].join(5)
+    pipeline.join(0.2)
+    assert len(decisions) == 1
+    hold.set()
+    pipeline.join(5)
+    assert "north_5" in {d["PATH"] for d in decisions[-1]["DATA"]}
+
+
+def test_resizes_to_the_working_size():
+    sizes = []
+
+    class Detector(_Detector):
+        def detect_vehicles(self, img, nmsThreshold=0.3, lane=None):
+            sizes.append(img.shape[1::-1])
+            return super().detect_vehicles(img, nmsThreshold, lane)
+
+    pipeline = Pipeline({"north": _Source("north", [1])}, detector=Detector(), size=(32, 24))
+    pipeline.start()
+    pipeline.join(5)
+    assert sizes == [(32, 24)]
+
+
+def test_from_conf_rejects_unknown_sources():
+    with pytest.raises(ValueError):
+        Pipeline.from_conf({"north": {"type": "satellite"}}, detector=_Detector())
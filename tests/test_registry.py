@@ -0,0 +1,126 @@
+import cv2
+import numpy as np
+import pytest
+
+import vc.registry
+from benchmarks.tiny_model import write_tiny_model
+from vc.detector import Group, Image, VehicleDetector
+from vc.registry import DEFAULT_CFG, ModelRegistry, configure_model, model_from_conf, registry
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    return write_tiny_model(str(tmp_path_factory.mktemp("model")), size=64)
+
+
+@pytest.fixture
+def fresh_registry():
+    defaults, thresholds, models, detectors = dict(registry.defaults), dict(registry.thresholds), \
+        dict(registry._models), dict(registry._detectors)
+    registry.clear()
+    yield registry
+    registry.clear()
+    registry.defaults, registry.thresholds = defaults, thresholds
+    registry._models.update(models)
+    registry._detectors.update(detectors)
+
+
+def _users(weights):
+    return [m["USERS"] for m in registry.metrics()["MODELS"] if m["WEIGHTS"] == weights]
+
+
+def test_model_is_loaded_once(fresh_registry, tiny_model):
+    weights, cfg = tiny_model
+    first = registry.get_model(weights=weights, cfg=cfg, size=(64, 64))
+    assert registry.get_model(weights=weights, cfg=cfg, size=(64, 64)) is first
+    # Another input size is another model
+    assert registry.get_model(weights=weights, cfg=cfg, size=(32, 32)) is not first
+    assert registry.metrics()["COUNT"] == 2
+    assert first.users == 2
+
+
+def test_detectors_share_the_model(fresh_registry, tiny_model):
+    weights, cfg = tiny_model
+    a = VehicleDetector(weights=weights, cfg=cfg, size=(64, 64))
+    b = VehicleDetector(weights=weights, cfg=cfg, size=(64, 64), thresholds={2: 0.9})
+    assert a._loaded is b._loaded and a.model is b.model
+    # Thresholds are per detector
+    assert a.thresholds != b.thresholds
+    assert _users(weights) == [2]
+
+
+def test_shared_detector_per_parameters(fresh_registry, tiny_model):
+    weights, cfg = tiny_model
+    detector = registry.get_detector(weights=weights, cfg=cfg, size=(64, 64))
+    assert registry.get_detector(weights=weights, cfg=cfg, size=[64, 64]) is detector
+    assert registry.get_detector(weights=weights, cfg=cfg, size=(32, 32)) is not detector
+
+
+def test_images_are_not_users(fresh_registry, tiny_model, tmp_path):
+    weights, cfg = tiny_model
+    registry.configure(weights=weights, cfg=cfg, size=(64, 64))
+    group = Group("north")
+    for i in range(3):
+        path = str(tmp_path / f"lane_{i}.jpg")
+        cv2.imwrite(path, np.zeros((64, 64, 3), dtype=np.uint8))
+        image = Image(path, group, detect=False)
+        assert image._loaded is group.detector._loaded
+    # The group's detector only, however many images
+    assert _users(weights) == [1]
+
+
+def test_model_from_conf_backend_and_target():
+    params = model_from_conf({"name": "tiny", "backend": "opencv", "target": "cpu", "size": [416, 416],
+                              "models": {"tiny": {"weights": "tiny.weights", "cfg": "tiny.cfg"}}})
+    assert params == dict(weights="tiny.weights", cfg="tiny.cfg", size=(416, 416),
+                          backend=cv2.dnn.DNN_BACKEND_OPENCV, target=cv2.dnn.DNN_TARGET_CPU)
+
+
+def test_model_from_conf_onnx():
+    params = model_from_conf({"name": "onnx", "size": [416, 416], "models": {"onnx": {"weights": "m.onnx",
+                                                                                     "size": [320, 320]}}})
+    # No darknet cfg, the graph's own input size wins
+    assert params["cfg"] == "" and params["size"] == (320, 320)
+    assert params["backend"] is None and params["target"] is None
+
+
+@pytest.mark.parametrize("conf", [
+    {"name": "missing", "models": {"tiny": {"weights": "tiny.weights"}}},
+    {"name": "tiny", "backend": "tpu", "models": {"tiny": {"weights": "tiny.weights"}}},
+    {"name": "tiny", "target": "fpga", "models": {"tiny": {"weights": "tiny.weights"}}},
+])
+def test_model_from_conf_rejects_unknown_names(conf):
+    with pytest.raises(ValueError):
+        model_from_conf(conf)
+
+
+def test_unavailable_backend_falls_back(monkeypatch, capsys):
+    monkeypatch.setattr(vc.registry, "backend_available", lambda backend, target=None: False)
+    params = model_from_conf({"name": "tiny", "backend": "cuda", "target": "cuda",
+                              "models": {"tiny": {"weights": "tiny.weights"}}})
+    assert params["backend"] is None and params["target"] is None and params["cfg"] == DEFAULT_CFG
+    assert "Backend cuda/cuda is not available" in capsys.readouterr().err
+
+
+def test_configured_backend_reaches_the_detectors(fresh_registry, tiny_model):
+    weights, cfg = tiny_model
+    configure_model({"name": "tiny", "backend": "opencv", "target": "cpu", "size": [64, 64],
+                     "thresholds": {"2": 0.25}, "models": {"tiny": {"weights": weights, "cfg": cfg}}})
+    detector = registry.get_detector()
+    assert detector.params["backend"] == cv2.dnn.DNN_BACKEND_OPENCV
+    assert detector.params["target"] == cv2.dnn.DNN_TARGET_CPU
+    assert detector._loaded.key == (weights, cfg, (64, 64), cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU)
+    assert detector.thresholds == {2: 0.25}
+
+
+def test_explicit_weights_keep_the_configured_backend():
+    models = ModelRegistry()
+    models.configure(backend=cv2.dnn.DNN_BACKEND_OPENCV, size=[64, 64])
+    params = models.resolve(weights="other.onnx")
+    assert params["backend"] == cv2.dnn.DNN_BACKEND_OPENCV and params["cfg"] == "" and params["size"] == (64, 64)
+
+
+def test_empty_configured_thresholds_are_rejected(fresh_registry):
+    with pytest.raises(ValueError):
+        configure_model({"name": "tiny", "thresholds": {}, "models": {"tiny": {"weights": "tiny.weights"}}})
+    assert registry.thresholds
@@ -0,0 +1,92 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from vc.ringbuffer import FrameRing
+
+SHAPE = (8, 12, 3)
+
+
+@pytest.fixture
+def ring():
+    with FrameRing.create(capacity=4, shape=SHAPE, readers=2) as ring:
+        yield ring
+
+
+def _frame(value, shape=SHAPE):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def _read(name, reader, count, out):
+    ring = FrameRing.attach(name)
+    try:
+        for _ in range(count):
+            seq, frame = ring.next(reader, timeout=5.0)
+            out.put((seq, int(frame[0, 0, 0])))
+            ring.release(reader, seq)
+    finally:
+        ring.close()
+
+
+def test_put_and_view(ring):
+    reader = ring.add_reader()
+    assert ring.put(_frame(1)) == 0
+    seq, frame = ring.next(reader, timeout=1.0)
+    assert seq == 0 and np.array_equal(frame, _frame(1))
+    assert not frame.flags.writeable
+    # A frame of another shape is resized into the slot
+    ring.release(reader, seq)
+    ring.put(_frame(2, (16, 24, 3)))
+    seq, frame = ring.next(reader, timeout=1.0)
+    assert seq == 1 and frame.shape == SHAPE and int(frame[0, 0, 0]) == 2
+
+
+def test_next_times_out(ring):
+    reader = ring.add_reader()
+    assert ring.next(reader, timeout=0.01) is None
+
+
+def test_blocking_reader_holds_the_writer(ring):
+    reader = ring.add_reader(blocking=True)
+    for i in range(4):
+        ring.put(_frame(i))
+    with pytest.raises(TimeoutError):
+        ring.put(_frame(4), timeout=0.01)
+    ring.release(reader, 0)
+    assert ring.put(_frame(4), timeout=0.01) == 4
+    assert not ring.valid(0)
+    with pytest.raises(LookupError):
+        ring.view(0)
+
+
+def test_lossy_reader_skips(ring):
+    reader = ring.add_reader(blocking=False)
+    for i in range(10):
+        ring.put(_frame(i))
+    seq, frame = ring.next(reader, timeout=1.0)
+    # Lapped: the oldest frame still in the ring
+    assert seq == 6 and int(frame[0, 0, 0]) == 6
+    assert ring.stats()["DROPPED"] == 6
+
+
+def test_reader_limit(ring):
+    ring.add_reader()
+    second = ring.add_reader()
+    with pytest.raises(ValueError):
+        ring.add_reader()
+    ring.remove_reader(second)
+    assert ring.add_reader() == second
+
+
+def test_other_process(ring):
+    reader = ring.add_reader()
+    out = multiprocessing.get_context("spawn").Queue()
+    process = multiprocessing.get_context("spawn").Process(target=_read, args=(ring.name, reader, 6, out))
+    process.start()
+    for i in range(6):
+        ring.put(_frame(i), timeout=5.0)
+    received = [out.get(timeout=10.0) for _ in range(6)]
+    process.join(10.0)
+    assert process.exitcode == 0
+    assert received == [(i, i) for i in range(6)]
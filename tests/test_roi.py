@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+import pytest
+
+from vc.roi import Roi, rois_from_conf
+
+SHAPE = (640, 1200, 3)
+
+
+class _Detector:
+    # Stand-in network: finds the white rectangles of every tile, in tile pixels
+    params = {"size": (416, 416)}
+
+    def __init__(self):
+        self.sizes = []
+
+    def fixed_size(self):
+        return False
+
+    def detect_vehicles_batch(self, imgs, nmsThreshold=0.3, lanes=None, size=None):
+        self.sizes.append(size)
+        results = []
+        for img in imgs:
+            count, _, stats, _ = cv2.connectedComponentsWithStats((img[..., 0] == 255).astype(np.uint8))
+            boxes = stats[1:, :4].astype(np.int32)
+            results.append((boxes, len(boxes)))
+        return results
+
+
+@pytest.mark.parametrize("tiles", [(1, 1), (2, 1), (3, 2), (4, 3)])
+def test_tiles_share_one_size_and_cover_the_region(tiles):
+    roi = Roi([[100, 50], [1150, 60], [1100, 600], [90, 620]], tiles=tiles, overlap=32)
+    img = np.arange(np.prod(SHAPE[:2]), dtype=np.int64).reshape(SHAPE[:2])
+    crops, offsets = roi.crops(img)
+    x, y, w, h = roi.bounds(SHAPE)
+    assert len(crops) == tiles[0] * tiles[1]
+    assert len({crop.shape for crop in crops}) == 1
+    covered = np.zeros(SHAPE[:2], dtype=bool)
+    for crop, (x0, y0) in zip(crops, offsets):
+        assert np.array_equal(crop, img[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]])
+        covered[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]] = True
+    assert covered[y:y + h, x:x + w].all() and covered.sum() == w * h
+    # Neighbouring tiles overlap by at least the configured pixels
+    columns = sorted({x0 for x0, _ in offsets})
+    for left, right in zip(columns, columns[1:]):
+        assert left + crops[0].shape[1] - right >= 32
+
+
+def test_contains():
+    roi = Roi([[0, 0], [600, 0], [0, 640]])
+    boxes = np.array([[10, 10, 20, 20], [500, 500, 40, 40], [280, 300, 10, 10]])
+    assert roi.contains(boxes, SHAPE).tolist() == [True, False, True]
+    # Polygons are given in working resolution pixels, boxes of a smaller frame are scaled
+    assert roi.contains(boxes // 2, (320, 600, 3)).tolist() == [True, False, True]
+
+
+@pytest.mark.parametrize("tiles", [(1, 1), (2, 1), (2, 2)])
+def test_detect_maps_tile_boxes_back_to_the_frame(tiles):
+    img = np.zeros(SHAPE, dtype=np.uint8)
+    vehicles = [(120, 100, 60, 40), (585, 300, 30, 30), (900, 450, 80, 50), (1150, 600, 40, 30)]
+    for vx, vy, vw, vh in vehicles:
+        img[vy:vy + vh, vx:vx + vw] = 255
+    roi = Roi([[100, 80], [1100, 80], [1100, 580], [100, 580]], tiles=tiles)
+    detector = _Detector()
+    boxes, count = roi.detect(detector, img)
+    # The vehicle across the middle is found by both tiles and kept once, the last one lies outside
+    assert count == 3
+    assert sorted(map(tuple, boxes.tolist())) == sorted(vehicles[:3])
+    crop = roi.crops(img)[0][0]
+    assert detector.sizes == [roi.input_size(detector, crop.shape, SHAPE)]
+
+
+def test_rois_from_conf():
+    polygon = [[0, 0], [10, 0], [0, 10]]
+    assert rois_from_conf(None) == {}
+    assert list(rois_from_conf(polygon)) == ["*"]
+    rois = rois_from_conf({"lane_1.jpg": {"polygon": polygon, "tiles": [2, 1]}})
+    assert rois["lane_1.jpg"].tiles == (2, 1)
+    with pytest.raises(ValueError):
+        Roi([[0, 0], [1, 1]])
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from benchmarks.tiny_model import write_tiny_model
+from runners import Daemon, parse_address
+from vc.cache import configure_cache, get_cache
+from vc.metrics import metrics
+from vc.registry import registry
+
+CONF = {
+    "settings": {"controller": False, "monitor": False},
+    "ARDUINO_CONFIGURATION": {"conf": {"port": "loop://", "baudrate": 9600}, "auto_send": False},
+    "FOLDER_DETAILS": {"Folder 1": {"path": "frames"}},
+}
+
+
+@pytest.fixture
+def tiny_default_model(tmp_path):
+    weights, cfg = write_tiny_model(str(tmp_path / "model"), size=64)
+    defaults, enabled = dict(registry.defaults), metrics.enabled
+    registry.configure(weights=weights, cfg=cfg, size=(64, 64))
+    metrics.enabled = True
+    yield
+    registry.defaults, metrics.enabled = defaults, enabled
+    configure_cache(enabled=False)
+
+
+def _inferences():
+    return sum(s["COUNT"] for s in metrics.snapshot() if s["STAGE"] == "infer")
+
+
+def test_warmup_runs_the_network_past_the_cache(tiny_default_model, tmp_path):
+    configure_cache(str(tmp_path / "detections.sqlite3"))
+    for _ in range(2):
+        # The second daemon starts with the warm-up frame already in the persistent cache
+        daemon = Daemon(CONF, address=str(tmp_path / "daemon.sock"))
+        before = _inferences()
+        daemon.warmup()
+        assert _inferences() - before == 2
+        assert daemon.ready.is_set()
+    assert get_cache().stats()["HITS"] == 0
+
+
+def test_dispatch(tiny_default_model, tmp_path):
+    daemon = Daemon(CONF, address=str(tmp_path / "daemon.sock"))
+    status = daemon.dispatch(json.dumps({"cmd": "status"}))
+    assert status["OK"] and not status["RESULT"]["READY"]
+    assert status["RESULT"]["LINK"] is None
+    assert daemon.dispatch(json.dumps({"cmd": "nope"}))["OK"] is False
+    response = daemon.dispatch(json.dumps({"cmd": "process", "timeout": 0.01}))
+    assert response["OK"] is False and "TimeoutError" in response["ERROR"]
+
+
+def test_parse_address():
+    assert parse_address("127.0.0.1:7000")[1] == ("127.0.0.1", 7000)
+    assert parse_address("/tmp/vehicle_detector.sock")[1] == "/tmp/vehicle_detector.sock"
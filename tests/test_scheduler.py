@@ -0,0 +1,76 @@
+import random
+
+from vc.scheduler import LaneScheduler
+
+
+def _check_heap(scheduler):
+    heap = scheduler._heap
+    for i, lane in enumerate(heap):
+        assert scheduler._pos[lane] == i
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < len(heap):
+                assert scheduler._rank(lane) <= scheduler._rank(heap[child])
+
+
+def test_top_follows_updates():
+    scheduler = LaneScheduler(["a", "b", "c", "d"], clock=lambda: 0.0)
+    rng = random.Random(0)
+    for _ in range(500):
+        lane = rng.choice("abcdef")
+        scheduler.update(lane, rng.randint(0, 20), now=0.0)
+        _check_heap(scheduler)
+        best = min(scheduler._counts, key=scheduler._rank)
+        assert scheduler.top() == best
+    assert len(scheduler) == 6
+
+
+def test_ties_go_to_the_first_lane():
+    scheduler = LaneScheduler(["a", "b", "c"], clock=lambda: 0.0)
+    scheduler.update("c", 5)
+    scheduler.update("b", 5)
+    assert scheduler.top() == "b"
+
+
+def test_decide_by_count():
+    scheduler = LaneScheduler(["a", "b"], clock=lambda: 0.0)
+    assert LaneScheduler().decide(0.0) is None
+    scheduler.update("b", 3)
+    decision = scheduler.decide(0.0)
+    assert (decision.lane, decision.count, decision.reason, decision.changed) == ("b", 3, "count", True)
+    decision = scheduler.decide(1.0)
+    assert decision.lane == "b" and not decision.changed
+    assert scheduler.waited("b", 1.0) == 0.0 and scheduler.waited("a", 1.0) == 1.0
+
+
+def test_min_green_holds_the_lane():
+    scheduler = LaneScheduler(["a", "b"], min_green=10.0, clock=lambda: 0.0)
+    scheduler.update("a", 1)
+    assert scheduler.decide(0.0).lane == "a"
+    scheduler.update("b", 9)
+    decision = scheduler.decide(5.0)
+    assert decision.lane == "a" and decision.reason == "min_green"
+    assert scheduler.decide(10.0).lane == "b"
+
+
+def test_max_wait_forces_the_oldest_red_lane():
+    scheduler = LaneScheduler(["a", "b", "c"], max_wait=30.0, clock=lambda: 0.0)
+    scheduler.update("a", 10)
+    assert scheduler.decide(0.0).lane == "a"
+    decision = scheduler.decide(30.0)
+    assert (decision.lane, decision.reason) == ("b", "max_wait")
+    # a went back of the waiting order, c waited the longest
+    decision = scheduler.decide(60.0)
+    assert (decision.lane, decision.reason) == ("c", "max_wait")
+    assert scheduler.stats()["FORCED"] == 2
+
+
+def test_ranking():
+    scheduler = LaneScheduler(["a", "b", "c"], clock=lambda: 0.0)
+    scheduler.update("a", 1)
+    scheduler.update("b", 7)
+    scheduler.update("c", 4)
+    assert scheduler.ranking() == ["b", "c", "a"]
+    scheduler.decide(0.0)
+    scheduler.update("b", 0)
+    # The green lane stays first
+    assert scheduler.ranking() == ["b", "c", "a"]
@@ -0,0 +1,112 @@
+import os.path
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from vc.sources import ImageFolderSource, ReplaySource, VideoFileSource, open_source
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for i in (10, 2, 1):
+        cv2.imwrite(str(tmp_path / f"lane_{i}.jpg"), np.zeros((8, 8, 3), dtype=np.uint8))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "lane.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    for i in range(3):
+        writer.write(np.full((48, 64, 3), i * 100, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_folder_in_numeric_order(folder):
+    frames = list(ImageFolderSource("north", folder))
+    assert [f.name for f in frames] == ["lane_1.jpg", "lane_2.jpg", "lane_10.jpg"]
+    assert [f.seq for f in frames] == [1, 2, 3]
+    # Decoding is left to the pipeline
+    assert all(f.img is None and os.path.isfile(f.path) and f.lane == "north" for f in frames)
+
+
+def test_folder_loops_until_closed(folder):
+    source = ImageFolderSource("north", folder, loop=True)
+    names = []
+    for frame in source:
+        names.append(frame.name)
+        if len(names) == 7:
+            source.close()
+    assert names == ["lane_1.jpg", "lane_2.jpg", "lane_10.jpg"] * 2 + ["lane_1.jpg"]
+
+
+def test_folder_missing(tmp_path):
+    with pytest.raises(NotADirectoryError):
+        ImageFolderSource("north", str(tmp_path / "missing"))
+
+
+def test_interval_spaces_the_frames(folder):
+    t = time.monotonic()
+    frames = list(ImageFolderSource("north", folder, interval=0.05))
+    assert len(frames) == 3 and time.monotonic() - t >= 0.1
+
+
+def test_video_frames(video):
+    frames = list(VideoFileSource("north", video))
+    assert [f.name for f in frames] == ["north_1", "north_2", "north_3"]
+    assert [f.img.shape for f in frames] == [(48, 64, 3)] * 3
+    assert [int(round(f.img.mean(), -2)) for f in frames] == [0, 100, 200]
+
+
+def test_video_loops(video):
+    source = VideoFileSource("north", video, loop=True)
+    frames = []
+    for frame in source:
+        frames.append(frame)
+        if len(frames) == 5:
+            source.close()
+    assert [int(round(f.img.mean(), -2)) for f in frames] == [0, 100, 200, 0, 100]
+
+
+def test_video_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        VideoFileSource("north", str(tmp_path / "missing.avi"))
+
+
+def test_replay_follows_the_manifest(tmp_path, folder):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(os.path.join(folder, "lane_1.jpg") + "\n")
+    source = ReplaySource("north", str(manifest), poll=0.01)
+    frames = []
+    reader = threading.Thread(target=lambda: frames.extend(source))
+    reader.start()
+    time.sleep(0.05)
+    # Lines appended while the source runs are picked up, EOF ends it
+    with open(manifest, "a") as f:
+        f.write("\n" + os.path.join(folder, "lane_2.jpg") + "\nEOF\n")
+    reader.join(5)
+    assert not reader.is_alive()
+    assert [f.name for f in frames] == ["lane_1.jpg", "lane_2.jpg"]
+    assert source._f.closed
+
+
+def test_replay_close_stops_waiting(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("")
+    source = ReplaySource("north", str(manifest), poll=0.01)
+    reader = threading.Thread(target=lambda: list(source))
+    reader.start()
+    source.close()
+    reader.join(5)
+    assert not reader.is_alive() and source._f.closed
+
+
+def test_open_source(folder, video):
+    assert isinstance(open_source("north", {"type": "folder", "path": folder}), ImageFolderSource)
+    assert isinstance(open_source("north", {"type": "video", "path": video}), VideoFileSource)
+    with pytest.raises(ValueError):
+        open_source("north", {"type": "satellite"})
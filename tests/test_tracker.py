@@ -0,0 +1,52 @@
+import numpy as np
+
+from vc.tracker import LaneTracker, greedy_match, iou_matrix
+
+IMG = np.zeros((100, 200, 3), dtype=np.uint8)
+
+
+def _detections(*frames):
+    # detect callable answering the boxes of one frame per call
+    frames = list(frames)
+
+    def detect(img):
+        boxes = frames.pop(0)
+        return boxes, len(boxes)
+    return detect
+
+
+def test_iou_and_matching():
+    iou = iou_matrix([[0, 0, 10, 10], [50, 50, 10, 10]], [[5, 0, 10, 10], [50, 50, 10, 10]])
+    assert np.isclose(iou[0, 0], 50 / 150) and iou[1, 1] == 1.0 and iou[0, 1] == 0.0
+    assert sorted(greedy_match(iou, 0.3)) == [(0, 0), (1, 1)]
+
+
+def test_counts_confirmed_tracks_only():
+    tracker = LaneTracker(keyframe_interval=1, min_hits=2)
+    detect = _detections([[10, 10, 20, 20]], [[11, 10, 20, 20], [100, 50, 20, 20]])
+    boxes, count = tracker.update(detect, IMG, timestamp=0.0)
+    assert count == 0 and len(boxes) == 0
+    boxes, count = tracker.update(detect, IMG, timestamp=0.1)
+    assert count == 1 and boxes.tolist() == [[11, 10, 20, 20]]
+    assert len(tracker.tracks) == 2
+
+
+def test_dropped_track_is_not_flow():
+    tracker = LaneTracker(keyframe_interval=1, min_hits=2, max_misses=2)
+    box = [[80, 40, 20, 20]]
+    detect = _detections(box, box, [], [], [])
+    for i in range(5):
+        tracker.update(detect, IMG, timestamp=i * 0.1)
+    assert not tracker.tracks
+    assert tracker.crossed == 0
+
+
+def test_track_leaving_the_frame_is_flow():
+    tracker = LaneTracker(keyframe_interval=1, min_hits=2, max_misses=2)
+    # 150 px/s to the right, the prediction of the next frame is out of the frame
+    detect = _detections([[150, 40, 20, 20]], [[165, 40, 20, 20]], [])
+    for timestamp in (0.0, 0.1, 0.5):
+        tracker.update(detect, IMG, timestamp=timestamp)
+    assert not tracker.tracks
+    assert tracker.crossed == 1
+    assert tracker.flow_rate() == 60.0 / tracker.window
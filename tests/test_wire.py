@@ -0,0 +1,41 @@
+import pytest
+
+from wire import FLAG_CRC, crc16, decode_group, encode_group, frame_size
+
+DATA = {
+    "DATA": [
+        {"PATH": "lane_1.jpg", "VEHICLE_COUNT": 12, "INDEX": 0, "POSITION": 1},
+        {"PATH": "lane_2.jpg", "VEHICLE_COUNT": 70000, "INDEX": 1, "POSITION": 0},
+    ],
+    "COUNT": 2,
+}
+
+
+def test_crc16_ccitt_false():
+    # Check value of CRC-16/CCITT-FALSE
+    assert crc16(b"123456789") == 0x29B1
+
+
+@pytest.mark.parametrize("crc", [True, False])
+def test_round_trip(crc):
+    frame = encode_group(DATA, seq=300, crc=crc)
+    assert len(frame) == frame_size(2, crc)
+    assert bool(frame[2] & FLAG_CRC) == crc
+    decoded = decode_group(frame)
+    assert decoded["SEQ"] == 300 & 0xFF
+    assert decoded["COUNT"] == 2
+    assert decoded["DATA"] == [
+        {"INDEX": 0, "VEHICLE_COUNT": 12, "POSITION": 1},
+        {"INDEX": 1, "VEHICLE_COUNT": 0xFFFF, "POSITION": 0},  # saturated
+    ]
+
+
+def test_corrupted_frame():
+    frame = bytearray(encode_group(DATA, seq=1))
+    frame[6] ^= 0xFF
+    with pytest.raises(ValueError, match="crc"):
+        decode_group(bytes(frame))
+    with pytest.raises(ValueError):
+        decode_group(bytes(frame[:-1]))
+    with pytest.raises(ValueError):
+        decode_group(b"\x00" + bytes(frame[1:]))
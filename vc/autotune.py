@@ -0,0 +1,174 @@
+"""
+Benchmarks candidate models and input sizes on sample lane frames and reports the latency of each
+against the agreement of its vehicle counts with a reference (by default the configured MODEL):
+
+    python -m vc.autotune --conf conf.json --frames src/demo_images/set_2 --sizes 416 608 832
+    python -m vc.autotune --models yolov4 yolov4-tiny --sizes 320 416 --budget 0.25
+"""
+import argparse
+import glob
+import json
+import os.path
+import sys
+import time
+
+import numpy as np
+
+from vc.cache import configure_cache
+from vc.detector import load_frame
+from vc.registry import configure_model, model_from_conf, registry
+
+
+def candidates(model_conf: dict, models=None, sizes=None):
+    """
+    Parameters of every (model, size) combination to try
+    :param model_conf: MODEL section of conf.json
+    :param models: model names (defaults to the configured one)
+    :param sizes: square input sizes, multiples of 32 (defaults to the configured size)
+    :return: [(name, size, params)]
+    """
+    results = []
+    for name in models or [model_conf.get("name", "yolov4")]:
+        for size in sizes or [None]:
+            conf = dict(model_conf, name=name)
+            if size is not None:
+                if size % 32:
+                    raise ValueError(f"Input size {size} is not a multiple of 32")
+                conf["size"] = [size, size]
+            params = model_from_conf(conf)
+            results.append((name, params["size"], params))
+    return results
+
+
+def measure(params, frames, repeat=3):
+    """
+    Times the detection of every frame with the given model
+    :param params:
+    :param frames:
+    :param repeat: timed passes over the frames (after one warm-up pass)
+    :return: mean seconds per frame (None when repeat is 0), counts[]
+    """
+    detector = registry.get_detector(**params)
+    # A detector cached before the configuration keeps the thresholds it was built with
+    detector.set_thresholds(registry.thresholds)
+    counts = [detector.detect_vehicles(frame)[1] for frame in frames]  # Warm-up, also the counts
+    if not repeat:
+        return None, counts
+    t = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            detector.detect_vehicles(frame)
+    return (time.perf_counter() - t) / (repeat * len(frames)), counts
+
+
+def agreement(counts, reference):
+    """
+    Compares the vehicle counts of a candidate with the reference ones
+    :param counts:
+    :param reference:
+    :return: {"MAE": mean absolute count error, "EXACT": share of identical counts, "ORDER": share of lane pairs
+             ranked the same way (what the traffic decision depends on)}
+    """
+    counts, reference = np.asarray(counts), np.asarray(reference)
+    i, j = np.triu_indices(len(counts), k=1)
+    same_order = np.sign(counts[i] - counts[j]) == np.sign(reference[i] - reference[j])
+    return {
+        "MAE": float(np.abs(counts - reference).mean()),
+        "EXACT": float((counts == reference).mean()),
+        "ORDER": float(same_order.mean()) if len(i) else 1.0,
+    }
+
+
+def autotune(model_conf: dict, paths, models=None, sizes=None, repeat=3, reference=None, budget=None,
+             min_order=1.0):
+    """
+    Benchmarks every candidate and recommends the fastest one that fits the budget and ranks the lanes
+    like the reference
+    :param model_conf: MODEL section of conf.json
+    :param paths: sample lane frames
+    :param models:
+    :param sizes:
+    :param repeat:
+    :param reference: (name, size) the counts are compared with, defaults to the configured model
+    :param budget: seconds per frame allowed, None does not limit the latency
+    :param min_order: lowest ORDER agreement accepted
+    :return: {"RESULTS": [...], "RECOMMENDED": result or None}
+    """
+    # Sample frames are cached by content, the cache must not hide the inference time
+    configure_cache(enabled=False)
+    # Every candidate counts with the configured class thresholds
+    configure_model(model_conf)
+
+    frames = [load_frame(path) for path in paths]
+    if not frames:
+        raise ValueError("No sample frames to benchmark")
+    ref_conf = dict(model_conf)
+    if reference is not None:
+        ref_conf.update(name=reference[0], size=[reference[1], reference[1]])
+    _, ref_counts = measure(model_from_conf(ref_conf), frames, repeat=0)
+
+    results = []
+    for name, size, params in candidates(model_conf, models, sizes):
+        latency, counts = measure(params, frames, repeat)
+        results.append(dict(MODEL=name, SIZE=list(size), LATENCY=latency, COUNTS=counts,
+                            **agreement(counts, ref_counts)))
+    eligible = [r for r in results if r["ORDER"] >= min_order and (budget is None or r["LATENCY"] <= budget)]
+    return {
+        "REFERENCE": {"MODEL": ref_conf.get("name", "yolov4"), "SIZE": list(model_from_conf(ref_conf)["size"]),
+                      "COUNTS": ref_counts},
+        "RESULTS": results,
+        "RECOMMENDED": min(eligible, key=lambda r: r["LATENCY"]) if eligible else None,
+    }
+
+
+def report(results):
+    """
+    Prints the latency and agreement of every candidate
+    :param results: autotune results
+    :return: None
+    """
+    print(f"{'model':<16}{'size':>10}{'ms/frame':>10}{'mae':>8}{'exact':>8}{'order':>8}")
+    for r in results["RESULTS"]:
+        size = "x".join(map(str, r["SIZE"]))
+        print(f"{r['MODEL']:<16}{size:>10}{r['LATENCY'] * 1000:>10.1f}{r['MAE']:>8.2f}{r['EXACT']:>8.2f}"
+              f"{r['ORDER']:>8.2f}")
+    best = results["RECOMMENDED"]
+    if best is None:
+        print("No candidate fits the budget and agreement")
+    else:
+        print(f"Recommended: \"name\": \"{best['MODEL']}\", \"size\": {best['SIZE']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conf", default="conf.json")
+    parser.add_argument("--frames", default="src/demo_images/set_2", help="folder of sample lane frames (jpg)")
+    parser.add_argument("--models", nargs="*", help="model names of the MODEL section (the configured one by default)")
+    parser.add_argument("--sizes", nargs="*", type=int, help="square input sizes (the configured one by default)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--reference", nargs=2, metavar=("MODEL", "SIZE"),
+                        help="model and size the counts are compared with (the configured model by default)")
+    parser.add_argument("--budget", type=float, help="seconds per frame allowed")
+    parser.add_argument("--min-order", type=float, default=1.0, help="lowest share of lane pairs ranked alike")
+    parser.add_argument("--output", help="writes the results to this json file")
+    args = parser.parse_args(argv)
+
+    with open(args.conf, "r") as f:
+        model_conf = json.load(f)["MODEL"]
+    paths = sorted(glob.glob(os.path.join(args.frames, "*.jpg")))
+    reference = (args.reference[0], int(args.reference[1])) if args.reference else None
+    try:
+        results = autotune(model_conf, paths, models=args.models, sizes=args.sizes, repeat=args.repeat,
+                           reference=reference, budget=args.budget, min_order=args.min_order)
+    except (ValueError, OSError) as e:
+        sys.stderr.write(str(e) + "\n")
+        return 1
+    report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os.path
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# Hits whose access time is kept in memory before being written
+ACCESS_BATCH = 1024
+
+
+class DetectionCache:
+    """
+        On-disk (sqlite) cache of detection results keyed by frame content hash + model parameters,
+        least recently used entries are evicted once max_entries is reached
+    """
+
+    def __init__(self, path="cache/detections.sqlite3", max_entries=100000):
+        """
+        :param path: sqlite file (":memory:" keeps the cache in memory)
+        :param max_entries: size cap of the cache
+        """
+        self.path = path
+        self.max_entries = max_entries
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS detections "
+                         "(key TEXT PRIMARY KEY, boxes BLOB, count INTEGER, accessed REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS detections_accessed ON detections (accessed)")
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        # Access times of the hits, written on the next put (or close) instead of a commit per hit
+        self._accessed = {}
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return repr((self.path, self._entries, self.hits, self.misses))
+
+    @staticmethod
+    def make_key(img, params: dict):
+        """
+        Hashes the frame pixels together with the detection parameters
+        :param img:
+        :param params:
+        :return: key: str
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(json.dumps(params, sort_keys=True, default=str).encode("ascii"))
+        h.update(repr(img.shape).encode("ascii"))
+        h.update(np.ascontiguousarray(img).data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached detection for the key
+        :param key:
+        :return: (vehicle_boxes[], vehicle_count) or None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT boxes, count FROM detections WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._flush_accessed()
+                self._db.commit()
+        boxes = np.frombuffer(row[0], dtype=np.int32).reshape(-1, 4)
+        return boxes.copy(), row[1]
+
+    def put(self, key, vehicle_boxes, vehicle_count):
+        """
+        Stores a detection, evicting the least recently used entries when full
+        :param key:
+        :param vehicle_boxes:
+        :param vehicle_count:
+        :return: None
+        """
+        boxes = np.asarray(vehicle_boxes, dtype=np.int32).reshape(-1, 4).tobytes()
+        with self._lock:
+            self._accessed.pop(key, None)
+            self._flush_accessed()
+            exists = self._db.execute("SELECT 1 FROM detections WHERE key = ?", (key,)).fetchone() is not None
+            self._db.execute("INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?)",
+                             (key, boxes, int(vehicle_count), time.time()))
+            if not exists:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                # Evicting a tenth of the cache at once keeps eviction off the common path
+                excess = self._entries - self.max_entries + max(self.max_entries // 10, 1)
+                cursor = self._db.execute("DELETE FROM detections WHERE key IN "
+                                          "(SELECT key FROM detections ORDER BY accessed LIMIT ?)", (excess,))
+                self.evictions += cursor.rowcount
+                self._entries = self._db.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+            self._db.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the number of entries
+        :return: stats: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            "PATH": self.path,
+            "ENTRIES": self._entries,
+            "MAX_ENTRIES": self.max_entries,
+            "HITS": self.hits,
+            "MISSES": self.misses,
+            "EVICTIONS": self.evictions,
+            "HIT_RATE": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._accessed.clear()
+            self._db.execute("DELETE FROM detections")
+            self._db.commit()
+            self._entries = 0
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._flush_accessed()
+            self._db.commit()
+            self._db.close()
+            self._closed = True
+
+    def _flush_accessed(self):
+        # Called with the lock held, the caller commits
+        if self._accessed:
+            self._db.executemany("UPDATE detections SET accessed = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+
+_cache = None
+
+
+def configure_cache(path="cache/detections.sqlite3", max_entries=100000, enabled=True):
+    """
+    Sets up the process wide detection cache used by VehicleDetector (settings.cache in conf.json)
+    :param path:
+    :param max_entries:
+    :param enabled:
+    :return: cache: DetectionCache or None
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = DetectionCache(path, max_entries) if enabled else None
+    return _cache
+
+
+def get_cache():
+    """
+    Returns the process wide detection cache
+    :return: cache: DetectionCache or None
+    """
+    return _cache
@@ -0,0 +1,135 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Size of the monitor mosaic (width, height)
+MOSAIC_SIZE = (1360, 600)
+
+
+def grid(count, mid_pos=None):
+    """
+    Tiles per row of the mosaic: mid_pos lanes on the top row and the others below
+    (two lanes are stacked, a single lane fills the canvas)
+    :param count:
+    :param mid_pos: defaults to half the lanes
+    :return: rows: tuple
+    """
+    if count <= 1:
+        return (1,)
+    mid_pos = count // 2 if mid_pos is None else mid_pos
+    if count == 2 or not 0 < mid_pos < count:
+        return (1, 1) if count == 2 else (count,)
+    return mid_pos, count - mid_pos
+
+
+class Compositor:
+    """
+        Writes every lane, downscaled, straight into its tile of a preallocated canvas.
+        The canvas is reused by every compose() (copy it to keep a mosaic), a tile is only redrawn
+        when the token given with its frame changed.
+    """
+
+    def __init__(self, size=MOSAIC_SIZE, rows=(1,)):
+        """
+        :param size: (width, height) of the canvas
+        :param rows: number of tiles of every row, see grid()
+        """
+        self.size = tuple(size)
+        self.rows = tuple(rows)
+        self.canvas = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._tiles = self._layout()
+        self._tokens = [None] * len(self._tiles)
+        self.drawn = 0
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __repr__(self):
+        return repr((self.size, self.rows, self.drawn, self.skipped))
+
+    def _layout(self):
+        width, height = self.size
+        tiles = []
+        for r, columns in enumerate(self.rows):
+            y0, y1 = r * height // len(self.rows), (r + 1) * height // len(self.rows)
+            for c in range(columns):
+                tiles.append((c * width // columns, y0, (c + 1) * width // columns, y1))
+        return tiles
+
+    def tile(self, i):
+        """
+        View of the canvas of tile i
+        :param i:
+        :return: view: np.ndarray
+        """
+        x0, y0, x1, y1 = self._tiles[i]
+        return self.canvas[y0:y1, x0:x1]
+
+    def draw(self, i, frame, token=None):
+        """
+        Downscales frame into tile i
+        :param i:
+        :param frame:
+        :param token: identifies the frame content (e.g. its sequence number), None always redraws
+        :return: drawn: bool
+        """
+        if token is not None and token == self._tokens[i]:
+            self.skipped += 1
+            return False
+        view = self.tile(i)
+        if frame.shape[:2] == view.shape[:2]:
+            view[...] = frame
+        else:
+            cv2.resize(frame, (view.shape[1], view.shape[0]), dst=view)
+        self._tokens[i] = token
+        self.drawn += 1
+        return True
+
+    def invalidate(self, i=None):
+        """
+        Forces tile i (every tile when None) to be redrawn
+        :param i:
+        :return: None
+        """
+        if i is None:
+            self._tokens = [None] * len(self._tiles)
+        else:
+            self._tokens[i] = None
+
+    def compose(self, frames, tokens=None):
+        """
+        Draws the changed frames and returns the canvas
+        :param frames: one frame per tile, in row order
+        :param tokens: one token per frame (see draw)
+        :return: canvas: np.ndarray (reused)
+        """
+        if len(frames) != len(self._tiles):
+            raise ValueError(f"{len(frames)} frames for a mosaic of {len(self._tiles)} tiles")
+        tokens = tokens if tokens is not None else [None] * len(frames)
+        for i, (frame, token) in enumerate(zip(frames, tokens)):
+            self.draw(i, frame, token)
+        return self.canvas
+
+
+_compositors = {}
+_compositors_lock = threading.Lock()
+
+
+def get_compositor(key, count, mid_pos=None, size=MOSAIC_SIZE):
+    """
+    Returns the compositor of a monitor (e.g. a group name), kept across cycles while its layout holds
+    :param key:
+    :param count: number of lanes
+    :param mid_pos: lanes on the top row
+    :param size:
+    :return: compositor: Compositor
+    """
+    rows = grid(count, mid_pos)
+    with _compositors_lock:
+        compositor = _compositors.get(key)
+        if compositor is None or compositor.rows != rows or compositor.size != tuple(size):
+            compositor = Compositor(size, rows)
+            _compositors[key] = compositor
+        return compositor
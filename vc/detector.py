@@ -1,83 +1,325 @@
 import os.path
-import time
-from datetime import datetime
+import struct
 
 import cv2
 import numpy as np
 
+from vc.cache import get_cache
+from vc.metrics import metrics
+from vc.registry import get_detector, get_model, registry
+from vc.scheduler import LaneScheduler
 
-def is_similar(image1, image2):
+
+def is_similar(image1, image2, threshold=None, size=(64, 36)):
     """
     Compares two images for similarities
     :param image1:
     :param image2:
+    :param threshold: None compares exactly, otherwise the images are similar when the mean absolute
+                      difference of their downscaled grayscale thumbnails is at most threshold (0-255)
+    :param size: thumbnail size
     :return:  bool
     """
-    return image1.shape == image2.shape and not (np.bitwise_xor(image1, image2).any())
+    if threshold is None:
+        return image1.shape == image2.shape and not (np.bitwise_xor(image1, image2).any())
+    return frame_difference(thumbnail(image1, size), thumbnail(image2, size)) <= threshold
+
+
+def thumbnail(image, size=(64, 36)):
+    """
+    Downscaled grayscale version of an image, cheap to compare
+    :param image:
+    :param size:
+    :return: thumbnail
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def frame_difference(thumb1, thumb2):
+    """
+    Mean absolute difference between two thumbnails
+    :param thumb1:
+    :param thumb2:
+    :return: difference: float (0-255)
+    """
+    return float(cv2.absdiff(thumb1, thumb2).mean())
 
 
-_current_time = datetime.now()
+# JPEG start of frame markers (every SOFn but DHT, JPG and DAC)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
 
 
-# Printing with timestamp
-def print_timestamp(threadName, delay, counter):
+def jpeg_size(path):
     """
-    Prints the current timestamp with message provided
-    :param threadName:
-    :param delay:
-    :param counter:
-    :return: None
+    Reads the dimensions of a JPEG from its header without decoding it
+    :param path:
+    :return: (width, height) or None when the file is not a JPEG
     """
-    global _current_time
-    while counter:
-        delta = _current_time - datetime.now()
-        time.sleep(delay)
-        # time difference in milliseconds
-        ms = -1 * delta.total_seconds() * 1000
-        d = 'milliseconds'
-        if ms > 10000:
-            ms = -1 * delta.total_seconds()
-            d = 'seconds'
-        print("%s: %s : %f %s" % (threadName, time.ctime(time.time()), ms, d))
-        counter -= 1
-        # time difference in seconds
-        # print(f"Time difference is {-1*delta.total_seconds()} seconds")
-        _current_time = datetime.now()
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(2)
+            while len(marker) == 2 and marker[1] == 0xFF:
+                marker = marker[1:] + f.read(1)  # Fill bytes
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD8:
+                continue  # Markers without a payload
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if marker[1] in _SOF_MARKERS:
+                header = f.read(5)
+                if len(header) < 5:
+                    return None
+                _, height, width = struct.unpack(">BHH", header)
+                return width, height
+            f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+def read_image(path, size=None):
+    """
+    Decodes an image, JPEGs at least twice as large as size are decoded at 1/2, 1/4 or 1/8 of their
+    resolution (IMREAD_REDUCED_*) which skips most of the decoding work
+    :param path:
+    :param size: (width, height) the image is resized to afterwards, None decodes at full resolution
+    :return: image
+    """
+    flag = cv2.IMREAD_COLOR
+    source = jpeg_size(path) if size is not None else None
+    if source is not None:
+        for factor, reduced in _REDUCED_FLAGS:
+            if source[0] // factor >= size[0] and source[1] // factor >= size[1]:
+                flag = reduced
+                break
+    return cv2.imread(path, flag)
+
+
+def load_frame(path, size=(1200, 640), lane=None):
+    """
+    Reads an image from disk and resizes it to the working resolution (a single resample, large JPEGs
+    are decoded at a reduced scale still covering it, see read_image)
+    :param path:
+    :param size: (width, height), every frame the network sees is read at the working resolution so that
+                 blobFromImage resizes them all the same way
+    :param lane: metrics label
+    :return: image
+    """
+    with metrics.span("decode", lane):
+        img = read_image(path, size)
+    if img.shape[1::-1] == tuple(size):
+        return img
+    with metrics.span("resize", lane):
+        return cv2.resize(img, tuple(size))
+
+
+def scale_boxes(boxes, shape, target_shape):
+    """
+    Maps (x, y, w, h) boxes found on a frame of one shape to a frame of another
+    :param boxes:
+    :param shape: (height, width, ...) the boxes refer to
+    :param target_shape:
+    :return: boxes: np.ndarray int32 (N, 4)
+    """
+    if len(boxes) == 0 or tuple(shape[:2]) == tuple(target_shape[:2]):
+        return boxes
+    sy, sx = target_shape[0] / shape[0], target_shape[1] / shape[1]
+    scaled = np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * (sx, sy, sx, sy)
+    return scaled.round().astype(np.int32)
 
 
 class VehicleDetector:
     """
         Main Vehicle Detection Class
     """
+    __slots__ = ("params", "_loaded", "model", "classes_allowed", "thresholds", "_threshold_table")
+
+    def __init__(self, weights=None, cfg=None, size=None, backend=None, target=None, thresholds=None, shared=None):
+        # SetUp Network (loaded once per process and shared through the registry, None uses the configured model)
+        if shared is not None:
+            # Same network as an existing detector, it does not count as another user of the model
+            self.params, self._loaded = shared.params, shared._loaded
+        else:
+            self.params = registry.resolve(weights=weights, cfg=cfg, size=size, backend=backend, target=target)
+            self._loaded = get_model(**self.params)
+        self.model = self._loaded.model
 
-    def __init__(self):
-        # SetUp and Load Network
-        net = cv2.dnn.readNet("dnn_model/yolov4.weights", "dnn_model/yolov4.cfg")
-        self.model = cv2.dnn_DetectionModel(net)
-        self.model.setInputParams(size=(832, 832), scale=1 / 255)
+        # Allow classes containing Vehicles only, each with its own minimum score
+        self.set_thresholds(registry.thresholds if thresholds is None else thresholds)
 
-        # Allow classes containing Vehicles only
-        self.classes_allowed = [2, 3, 5, 6, 7]
+    def set_thresholds(self, thresholds):
+        """
+        Sets the minimum score of every vehicle class, detections of other classes are dropped
+        :param thresholds: {class_id: score}, at least one class
+        :return: None
+        """
+        thresholds = {int(class_id): float(score) for class_id, score in thresholds.items()}
+        if not thresholds:
+            raise ValueError("No vehicle class in thresholds, nothing could ever be detected")
+        if min(thresholds) < 0:
+            raise ValueError(f"Negative class id in thresholds {thresholds}")
+        self.thresholds = thresholds
+        self.classes_allowed = sorted(self.thresholds)
+        # Lookup table indexed by class id, classes not allowed can never pass
+        self._threshold_table = np.full(max(self.classes_allowed, default=-1) + 1, np.inf, dtype=np.float32)
+        self._threshold_table[self.classes_allowed] = [self.thresholds[c] for c in self.classes_allowed]
 
-    def detect_vehicles(self, img, nmsThreshold=0.3):
+    def min_threshold(self):
+        """
+        Lowest score accepted for any class, the confidence threshold handed to the network post processing
+        :return: score: float
+        """
+        return min(self.thresholds.values(), default=0.5)
+
+    def detect_vehicles(self, img, nmsThreshold=0.3, lane=None):
         """
         The function which detects the vehicles in an image
         :param img:
         :param nmsThreshold:
+        :param lane: metrics label
         :return: vehicle_boxes[]:
         """
-        vehicles_boxes = []
-        class_ids, scores, boxes = self.model.detect(img, nmsThreshold=nmsThreshold)
-        for class_id, score, box in zip(class_ids, scores, boxes):
-            if score < 0.5:
-                # Skip detection with low confidence
-                continue
+        cache = get_cache()
+        if cache is None:
+            return self._detect(img, nmsThreshold, lane)
+        key = cache.make_key(img, self.cache_params(nmsThreshold))
+        result = cache.get(key)
+        if result is None:
+            result = self._detect(img, nmsThreshold, lane)
+            cache.put(key, *result)
+        return result
+
+    def _detect(self, img, nmsThreshold, lane=None):
+        if self._loaded.raw:
+            return self._detect_batch([img], nmsThreshold, self.min_threshold(), [lane])[0]
+        with metrics.span("infer", lane), self._loaded.lock:
+            class_ids, scores, boxes = self.model.detect(img, confThreshold=self.min_threshold(),
+                                                         nmsThreshold=nmsThreshold)
+        with metrics.span("nms_filter", lane):
+            return self.filter_vehicles(class_ids, scores, boxes)
+
+    def cache_params(self, nmsThreshold, confThreshold=None, size=None):
+        """
+        Returns every parameter affecting the detection result, part of the cache key
+        :param nmsThreshold:
+        :param confThreshold:
+        :param size: network input size when it differs from the model's
+        :return: params: dict
+        """
+        params = dict(self.params, nms=nmsThreshold,
+                      conf=self.min_threshold() if confThreshold is None else confThreshold,
+                      thresholds=sorted(self.thresholds.items()))
+        if size is not None:
+            params["size"] = tuple(size)
+        return params
+
+    def fixed_size(self):
+        """
+        Whether the network only accepts its configured input size (ONNX graphs)
+        :return: bool
+        """
+        return self._loaded.raw
+
+    def filter_vehicles(self, class_ids, scores, boxes):
+        """
+        Keeps the confident detections of vehicle classes
+        :param class_ids:
+        :param scores:
+        :param boxes:
+        :return: vehicle_boxes: np.ndarray int32 (N, 4), vehicle_count: int
+        """
+        class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        # Classes beyond the table are not vehicles, the others need their class' score
+        table = self._threshold_table
+        keep = scores >= table[np.minimum(class_ids, len(table) - 1)]
+        keep &= class_ids < len(table)
 
-            if class_id in self.classes_allowed:
-                vehicles_boxes.append(box)
+        vehicle_boxes = boxes[keep]
+        return vehicle_boxes, len(vehicle_boxes)  # Return vehicle_boxes and vehicle count
 
-        vehicle_count = len(vehicles_boxes)  # Get vehicle count
-        return vehicles_boxes, vehicle_count  # Return vehicle_boxes and vehicle count
+    def detect_vehicles_batch(self, imgs, nmsThreshold=0.3, confThreshold=None, lanes=None, size=None):
+        """
+        Detects the vehicles of several images with a single forward pass
+        :param imgs:
+        :param nmsThreshold:
+        :param confThreshold: defaults to the lowest class threshold
+        :param lanes: metrics label of every image
+        :param size: network input size (width, height), defaults to the model's (see vc.roi.Roi.input_size)
+        :return: [(vehicle_boxes[], vehicle_count)]
+        """
+        if len(imgs) == 0:
+            return []
+        confThreshold = self.min_threshold() if confThreshold is None else confThreshold
+        cache = get_cache()
+        if cache is None:
+            return self._detect_batch(imgs, nmsThreshold, confThreshold, lanes, size)
+        # Only the frames missing from the cache go through the network
+        params = self.cache_params(nmsThreshold, confThreshold, size)
+        keys = [cache.make_key(img, params) for img in imgs]
+        results = [cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            detected = self._detect_batch([imgs[i] for i in missing], nmsThreshold, confThreshold,
+                                          None if lanes is None else [lanes[i] for i in missing], size)
+            for i, result in zip(missing, detected):
+                cache.put(keys[i], *result)
+                results[i] = result
+        return results
+
+    def _detect_batch(self, imgs, nmsThreshold, confThreshold, lanes=None, size=None):
+        net = self._loaded.net
+        lanes = lanes if lanes is not None else [None] * len(imgs)
+        with metrics.span("infer"):
+            # One NCHW blob for every frame
+            blob = cv2.dnn.blobFromImages(imgs, scalefactor=1 / 255, size=tuple(size or self.params["size"]),
+                                          swapRB=False, crop=False)
+            with self._loaded.lock:
+                net.setInput(blob)
+                outs = net.forward(net.getUnconnectedOutLayersNames())
+        # Rows of every output layer per frame: cx, cy, w, h, objectness, class scores...
+        rows = np.concatenate([out.reshape(len(imgs), -1, out.shape[-1]) for out in outs], axis=1)
+        results = []
+        for frame_rows, img, lane in zip(rows, imgs, lanes):
+            with metrics.span("nms_filter", lane):
+                results.append(self._decode(frame_rows, img.shape, nmsThreshold, confThreshold))
+        return results
+
+    def _decode(self, rows, shape, nmsThreshold, confThreshold):
+        """
+        Decodes the network rows of a single frame and applies per class nms
+        :param rows:
+        :param shape:
+        :param nmsThreshold:
+        :param confThreshold:
+        :return: vehicle_boxes[], vehicle_count: int
+        """
+        h, w = shape[:2]
+        class_ids = rows[:, 5:].argmax(axis=1)
+        scores = rows[np.arange(len(rows)), 5 + class_ids]
+        keep = scores >= confThreshold
+        rows, class_ids, scores = rows[keep], class_ids[keep], scores[keep]
+        # Relative centre boxes to pixel (x, y, w, h) clipped to the frame, with the integer arithmetic of
+        # dnn_DetectionModel (float32 products truncated, then integer halving) so both paths keep the same boxes
+        rows = rows.astype(np.float32, copy=False)
+        cx = (rows[:, 0] * np.float32(w)).astype(np.int32)
+        cy = (rows[:, 1] * np.float32(h)).astype(np.int32)
+        bw = (rows[:, 2] * np.float32(w)).astype(np.int32)
+        bh = (rows[:, 3] * np.float32(h)).astype(np.int32)
+        x = np.clip(cx - bw // 2, 0, w - 1)
+        y = np.clip(cy - bh // 2, 0, h - 1)
+        bw = np.clip(bw, 1, w - x)
+        bh = np.clip(bh, 1, h - y)
+        boxes = np.stack([x, y, bw, bh], axis=1)
+        indices = cv2.dnn.NMSBoxesBatched(boxes.tolist(), scores.tolist(), class_ids.tolist(),
+                                          confThreshold, nmsThreshold)
+        indices = np.array(indices, dtype=int).reshape(-1)
+        return self.filter_vehicles(class_ids[indices], scores[indices], boxes[indices])
 
     def append_boxes(self, img, vehicle_boxes, vehicle_count):
         """
@@ -87,39 +329,81 @@ class VehicleDetector:
         :param vehicle_count:
         :return: None
         """
-        for box in vehicle_boxes:
-            x, y, w, h = box
-
-            cv2.rectangle(img, (x, y), (x + w, y + h), (25, 0, 180), 3)
+        boxes = np.asarray(vehicle_boxes, dtype=np.int32).reshape(-1, 4)
+        if not len(boxes):
+            return None
+        # Corners of every box, drawn in a single call
+        x, y, w, h = boxes.T
+        corners = np.stack([x, y, x + w, y, x + w, y + h, x, y + h], axis=1).reshape(-1, 4, 2)
+        cv2.polylines(img, list(corners), True, (25, 0, 180), 3)
 
-            cv2.putText(img, "Vehicle Count: " + str(vehicle_count), (20, 50), 5, 2, (100, 200, 0), 3)
+        cv2.putText(img, "Vehicle Count: " + str(vehicle_count), (20, 50), 5, 2, (100, 200, 0), 3)
 
         return None
 
 
+# Shape of the frames kept in the group's contiguous buffer (see Image.__init__)
+FRAME_SHAPE = (640, 1200, 3)
+
+
 # Image Class Wrapper
 class Group:
     """ This is a wrapper for images with detect capabilities
+        Images are kept in a growable object array and their frames in a single contiguous
+        uint8 buffer (capacity * 640 * 1200 * 3), both doubling when full so appends don't copy every time
     """
 
     # Class Setup
-    def __init__(self, name, images=None):
+    def __init__(self, name, images=None, detector=None, capacity=4, rois=None, scheduler=None):
         """
                 Init method for Group
                 :param name:
                 :param images:
+                :param detector: shared VehicleDetector (defaults to the registry's)
+                :param capacity: number of preallocated image slots
+                :param rois: image name ("*" for every image) -> Roi, see vc.roi.rois_from_conf
+                :param scheduler: LaneScheduler fed with the count of every image (by index)
                 :returns self
         """
 
-        if images is None:
-            images = np.array([], dtype=Image)
-        self._images = images
-        self._sorted_images = np.array([], dtype=Image)
+        images = [] if images is None else list(images)
+        capacity = max(capacity, len(images), 1)
+        self._slots = np.empty(capacity, dtype=object)
+        self._slots[:len(images)] = images
+        self._size = len(images)
+        self._counts = np.zeros(capacity, dtype=np.int32)
+        self._frames = None  # Allocated on the first stored frame
+        self._sorted_images = np.array([], dtype=object)
         self.name = name
         self._img_data = {}
+        self.detector = detector if detector is not None else get_detector()
+        self.rois = rois if rois is not None else {}
+        self.scheduler = scheduler if scheduler is not None else LaneScheduler()
+        for index in range(self._size):
+            self.scheduler.add_lane(index)
 
     def __repr__(self):
-        return repr((self.name, len(self._images)))
+        return repr((self.name, self._size))
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, capacity):
+        """
+        Reallocates the slots (and frame buffer) with the given capacity
+        :param capacity:
+        :return: None
+        """
+        slots = np.empty(capacity, dtype=object)
+        slots[:self._size] = self._slots[:self._size]
+        self._slots = slots
+        counts = np.zeros(capacity, dtype=np.int32)
+        counts[:self._size] = self._counts[:self._size]
+        self._counts = counts
+        if self._frames is not None:
+            frames = np.empty((capacity,) + FRAME_SHAPE, dtype=np.uint8)
+            frames[:self._size] = self._frames[:self._size]
+            self._frames = frames
 
     # Adds image to list
     def append_image(self, img):
@@ -128,8 +412,45 @@ class Group:
         :param img:
         :return: (list , index)
         """
-        self._images = np.append(self._images, [img])
-        return self._images, len(self._images) - 1
+        if self._size == len(self._slots):
+            self._grow(2 * len(self._slots))
+        index = self._size
+        self._slots[index] = img
+        self._size += 1
+        self.scheduler.add_lane(index)
+        return self.get_images(), index
+
+    def store_frame(self, i, frame):
+        """
+        Copies the frame of image i into the contiguous buffer
+        :param i:
+        :param frame:
+        :return: stored: bool (False when the frame doesn't have the buffer's shape)
+        """
+        if frame.shape != FRAME_SHAPE or frame.dtype != np.uint8:
+            return False
+        if self._frames is None:
+            self._frames = np.empty((len(self._slots),) + FRAME_SHAPE, dtype=np.uint8)
+        self._frames[i] = frame
+        return True
+
+    def get_frame(self, i):
+        """
+        Returns the buffered frame of image i (a view, drawing on it changes the buffer)
+        :param i:
+        :return: image
+        """
+        return self._frames[i]
+
+    def set_count(self, i, count):
+        """
+        Records the vehicle count of image i for sorting and scheduling
+        :param i:
+        :param count:
+        :return: None
+        """
+        self._counts[i] = count
+        self.scheduler.update(i, count)
 
     # Returns Image list
     def get_images(self):
@@ -137,7 +458,50 @@ class Group:
         Retrieves Image List
         :return: images[]
         """
-        return self._images
+        return self._slots[:self._size]
+
+    def detect(self, batch_size=4, nmsThreshold=0.3):
+        """
+        Detects the vehicles of every image in the group, batch_size frames per forward pass
+        :param batch_size:
+        :param nmsThreshold:
+        :return: None
+        """
+        images = self.get_images()
+        # Images with a region of interest are detected on their own crops
+        for img in images:
+            if self.get_roi(img.name) is not None:
+                frame = img.get_input()
+                img.set_detection(*self.detect_frame(frame, img.name, nmsThreshold), shape=frame.shape)
+        images = [img for img in images if self.get_roi(img.name) is None]
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            inputs = [img.get_input() for img in chunk]
+            results = self.detector.detect_vehicles_batch(inputs, nmsThreshold=nmsThreshold,
+                                                          lanes=[img.name for img in chunk])
+            for img, frame, (vehicle_boxes, vehicle_count) in zip(chunk, inputs, results):
+                img.set_detection(vehicle_boxes, vehicle_count, shape=frame.shape)
+
+    def get_roi(self, name):
+        """
+        Returns the region of interest of an image
+        :param name: image name
+        :return: Roi or None
+        """
+        return self.rois.get(name, self.rois.get("*"))
+
+    def detect_frame(self, frame, name, nmsThreshold=0.3):
+        """
+        Detects the vehicles of a frame of the image name, within its region of interest if any
+        :param frame:
+        :param name:
+        :param nmsThreshold:
+        :return: vehicle_boxes[], vehicle_count: int
+        """
+        roi = self.get_roi(name)
+        if roi is None:
+            return self.detector.detect_vehicles(frame, nmsThreshold, lane=name)
+        return roi.detect(self.detector, frame, nmsThreshold, lane=name)
 
     # Retrieves image at index
     def get_image(self, i):
@@ -146,21 +510,27 @@ class Group:
         :param i:
         :return: Image
         """
-        return self._images[i]
+        return self.get_images()[i]
 
     # Sorts Image List
-    def sort(self, key=lambda image: image.get_vehicle_count(), reverse=False):
+    def sort(self, key=None, reverse=False):
         """
         Returns the sorted and unsorted image list of the group
-        :param key:
+        :param key: defaults to the vehicle count, sorted on the count array without calling back into python
         :param reverse:
         :return:  sorted_images, unsorted_images
         """
-        self._sorted_images = np.array(sorted(self._images, key=key, reverse=reverse))
-        # print(self.__sorted_images)
-        for i, img in enumerate(self._sorted_images):
-            self._images[img.get_index()].set_position(i)
-        return self._sorted_images, self._images
+        images = self.get_images()
+        if key is None:
+            counts = self._counts[:self._size]
+            # Stable like sorted(), ties keep their original order in both directions
+            order = np.argsort(-counts if reverse else counts, kind="stable")
+        else:
+            order = np.array(sorted(range(self._size), key=lambda i: key(images[i]), reverse=reverse), dtype=int)
+        self._sorted_images = images[order]
+        for position, img in enumerate(self._sorted_images):
+            img.set_position(position)
+        return self._sorted_images, images
 
     def get_images_data(self):
         i_list, _ = self.sort(reverse=True)
@@ -185,19 +555,41 @@ class Image(VehicleDetector):
         path, group :arg,
         Image :returns ,
         """
+    __slots__ = ("_name", "_path", "_img", "_stored", "_lazy", "_vehicle_boxes", "_vehicle_count", "_group",
+                 "_index", "_position", "_rendered")
 
-    def __init__(self, path, group: Group):
-        super().__init__()
+    def __init__(self, path, group: Group, detect=True, img=None, lazy=False):
+        """
+        :param path:
+        :param group:
+        :param detect: detects on construction (False defers to Group.detect or set_detection)
+        :param img: already decoded frame
+        :param lazy: keeps only path, metadata and detection results, pixels are decoded on get_img()
+                     and dropped again once the detection is known or release() is called
+        """
+        # Reuses the group's already loaded network
+        super().__init__(thresholds=group.detector.thresholds, shared=group.detector)
         self._name = os.path.basename(path)
         self.name = self._name
         self._path = path
         self.path = path
-        self._img = cv2.resize(cv2.imread(path), (1200, 640))
-        self._vehicle_boxes, self._vehicle_count = self.detect_vehicles(self._img)
         self._group = group
-        _, self._index = self._group.append_image(img=self)
         self._position = None
         self._rendered = False
+        self._vehicle_boxes, self._vehicle_count = np.zeros((0, 4), dtype=np.int32), 0
+        _, self._index = self._group.append_image(img=self)
+        self._lazy = lazy
+        self._img = None
+        self._stored = False
+        # The frame may already have been decoded by a worker (see processors.scan_folder)
+        if img is not None:
+            self.set_img(img)
+        elif not lazy:
+            self.set_img(load_frame(path, lane=self._name))
+        # Detection may be deferred to a batched pass over the group (Group.detect)
+        if detect:
+            frame = self.get_input()
+            self.set_detection(*self._group.detect_frame(frame, self._name), shape=frame.shape)
 
     def __repr__(self):
         return repr(self._path)
@@ -223,7 +615,25 @@ class Image(VehicleDetector):
         self._path = value
 
     def set_img(self, img):
-        self._img = img
+        # Kept in the group's frame buffer when possible (never for lazy images), held by the image otherwise
+        self._stored = not self._lazy and self._group.store_frame(self._index, img)
+        self._img = None if self._stored else img
+
+    def is_loaded(self):
+        """
+        Returns whether the pixels are currently in memory
+        :return: bool
+        """
+        return self._img is not None or self._stored
+
+    def release(self):
+        """
+        Drops the pixel data, get_img() decodes the frame again from its path
+        :return: None
+        """
+        self._img = None
+        self._stored = False
+        self._rendered = False
 
     def is_rendered(self, state=None):
         if state:
@@ -261,10 +671,15 @@ class Image(VehicleDetector):
 
     def get_img(self):
         """
-         Returns actual image
+         Returns actual image (decoded on first call for lazy or released images)
         :return: image
         """
-        return self._img
+        if self._img is not None:
+            return self._img
+        if self._stored:
+            return self._group.get_frame(self._index)
+        self.set_img(load_frame(self._path, lane=self._name))
+        return self.get_img()
 
     def get_vehicle_boxes(self):
         """
@@ -287,12 +702,40 @@ class Image(VehicleDetector):
         """
         return self._group
 
+    def get_input(self):
+        """
+        Returns the frame handed to the network: the image itself when loaded, otherwise (lazy images)
+        a frame decoded at the working resolution that is not kept. Decoding straight at the network input
+        size would skip the resize blobFromImage does on every other frame and change the detections
+        :return: image
+        """
+        if self.is_loaded():
+            return self.get_img()
+        return load_frame(self._path, size=FRAME_SHAPE[1::-1], lane=self._name)
+
+    def set_detection(self, vehicle_boxes, vehicle_count, shape=None):
+        """
+        Sets the detection results computed outside the image
+        :param vehicle_boxes:
+        :param vehicle_count:
+        :param shape: shape of the frame the boxes were found on (mapped to FRAME_SHAPE), None when it is the image
+        :return: None
+        """
+        if shape is not None:
+            vehicle_boxes = scale_boxes(vehicle_boxes, shape, FRAME_SHAPE)
+        self._vehicle_boxes, self._vehicle_count = vehicle_boxes, vehicle_count
+        self._group.set_count(self._index, vehicle_count)
+        if self._lazy:
+            # Results are known, pixels are only needed again if the image gets displayed
+            self.release()
+
     def rescan(self):
         """
         Rescans the image for vehicles
         :return: None
         """
-        self._vehicle_boxes, self._vehicle_count = self.detect_vehicles(self._img, nmsThreshold=0.3)
+        frame = self.get_input()
+        self.set_detection(*self._group.detect_frame(frame, self._name, nmsThreshold=0.3), shape=frame.shape)
 
     def append_boxes(self, **kwargs):
         """
@@ -300,12 +743,15 @@ class Image(VehicleDetector):
         :param kwargs:
         :return: None
         """
-        return super(Image, self).append_boxes(self._img, self._vehicle_boxes, self._vehicle_count)
+        with metrics.span("render", self._name):
+            super(Image, self).append_boxes(self.get_img(), self._vehicle_boxes, self._vehicle_count)
+        self._rendered = True
 
-    def is_similar(self, image2):
+    def is_similar(self, image2, threshold=None):
         """
         Compare image to self
         :param image2:
+        :param threshold: see is_similar
         :return: bool
         """
-        return is_similar(self._img, image2)
+        return is_similar(self.get_img(), image2, threshold=threshold)
@@ -0,0 +1,76 @@
+from vc.detector import frame_difference, thumbnail
+
+
+class FrameGate:
+    """
+        Per lane frame differencing gate: reuses the previous detection while the lane hasn't changed
+        meaningfully since the last detected frame (the keyframe)
+    """
+
+    def __init__(self, threshold=4.0, size=(64, 36), max_skips=None):
+        """
+        :param threshold: mean absolute thumbnail difference (0-255) below which a frame is skipped
+        :param size: thumbnail size
+        :param max_skips: forces a detection after that many consecutive skips (None never forces)
+        """
+        self.threshold = threshold
+        self.size = size
+        self.max_skips = max_skips
+        self._keyframe = None
+        self._detection = None
+        self._consecutive = 0
+        self.frames = 0
+        self.skips = 0
+
+    def __repr__(self):
+        return repr((self.threshold, self.frames, self.skips))
+
+    def check(self, img):
+        """
+        Returns the previous detection if img is close enough to the keyframe
+        :param img:
+        :return: (vehicle_boxes[], vehicle_count) or None when img must be detected
+        """
+        self.frames += 1
+        if self._keyframe is None or (self.max_skips is not None and self._consecutive >= self.max_skips):
+            return None
+        if frame_difference(thumbnail(img, self.size), self._keyframe) > self.threshold:
+            return None
+        self._consecutive += 1
+        self.skips += 1
+        return self._detection
+
+    def update(self, img, detection):
+        """
+        Makes img the new keyframe with its detection
+        :param img:
+        :param detection:
+        :return: None
+        """
+        self._keyframe = thumbnail(img, self.size)
+        self._detection = detection
+        self._consecutive = 0
+
+    def detect(self, detector, img, **kwargs):
+        """
+        Detects the vehicles of img unless the gate lets the previous detection through
+        :param detector: VehicleDetector
+        :param img:
+        :param kwargs: passed to detect_vehicles
+        :return: vehicle_boxes[], vehicle_count
+        """
+        detection = self.check(img)
+        if detection is None:
+            detection = detector.detect_vehicles(img, **kwargs)
+            self.update(img, detection)
+        return detection
+
+    def skip_rate(self):
+        return self.skips / self.frames if self.frames else 0.0
+
+    def stats(self):
+        """
+        Returns the frames seen, skipped and the skip rate
+        :return: stats: dict
+        """
+        return {"FRAMES": self.frames, "SKIPS": self.skips, "SKIP_RATE": self.skip_rate()}
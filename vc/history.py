@@ -0,0 +1,435 @@
+"""
+Append-only lane history: every decision is logged per lane (settings.history in conf.json) and queried with
+
+    python -m vc.history --path history --window 300
+    python -m vc.history --path history --column latency --intersection stream --since 3600
+    python -m vc.history --path history --column infer --window 60
+"""
+import argparse
+import glob
+import json
+import os.path
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+
+from vc.metrics import metrics
+
+# Columns of the log, one memory mapped file per column and segment
+COLUMNS = {
+    "timestamp": np.float64,  # time.time() of the decision
+    "intersection": np.uint16,  # id in names.json
+    "lane": np.uint16,  # id in names.json
+    "vehicle_count": np.uint32,
+    "position": np.int16,  # rank given by the decision, 0 is green
+    "latency": np.float32,  # seconds from the frame to the decision, NaN when unknown
+}
+# Stages of the frame behind a row, seconds taken from the metrics spans, NaN when metrics are off
+# (or the stage did not run for that frame, e.g. tracked frames skip inference)
+STAGE_COLUMNS = ("decode", "resize", "infer", "nms_filter", "track")
+COLUMNS.update((stage, np.float32) for stage in STAGE_COLUMNS)
+
+
+class Segment:
+    """
+        Fixed capacity slice of the log: preallocated column files and a header holding the row count,
+        rows are only ever appended
+    """
+
+    def __init__(self, path, rows=65536):
+        """
+        Opens the segment directory, creating it when missing
+        :param path:
+        :param rows: capacity of a new segment
+        """
+        self.path = path
+        create = not os.path.exists(os.path.join(path, "header.bin"))
+        os.makedirs(path, exist_ok=True)
+        self._header = np.memmap(os.path.join(path, "header.bin"), dtype=np.int64, mode="w+" if create else "r+",
+                                 shape=(2,))
+        if create:
+            self._header[:] = (0, rows)
+        self.capacity = int(self._header[1])
+        self.columns = {name: self._open(name, dtype) for name, dtype in COLUMNS.items()}
+
+    def _open(self, name, dtype):
+        file = os.path.join(self.path, f"{name}.bin")
+        if os.path.exists(file):
+            return np.memmap(file, dtype=dtype, mode="r+", shape=(self.capacity,))
+        column = np.memmap(file, dtype=dtype, mode="w+", shape=(self.capacity,))
+        # A column added after the segment was created is unknown for its rows
+        if len(self) and np.issubdtype(dtype, np.floating):
+            column[:] = np.nan
+        return column
+
+    def __len__(self):
+        return int(self._header[0])
+
+    def __repr__(self):
+        return repr((self.path, len(self), self.capacity))
+
+    def free(self):
+        return self.capacity - len(self)
+
+    def started(self):
+        return float(self.columns["timestamp"][0]) if len(self) else None
+
+    def append(self, rows: dict):
+        """
+        Writes rows after the last ones (the caller checks free())
+        :param rows: column -> np.ndarray of the same length
+        :return: None
+        """
+        count = len(self)
+        n = len(rows["timestamp"])
+        for name, column in self.columns.items():
+            column[count:count + n] = rows[name]
+        # The count is written last, readers never see a partial row
+        self._header[0] = count + n
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+        self._header.flush()
+
+    def close(self):
+        self.flush()
+        self.columns = {}
+        self._header = None
+
+
+def read_segment(path, columns=None):
+    """
+    Reads the rows of a segment (written by any process)
+    :param path:
+    :param columns: names (all by default)
+    :return: column -> np.ndarray
+    """
+    count = int(np.fromfile(os.path.join(path, "header.bin"), dtype=np.int64, count=1)[0])
+    return {name: _read_column(path, name, count) for name in columns or COLUMNS}
+
+
+def _read_column(path, name, count):
+    file = os.path.join(path, f"{name}.bin")
+    if not os.path.exists(file):
+        # Segment written before the column existed
+        return np.full(count, np.nan if np.issubdtype(COLUMNS[name], np.floating) else 0, dtype=COLUMNS[name])
+    return np.fromfile(file, dtype=COLUMNS[name], count=count)
+
+
+def grouped_percentiles(keys, values, qs):
+    """
+    Percentiles of values per key, linear interpolation like np.percentile, without a loop over the groups
+    :param keys: int group of every value
+    :param values:
+    :param qs: percentiles (0-100)
+    :return: unique_keys, sizes, {q: np.ndarray}
+    """
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order].astype(np.float64)
+    unique, starts, sizes = np.unique(keys, return_index=True, return_counts=True)
+    results = {}
+    for q in qs:
+        position = starts + (sizes - 1) * q / 100.0
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, starts + sizes - 1)
+        results[q] = values[low] + (values[high] - values[low]) * (position - low)
+    return unique, sizes, results
+
+
+class LaneHistory:
+    """
+        Append-only columnar log of the lane results: each segment holds one memory mapped file per column,
+        a new segment starts once the current one is full or older than rotate seconds.
+        Queries read only the columns and segments they need and aggregate with NumPy.
+    """
+
+    def __init__(self, path="history", segment_rows=65536, rotate=86400.0, max_segments=None):
+        """
+        :param path: directory of the segments
+        :param segment_rows: capacity of a segment
+        :param rotate: seconds after which a segment is closed (None rotates on size only)
+        :param max_segments: oldest segments are deleted beyond that many (None keeps everything)
+        """
+        self.path = path
+        self.segment_rows = segment_rows
+        self.rotate = rotate
+        self.max_segments = max_segments
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._names = self._load_names()
+        self._segment = None
+        self.appended = 0
+        self.rotations = 0
+
+    def __repr__(self):
+        return repr((self.path, len(self.segments()), self.appended))
+
+    def segments(self):
+        """
+        Segment directories, oldest first
+        :return: paths[]
+        """
+        return sorted(glob.glob(os.path.join(self.path, "segment_*")))
+
+    def append(self, intersection, decision: dict, lanes=None, timestamp=None, latencies=None, since=None):
+        """
+        Logs every lane of a decision
+        :param intersection: name (folder, stream or intersection)
+        :param decision: {"DATA": [{"PATH", "VEHICLE_COUNT", "INDEX", "POSITION"}]}, see Group.serialise
+        :param lanes: lane names by INDEX, defaults to the PATH of every entry
+        :param timestamp: defaults to now
+        :param latencies: seconds from the frame to the decision, by INDEX (list or dict)
+        :param since: time.perf_counter() when the frames of the decision were read, stage spans older than that
+                      belong to earlier decisions and are left NaN
+        :return: rows: int
+        """
+        data = decision["DATA"]
+        if not data:
+            return 0
+        timestamp = time.time() if timestamp is None else timestamp
+        names = [lanes[d["INDEX"]] if lanes is not None else d["PATH"] for d in data]
+        with self._lock:
+            rows = {
+                "timestamp": np.full(len(data), timestamp),
+                "intersection": np.full(len(data), self._id("intersections", intersection)),
+                "lane": np.array([self._id("lanes", name) for name in names]),
+                "vehicle_count": np.array([d["VEHICLE_COUNT"] for d in data]),
+                "position": np.array([d["POSITION"] for d in data]),
+                "latency": np.array([np.nan if latencies is None else latencies[d["INDEX"]] for d in data]),
+            }
+            for stage in STAGE_COLUMNS:
+                rows[stage] = np.array([self._stage(stage, name, since) for name in names], dtype=np.float64)
+            segment = self._writable(len(data), timestamp)
+            segment.append(rows)
+            self.appended += len(data)
+        return len(data)
+
+    def load(self, columns=None, start=None, end=None, intersection=None, lane=None):
+        """
+        Rows of the log, segments entirely outside [start, end) are not read
+        :param columns: names (all by default)
+        :param start: timestamp
+        :param end: timestamp
+        :param intersection: name filter
+        :param lane: name filter
+        :return: column -> np.ndarray
+        """
+        columns = list(columns or COLUMNS)
+        needed = set(columns) | {"timestamp"} | ({"intersection"} if intersection else set()) | \
+            ({"lane"} if lane else set())
+        with self._lock:
+            if self._segment is not None:
+                self._segment.flush()
+            names = {kind: list(values) for kind, values in self._names.items()}
+        parts = []
+        paths = self.segments()
+        for i, path in enumerate(paths):
+            if end is not None and self._started(path) >= end:
+                break
+            # Segments are in time order, the next one bounds this one
+            if start is not None and i + 1 < len(paths) and self._started(paths[i + 1]) < start:
+                continue
+            parts.append(read_segment(path, needed))
+        rows = {name: np.concatenate([p[name] for p in parts]) if parts else np.zeros(0, dtype=COLUMNS[name])
+                for name in needed}
+        keep = np.ones(len(rows["timestamp"]), dtype=bool)
+        if start is not None:
+            keep &= rows["timestamp"] >= start
+        if end is not None:
+            keep &= rows["timestamp"] < end
+        if intersection:
+            keep &= rows["intersection"] == self._lookup(names, "intersections", intersection)
+        if lane:
+            keep &= rows["lane"] == self._lookup(names, "lanes", lane)
+        return {name: rows[name][keep] for name in columns}
+
+    def aggregate(self, column="vehicle_count", window=300.0, start=None, end=None, intersection=None, lane=None,
+                  percentiles=(50, 95)):
+        """
+        Mean and percentiles of a column per intersection, lane and time window
+        :param column: vehicle_count | position | latency | a stage of STAGE_COLUMNS
+        :param window: seconds per bucket, windows are aligned on multiples of it
+        :param start:
+        :param end:
+        :param intersection: name filter
+        :param lane: name filter
+        :param percentiles:
+        :return: {"INTERSECTION": names, "LANE": names, "WINDOW": start timestamps, "ROWS", "MEAN", "P<q>"...}
+        """
+        rows = self.load(("timestamp", "intersection", "lane", column), start, end, intersection, lane)
+        values = rows[column].astype(np.float64)
+        known = ~np.isnan(values)
+        rows = {name: array[known] for name, array in rows.items()}
+        values = values[known]
+        bucket = np.floor(rows["timestamp"] / window).astype(np.int64)
+        # One integer key per (intersection, lane, window)
+        first = bucket.min() if len(bucket) else 0
+        span = int(bucket.max() - first + 1) if len(bucket) else 1
+        keys = (rows["intersection"].astype(np.int64) * 65536 + rows["lane"]) * span + (bucket - first)
+        unique, sizes, results = grouped_percentiles(keys, values, percentiles)
+        sums = np.bincount(np.searchsorted(unique, keys), weights=values, minlength=len(unique))
+        with self._lock:
+            names = {kind: list(values) for kind, values in self._names.items()}
+        pairs, windows = unique // span, unique % span + first
+        return dict({
+            "INTERSECTION": [names["intersections"][i] for i in pairs // 65536],
+            "LANE": [names["lanes"][i] for i in pairs % 65536],
+            "WINDOW": windows * window,
+            "ROWS": sizes,
+            "MEAN": sums / np.maximum(sizes, 1),
+        }, **{f"P{q:g}": results[q] for q in percentiles})
+
+    def stats(self):
+        return {
+            "PATH": self.path,
+            "SEGMENTS": len(self.segments()),
+            "APPENDED": self.appended,
+            "ROTATIONS": self.rotations,
+            "LANES": len(self._names["lanes"]),
+        }
+
+    def flush(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.flush()
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+
+    # Helpers
+    def _load_names(self):
+        try:
+            with open(os.path.join(self.path, "names.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"intersections": [], "lanes": []}
+
+    def _id(self, kind, name):
+        values = self._names[kind]
+        name = str(name)
+        if name not in values:
+            if len(values) >= np.iinfo(COLUMNS["lane"]).max:
+                raise ValueError(f"Too many {kind} in {self.path}")
+            values.append(name)
+            # Written aside and renamed, readers never see a partial file
+            tmp = os.path.join(self.path, "names.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(self._names, f)
+            os.replace(tmp, os.path.join(self.path, "names.json"))
+        return values.index(name)
+
+    @staticmethod
+    def _stage(stage, lane, since):
+        if not metrics.enabled:
+            return np.nan
+        seconds = metrics.latest(stage, lane, since)
+        return np.nan if seconds is None else seconds
+
+    @staticmethod
+    def _lookup(names, kind, name):
+        return names[kind].index(name) if name in names[kind] else -1
+
+    @staticmethod
+    def _started(path):
+        first = np.fromfile(os.path.join(path, "timestamp.bin"), dtype=COLUMNS["timestamp"], count=1)
+        count = int(np.fromfile(os.path.join(path, "header.bin"), dtype=np.int64, count=1)[0])
+        return float(first[0]) if count else np.inf
+
+    def _writable(self, n, timestamp):
+        segment = self._segment
+        if segment is None:
+            paths = self.segments()
+            segment = Segment(paths[-1]) if paths else None
+        if segment is not None and (segment.free() < n or (
+                self.rotate is not None and len(segment) and timestamp - segment.started() >= self.rotate)):
+            segment.close()
+            segment = None
+            self.rotations += 1
+        if segment is None:
+            paths = self.segments()
+            number = int(os.path.basename(paths[-1]).split("_")[1]) + 1 if paths else 1
+            segment = Segment(os.path.join(self.path, f"segment_{number:06d}"), max(self.segment_rows, n))
+            self._retain()
+        self._segment = segment
+        return segment
+
+    def _retain(self):
+        if self.max_segments is None:
+            return
+        for path in self.segments()[:-self.max_segments]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_history = None
+
+
+def configure_history(path="history", segment_rows=65536, rotate=86400.0, max_segments=None, enabled=True):
+    """
+    Sets up the process wide lane history (settings.history in conf.json)
+    :param path:
+    :param segment_rows:
+    :param rotate:
+    :param max_segments:
+    :param enabled:
+    :return: history: LaneHistory or None
+    """
+    global _history
+    if _history is not None:
+        _history.close()
+    _history = LaneHistory(path, segment_rows, rotate, max_segments) if enabled else None
+    return _history
+
+
+def get_history():
+    """
+    Returns the process wide lane history
+    :return: history: LaneHistory or None
+    """
+    return _history
+
+
+def report(results):
+    """
+    Prints an aggregate() result
+    :param results:
+    :return: None
+    """
+    quantiles = [name for name in results if name.startswith("P")]
+    print(f"{'intersection':<16}{'lane':<16}{'window':<21}{'rows':>8}{'mean':>9}" +
+          "".join(f"{q.lower():>9}" for q in quantiles))
+    for i in range(len(results["ROWS"])):
+        window = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(results["WINDOW"][i]))
+        print(f"{results['INTERSECTION'][i]:<16}{results['LANE'][i]:<16}{window:<21}{results['ROWS'][i]:>8}"
+              f"{results['MEAN'][i]:>9.2f}" + "".join(f"{results[q][i]:>9.2f}" for q in quantiles))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="history")
+    parser.add_argument("--column", default="vehicle_count", choices=("vehicle_count", "position", "latency") + STAGE_COLUMNS)
+    parser.add_argument("--window", type=float, default=300.0, help="seconds per bucket")
+    parser.add_argument("--since", type=float, help="only the last seconds")
+    parser.add_argument("--intersection")
+    parser.add_argument("--lane")
+    parser.add_argument("--percentiles", nargs="*", type=float, default=[50, 95])
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.path):
+        sys.stderr.write(f"No history in {args.path}\n")
+        return 1
+    history = LaneHistory(args.path)
+    start = time.time() - args.since if args.since else None
+    report(history.aggregate(args.column, args.window, start=start, intersection=args.intersection,
+                             lane=args.lane, percentiles=args.percentiles))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import json
+import os.path
+import threading
+import time
+
+import numpy as np
+
+
+class Histogram:
+    """
+        Latency histogram of a stage: totals since start plus a ring of the latest samples for percentiles
+    """
+    __slots__ = ("count", "total", "max", "last", "last_at", "_samples", "_i", "_lock")
+
+    def __init__(self, window=4096):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = None
+        self.last_at = None  # time.perf_counter() when the last sample was observed
+        self._samples = np.zeros(window, dtype=np.float64)
+        self._i = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples[self._i % len(self._samples)] = seconds
+            self._i += 1
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            self.last_at = time.perf_counter()
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentiles(self, qs=(50, 95, 99)):
+        """
+        Percentiles over the latest window of samples
+        :param qs:
+        :return: {q: seconds}
+        """
+        with self._lock:
+            samples = self._samples[:min(self._i, len(self._samples))].copy()
+        if not len(samples):
+            return {q: 0.0 for q in qs}
+        return dict(zip(qs, np.percentile(samples, qs).tolist()))
+
+    def summary(self):
+        p = self.percentiles()
+        return {
+            "COUNT": self.count,
+            "MEAN": self.total / self.count if self.count else 0.0,
+            "P50": p[50],
+            "P95": p[95],
+            "P99": p[99],
+            "MAX": self.max,
+        }
+
+
+class _Span:
+    __slots__ = ("_metrics", "_key", "_t")
+
+    def __init__(self, metrics, key):
+        self._metrics = metrics
+        self._key = key
+
+    def __enter__(self):
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._metrics.observe_key(self._key, time.perf_counter() - self._t)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """
+        Per stage, per lane latency spans. When disabled, span() hands out a shared no-op context.
+        Stages along the hot path: decode, resize, infer, nms_filter, track, render, compose and send.
+    """
+
+    def __init__(self, enabled=False, path=None, fmt="json", window=4096):
+        """
+        :param enabled:
+        :param path: file written by export()
+        :param fmt: json | prometheus
+        :param window: samples kept per histogram for percentiles
+        """
+        self.enabled = enabled
+        self.path = path
+        self.fmt = fmt
+        self.window = window
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage, lane=None):
+        """
+        Times the enclosed block
+            with metrics.span("infer", lane="lane_1.jpg"):
+                ...
+        :param stage:
+        :param lane:
+        :return: context manager
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, (stage, lane))
+
+    def observe(self, stage, seconds, lane=None):
+        if self.enabled:
+            self.observe_key((stage, lane), seconds)
+
+    def observe_key(self, key, seconds):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.window))
+        histogram.observe(seconds)
+
+    def latest(self, stage, lane=None, since=None):
+        """
+        Duration of the last span of a stage for a lane, falling back to the span shared by every lane
+        (e.g. the forward pass of a batch)
+        :param stage:
+        :param lane:
+        :param since: time.perf_counter() before which a span is too old to count
+        :return: seconds or None
+        """
+        for key in ((stage, lane), (stage, None)):
+            histogram = self._histograms.get(key)
+            if histogram is not None and histogram.last is not None:
+                if since is None or histogram.last_at >= since:
+                    return histogram.last
+                return None
+        return None
+
+    def snapshot(self):
+        """
+        Returns the summary of every (stage, lane) histogram
+        :return: [{"STAGE", "LANE", "COUNT", "MEAN", "P50", "P95", "P99", "MAX"}]
+        """
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        return [dict(STAGE=stage, LANE=lane, **histogram.summary()) for (stage, lane), histogram in items]
+
+    def to_prometheus(self):
+        """
+        Prometheus text exposition of the histograms (summaries, seconds)
+        :return: text: str
+        """
+        lines = ["# HELP vc_stage_seconds Latency of the vehicle detection stages",
+                 "# TYPE vc_stage_seconds summary"]
+        for s in self.snapshot():
+            labels = f'stage="{s["STAGE"]}"' + (f',lane="{s["LANE"]}"' if s["LANE"] is not None else "")
+            for q in ("P50", "P95", "P99"):
+                lines.append(f'vc_stage_seconds{{{labels},quantile="0.{q[1:]}"}} {s[q]:.9f}')
+            lines.append(f"vc_stage_seconds_sum{{{labels}}} {s['MEAN'] * s['COUNT']:.9f}")
+            lines.append(f"vc_stage_seconds_count{{{labels}}} {s['COUNT']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=None, fmt=None):
+        """
+        Writes the histograms to a json or prometheus text file
+        :param path: defaults to the configured path
+        :param fmt: defaults to the configured format
+        :return: path: str or None when no path is configured
+        """
+        path = path or self.path
+        fmt = fmt or self.fmt
+        if path is None:
+            return None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            if fmt == "prometheus":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+        # Readers never see a partially written file
+        os.replace(tmp, path)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+# Process wide metrics, disabled until configured
+metrics = Metrics()
+
+
+def configure_metrics(enabled=True, path=None, format="json", window=4096):
+    """
+    Configures the process wide metrics (settings.metrics in conf.json)
+    :param enabled:
+    :param path:
+    :param format: json | prometheus
+    :param window:
+    :return: metrics: Metrics
+    """
+    metrics.enabled = enabled
+    metrics.path = path
+    metrics.fmt = format
+    metrics.window = window
+    return metrics
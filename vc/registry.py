@@ -0,0 +1,298 @@
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+DEFAULT_WEIGHTS = "dnn_model/yolov4.weights"
+DEFAULT_CFG = "dnn_model/yolov4.cfg"
+DEFAULT_SIZE = (832, 832)
+# Minimum score of the vehicle classes (COCO ids): car, motorbike, bus, train, truck
+DEFAULT_THRESHOLDS = {2: 0.5, 3: 0.5, 5: 0.5, 6: 0.5, 7: 0.5}
+
+# Names accepted in the MODEL section of conf.json
+BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    "cuda": cv2.dnn.DNN_BACKEND_CUDA,
+}
+TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    "cuda": cv2.dnn.DNN_TARGET_CUDA,
+    "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16,
+}
+
+
+def _rss_bytes():
+    """
+    Returns the resident set size of the current process
+    :return: rss: int (bytes, 0 when unavailable)
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is reported in kilobytes on linux (peak, not current)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def is_onnx(weights):
+    return weights.lower().endswith(".onnx")
+
+
+def backend_available(backend, target=None):
+    """
+    Checks that OpenCV was built with the backend (and target)
+    :param backend: cv2.dnn.DNN_BACKEND_*
+    :param target: cv2.dnn.DNN_TARGET_*
+    :return: bool
+    """
+    if backend is None or backend == cv2.dnn.DNN_BACKEND_DEFAULT:
+        return True
+    try:
+        targets = cv2.dnn.getAvailableTargets(backend)
+    except cv2.error:
+        return False
+    return len(targets) > 0 and (target is None or target in targets)
+
+
+def model_from_conf(model_conf: dict):
+    """
+    Returns the model parameters described by the MODEL section of conf.json
+        {"name": "yolov4-tiny", "size": [416, 416], "backend": "openvino", "target": "cpu",
+         "models": {"yolov4-tiny": {"weights": ..., "cfg": ...}, "yolov4-onnx": {"weights": "x.onnx"}}}
+    An unavailable backend falls back to the default one
+    :param model_conf:
+    :return: params: dict (weights, cfg, size, backend, target)
+    """
+    name = model_conf.get("name", "yolov4")
+    models = model_conf.get("models", {})
+    if name not in models:
+        raise ValueError(f"Unknown model {name}, expected one of {list(models)}")
+    weights = models[name]["weights"]
+    # ONNX models carry their own graph, no darknet cfg
+    cfg = models[name].get("cfg", "" if is_onnx(weights) else DEFAULT_CFG)
+    # A model's own size (the fixed input of an ONNX graph) takes precedence
+    size = tuple(models[name].get("size", model_conf.get("size", DEFAULT_SIZE)))
+    backend, target = model_conf.get("backend"), model_conf.get("target")
+    for value, names, kind in ((backend, BACKENDS, "backend"), (target, TARGETS, "target")):
+        if value is not None and value not in names:
+            raise ValueError(f"Unknown {kind} {value}, expected one of {list(names)}")
+    backend = BACKENDS[backend] if backend is not None else None
+    target = TARGETS[target] if target is not None else None
+    if not backend_available(backend, target):
+        sys.stderr.write(f"Backend {model_conf.get('backend')}/{model_conf.get('target')} is not available "
+                         f"in this OpenCV build, using the default one\n")
+        backend, target = None, None
+    return dict(weights=weights, cfg=cfg, size=size, backend=backend, target=target)
+
+
+class LoadedModel:
+    """
+        A network loaded once and shared by every detector using the same parameters
+    """
+
+    def __init__(self, key, net, model, load_time, rss_delta):
+        self.key = key
+        self.net = net
+        self.model = model
+        # ONNX outputs are decoded from the raw rows (VehicleDetector._detect_batch), not by DetectionModel
+        self.raw = is_onnx(key[0])
+        self.load_time = load_time
+        self.rss_delta = rss_delta
+        self.users = 0  # detectors built on the model
+        # cv2 networks are not safe for concurrent forward passes
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return repr((self.key, self.load_time, self.users))
+
+
+class ModelRegistry:
+    """
+        Loads each (weights, cfg, size, backend, target) combination once per process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._detectors = {}
+        # Parameters used by detectors built without explicit ones (see configure_model)
+        self.defaults = dict(weights=DEFAULT_WEIGHTS, cfg=DEFAULT_CFG, size=DEFAULT_SIZE, backend=None, target=None)
+        # Class thresholds of new detectors, not part of the model key (the loaded network is the same)
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+
+    @staticmethod
+    def key(weights=DEFAULT_WEIGHTS, cfg=DEFAULT_CFG, size=DEFAULT_SIZE, backend=None, target=None):
+        """
+        Builds the registry key for a set of model parameters
+        :param weights:
+        :param cfg:
+        :param size:
+        :param backend:
+        :param target:
+        :return: key: tuple
+        """
+        return weights, cfg, tuple(size), backend, target
+
+    def resolve(self, weights=None, cfg=None, size=None, backend=None, target=None):
+        """
+        Fills the parameters left to None with the configured defaults
+        :param weights:
+        :param cfg:
+        :param size:
+        :param backend:
+        :param target:
+        :return: params: dict
+        """
+        if weights is None:
+            params = dict(self.defaults)
+        else:
+            # The configured backend still applies to explicitly chosen weights
+            params = dict(self.defaults, weights=weights, cfg="" if is_onnx(weights) else DEFAULT_CFG)
+        given = dict(cfg=cfg, size=size, backend=backend, target=target)
+        params.update({k: v for k, v in given.items() if v is not None})
+        params["size"] = tuple(params["size"])
+        return params
+
+    def configure(self, **params):
+        """
+        Sets the parameters used by detectors built without explicit ones
+        :param params: weights, cfg, size, backend, target
+        :return: params: dict
+        """
+        self.defaults = dict(self.defaults, **params)
+        self.defaults["size"] = tuple(self.defaults["size"])
+        return dict(self.defaults)
+
+    def get_model(self, weights=None, cfg=None, size=None, backend=None, target=None):
+        """
+        Returns the loaded model for the parameters, loading it on first use, every call counts a user
+        :param weights: None uses the configured defaults (as do the other parameters)
+        :param cfg:
+        :param size:
+        :param backend:
+        :param target:
+        :return: loaded: LoadedModel
+        """
+        key = self.key(**self.resolve(weights, cfg, size, backend, target))
+        with self._lock:
+            loaded = self._models.get(key)
+            if loaded is None:
+                loaded = self._load(key)
+                self._models[key] = loaded
+            loaded.users += 1
+            return loaded
+
+    def get_detector(self, weights=None, cfg=None, size=None, backend=None, target=None):
+        """
+        Returns the shared VehicleDetector for the parameters
+        :param weights: None uses the configured defaults (as do the other parameters)
+        :param cfg:
+        :param size:
+        :param backend:
+        :param target:
+        :return: detector: VehicleDetector
+        """
+        from vc.detector import VehicleDetector
+
+        params = self.resolve(weights, cfg, size, backend, target)
+        key = self.key(**params)
+        with self._lock:
+            detector = self._detectors.get(key)
+        if detector is None:
+            detector = VehicleDetector(**params)
+            with self._lock:
+                detector = self._detectors.setdefault(key, detector)
+        return detector
+
+    def metrics(self):
+        """
+        Returns load time and memory usage of every loaded model
+        :return: metrics: dict
+        """
+        with self._lock:
+            models = [
+                {
+                    "WEIGHTS": m.key[0],
+                    "CFG": m.key[1],
+                    "SIZE": list(m.key[2]),
+                    "BACKEND": m.key[3],
+                    "TARGET": m.key[4],
+                    "LOAD_TIME": m.load_time,
+                    "RSS_DELTA": m.rss_delta,
+                    "USERS": m.users,
+                } for m in self._models.values()
+            ]
+        return {"MODELS": models, "COUNT": len(models), "RSS": _rss_bytes()}
+
+    def clear(self):
+        """
+        Drops every loaded model
+        :return: None
+        """
+        with self._lock:
+            self._models.clear()
+            self._detectors.clear()
+
+    @staticmethod
+    def _load(key):
+        weights, cfg, size, backend, target = key
+        rss = _rss_bytes()
+        t = time.perf_counter()
+        net = cv2.dnn.readNet(weights, cfg)
+        if backend is not None:
+            net.setPreferableBackend(backend)
+        if target is not None:
+            net.setPreferableTarget(target)
+        model = cv2.dnn_DetectionModel(net)
+        model.setInputParams(size=size, scale=1 / 255)
+        load_time = time.perf_counter() - t
+        return LoadedModel(key, net, model, load_time, max(_rss_bytes() - rss, 0))
+
+
+# Process wide registry
+registry = ModelRegistry()
+
+
+def get_model(**kwargs):
+    """
+    Shortcut to registry.get_model
+    :param kwargs:
+    :return: loaded: LoadedModel
+    """
+    return registry.get_model(**kwargs)
+
+
+def get_detector(**kwargs):
+    """
+    Shortcut to registry.get_detector
+    :param kwargs:
+    :return: detector: VehicleDetector
+    """
+    return registry.get_detector(**kwargs)
+
+
+def configure_model(model_conf: dict):
+    """
+    Makes the MODEL section of conf.json the default model of the process,
+    "thresholds" ({"class id": score}) replaces the vehicle classes and their minimum scores
+    :param model_conf:
+    :return: params: dict
+    """
+    if "thresholds" in model_conf:
+        thresholds = {int(class_id): float(score) for class_id, score in model_conf["thresholds"].items()}
+        if not thresholds:
+            # Rejected here rather than by the first detector built
+            raise ValueError("MODEL.thresholds lists no vehicle class")
+        registry.thresholds = thresholds
+    return registry.configure(**model_from_conf(model_conf))
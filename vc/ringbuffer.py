@@ -0,0 +1,237 @@
+import multiprocessing
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+# Working resolution of the frames (height, width, channels), see vc.detector.FRAME_SHAPE
+RING_SHAPE = (640, 1200, 3)
+# Header: capacity, height, width, channels, write cursor, readers, then a cursor and a mode per reader
+# and the sequence number held by every slot (all int64)
+_CAPACITY, _HEIGHT, _WIDTH, _CHANNELS, _WRITE, _READERS = range(6)
+_FIXED = 6
+# Reader modes: blocking readers hold the writer back, the others skip what they missed
+INACTIVE, BLOCKING, LOSSY = 0, 1, 2
+# Slot being written, readers never see it
+WRITING = -1
+# Rings created by this process, registered with its resource tracker
+_created = set()
+
+
+class FrameRing:
+    """
+        Fixed size frame slots in shared memory, handed between processes by sequence number instead of pickling
+        the pixels. One writer puts frames, readers get views of the slots (no copy) until they release them.
+        The writer waits for the blocking readers instead of overwriting a frame they have not released yet,
+        lossy readers (e.g. a display) are never waited for and jump ahead when the writer laps them.
+        Every slot carries the sequence number of its frame, cleared while it is rewritten, so a reader can tell
+        a view it still holds has been overwritten (see valid).
+    """
+
+    def __init__(self, shm, owner=False):
+        """
+        Use create() or attach()
+        :param shm: SharedMemory
+        :param owner: unlinks the memory on close
+        """
+        self._shm = shm
+        self.owner = owner
+        capacity, height, width, channels, _, readers = np.ndarray((_FIXED,), dtype=np.int64, buffer=shm.buf)
+        self.capacity = int(capacity)
+        self.shape = (int(height), int(width), int(channels))
+        self.max_readers = int(readers)
+        header = _FIXED + 2 * self.max_readers + self.capacity
+        self._header = np.ndarray((header,), dtype=np.int64, buffer=shm.buf)
+        self._cursors = self._header[_FIXED:_FIXED + self.max_readers]
+        self._modes = self._header[_FIXED + self.max_readers:_FIXED + 2 * self.max_readers]
+        self._seqs = self._header[_FIXED + 2 * self.max_readers:]
+        offset = -(-header * 8 // 64) * 64  # Slots aligned on cache lines
+        self._slots = np.ndarray((self.capacity,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        self.written = 0
+        self.waits = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.capacity
+
+    def __repr__(self):
+        return repr((self.name, self.capacity, self.shape, int(self._header[_WRITE])))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def create(cls, capacity=8, shape=RING_SHAPE, readers=4, name=None):
+        """
+        Allocates a ring
+        :param capacity: number of slots
+        :param shape: (height, width, channels) of every frame
+        :param readers: most readers registered at the same time
+        :param name: shared memory name (generated when None)
+        :return: ring: FrameRing (owner)
+        """
+        header = _FIXED + 2 * readers + capacity
+        size = -(-header * 8 // 64) * 64 + capacity * int(np.prod(shape))
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created.add(shm.name)
+        fixed = np.ndarray((header,), dtype=np.int64, buffer=shm.buf)
+        fixed[:] = 0
+        fixed[:_FIXED] = (capacity, shape[0], shape[1], shape[2], 0, readers)
+        fixed[_FIXED + 2 * readers:] = WRITING
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Opens a ring created by another process
+        :param name:
+        :return: ring: FrameRing
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        if sys.version_info < (3, 13) and multiprocessing.parent_process() is None and name not in _created:
+            # The creator owns the memory, the tracker of an unrelated process must not unlink it on exit
+            # (children share the tracker of their parent, where the ring is already registered)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def cursor(self):
+        """
+        Sequence number of the next frame to be written
+        :return: int
+        """
+        return int(self._header[_WRITE])
+
+    # Writer
+    def put(self, frame, timeout=None, poll=0.0005):
+        """
+        Copies a frame into the next slot (resized when its shape differs), after the blocking readers
+        released the frame that slot held
+        :param frame:
+        :param timeout: seconds, None waits for the readers as long as needed
+        :param poll: seconds between two checks of the reader cursors
+        :return: seq: int
+        """
+        seq = int(self._header[_WRITE])
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            blocking = self._cursors[self._modes == BLOCKING]
+            if not len(blocking) or seq - int(blocking.min()) < self.capacity:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Ring {self.name} is full, readers are {self.capacity} frames behind")
+            self.waits += 1
+            time.sleep(poll)
+        i = seq % self.capacity
+        self._seqs[i] = WRITING
+        slot = self._slots[i]
+        if frame.shape == self.shape:
+            slot[...] = frame
+        else:
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=slot)
+        # The sequence numbers are written last, a reader seeing them sees the whole frame
+        self._seqs[i] = seq
+        self._header[_WRITE] = seq + 1
+        self.written += 1
+        return seq
+
+    # Readers
+    def add_reader(self, blocking=True):
+        """
+        Registers a reader starting at the next frame written (register every reader from the owner,
+        before handing the ring to other processes)
+        :param blocking: the writer waits for this reader before overwriting its frames
+        :return: reader: int, the index to pass to next and release
+        """
+        free = np.flatnonzero(self._modes == INACTIVE)
+        if not len(free):
+            raise ValueError(f"Ring {self.name} already has {self.max_readers} readers")
+        reader = int(free[0])
+        self._cursors[reader] = self._header[_WRITE]
+        self._modes[reader] = BLOCKING if blocking else LOSSY
+        return reader
+
+    def remove_reader(self, reader):
+        self._modes[reader] = INACTIVE
+
+    def view(self, seq):
+        """
+        Frame seq, in place (valid until the slot is rewritten, see valid)
+        :param seq:
+        :return: frame: np.ndarray (read only view)
+        """
+        if not self.valid(seq):
+            raise LookupError(f"Frame {seq} is no longer in ring {self.name}")
+        frame = self._slots[seq % self.capacity]
+        frame.flags.writeable = False
+        return frame
+
+    def valid(self, seq):
+        """
+        Whether the slot of seq still holds that frame
+        :param seq:
+        :return: bool
+        """
+        return int(self._seqs[seq % self.capacity]) == seq
+
+    def next(self, reader, timeout=None, poll=0.0005):
+        """
+        Waits for the next frame of a reader
+        :param reader: index returned by add_reader
+        :param timeout: seconds, None waits as long as needed
+        :param poll:
+        :return: (seq, frame view) or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq, written = int(self._cursors[reader]), int(self._header[_WRITE])
+            if written - seq > self.capacity:
+                # Lapped (lossy readers only), the oldest frame still in the ring is next
+                self.dropped += written - self.capacity - seq
+                seq = self._cursors[reader] = written - self.capacity
+            if seq < written and self.valid(seq):
+                return seq, self.view(seq)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def release(self, reader, seq):
+        """
+        Done with frame seq (and the ones before), its slot may be rewritten
+        :param reader:
+        :param seq:
+        :return: None
+        """
+        self._cursors[reader] = max(int(self._cursors[reader]), seq + 1)
+
+    def stats(self):
+        return {
+            "NAME": self.name,
+            "CAPACITY": self.capacity,
+            "WRITTEN": self.written,
+            "WAITS": self.waits,
+            "DROPPED": self.dropped,
+            "READERS": int((self._modes != INACTIVE).sum()),
+        }
+
+    def close(self):
+        """
+        Detaches the ring (views of its frames must no longer be used), the owner also frees the memory
+        :return: None
+        """
+        if self._shm is None:
+            return
+        self._header = self._cursors = self._modes = self._seqs = self._slots = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+            _created.discard(self.name)
+        self._shm = None
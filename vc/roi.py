@@ -0,0 +1,158 @@
+import cv2
+import numpy as np
+
+# Working resolution the polygons are given in (height, width), see vc.detector.FRAME_SHAPE
+ROI_SHAPE = (640, 1200)
+
+
+class Roi:
+    """
+        Region of interest of a lane: only the bounding box of the polygon is handed to the network
+        (optionally split in tiles), and only the vehicles whose centre lies in the polygon are counted
+    """
+    __slots__ = ("polygon", "tiles", "overlap", "_masks")
+
+    def __init__(self, polygon, tiles=(1, 1), overlap=32):
+        """
+        :param polygon: [[x, y], ...] in working resolution pixels (1200x640)
+        :param tiles: (columns, rows) the cropped region is split in, each tile is a separate network input
+        :param overlap: pixels shared by neighbouring tiles, vehicles on a tile border are kept once
+        """
+        self.polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError(f"A region of interest needs at least 3 points, got {len(self.polygon)}")
+        self.tiles = tuple(tiles)
+        self.overlap = overlap
+        self._masks = {}
+
+    def __repr__(self):
+        return repr((self.polygon.astype(int).tolist(), self.tiles))
+
+    def scaled(self, shape):
+        """
+        Polygon in the pixels of a frame of the given shape
+        :param shape: (height, width, ...)
+        :return: polygon: np.ndarray int32 (N, 2)
+        """
+        scale = (shape[1] / ROI_SHAPE[1], shape[0] / ROI_SHAPE[0])
+        return np.round(self.polygon * scale).astype(np.int32)
+
+    def mask(self, shape):
+        """
+        Filled polygon of a frame of the given shape (computed once per shape)
+        :param shape:
+        :return: mask: np.ndarray uint8 (height, width)
+        """
+        key = tuple(shape[:2])
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.zeros(key, dtype=np.uint8)
+            cv2.fillPoly(mask, [self.scaled(shape)], 1)
+            self._masks[key] = mask
+        return mask
+
+    def bounds(self, shape):
+        """
+        Bounding box of the polygon clipped to the frame
+        :param shape:
+        :return: (x, y, w, h)
+        """
+        polygon = self.scaled(shape)
+        polygon[:, 0] = np.clip(polygon[:, 0], 0, shape[1] - 1)
+        polygon[:, 1] = np.clip(polygon[:, 1], 0, shape[0] - 1)
+        return cv2.boundingRect(polygon)
+
+    def crops(self, img):
+        """
+        Splits the bounding box of the polygon in tiles of the same size, evenly spread so that neighbouring
+        tiles share at least overlap pixels (the last ones end on the border of the box)
+        :param img:
+        :return: crops[]: views of img, offsets[]: (x, y) of every crop in img
+        """
+        x, y, w, h = self.bounds(img.shape)
+        columns, rows = self.tiles
+        tw, th = _tile(w, columns, self.overlap), _tile(h, rows, self.overlap)
+        crops, offsets = [], []
+        for r in range(rows):
+            for c in range(columns):
+                x0 = x + (round(c * (w - tw) / (columns - 1)) if columns > 1 else 0)
+                y0 = y + (round(r * (h - th) / (rows - 1)) if rows > 1 else 0)
+                crops.append(img[y0:y0 + th, x0:x0 + tw])
+                offsets.append((x0, y0))
+        return crops, offsets
+
+    def contains(self, boxes, shape):
+        """
+        Which boxes have their centre inside the polygon
+        :param boxes: (N, 4) x, y, w, h
+        :param shape: shape of the frame the boxes refer to
+        :return: keep: np.ndarray bool (N,)
+        """
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        cx = np.clip(boxes[:, 0] + boxes[:, 2] // 2, 0, shape[1] - 1)
+        cy = np.clip(boxes[:, 1] + boxes[:, 3] // 2, 0, shape[0] - 1)
+        return self.mask(shape)[cy, cx].astype(bool)
+
+    def input_size(self, detector, crop_shape, shape):
+        """
+        Network input of a crop keeping the scale the full frame would have been detected at,
+        a smaller crop gives a proportionally smaller input
+        :param detector: VehicleDetector
+        :param crop_shape:
+        :param shape: shape of the full frame
+        :return: (width, height) multiples of 32
+        """
+        width, height = detector.params["size"]
+        return (max(32, -(-round(crop_shape[1] * width / shape[1]) // 32) * 32),
+                max(32, -(-round(crop_shape[0] * height / shape[0]) // 32) * 32))
+
+    def detect(self, detector, img, nmsThreshold=0.3, lane=None):
+        """
+        Detects the vehicles inside the region
+        :param detector: VehicleDetector
+        :param img:
+        :param nmsThreshold:
+        :param lane: metrics label
+        :return: vehicle_boxes: np.ndarray (N, 4) in img pixels, vehicle_count: int
+        """
+        crops, offsets = self.crops(img)
+        # Tiles all have the same size, hence the same input size, one forward pass for all of them
+        size = None if detector.fixed_size() else self.input_size(detector, crops[0].shape, img.shape)
+        results = detector.detect_vehicles_batch(crops, nmsThreshold=nmsThreshold, lanes=[lane] * len(crops),
+                                                 size=size)
+        boxes = [np.asarray(b, dtype=np.int32).reshape(-1, 4) + (x, y, 0, 0)
+                 for (b, _), (x, y) in zip(results, offsets)]
+        boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.int32)
+        if len(crops) > 1 and len(boxes):
+            # The same vehicle found on both sides of a tile border
+            indices = cv2.dnn.NMSBoxes(boxes.tolist(), [1.0] * len(boxes), 0.5, nmsThreshold)
+            boxes = boxes[np.array(indices, dtype=int).reshape(-1)]
+        boxes = boxes[self.contains(boxes, img.shape)]
+        return boxes, len(boxes)
+
+
+def _tile(length, count, overlap):
+    # Size of count tiles covering length, neighbours sharing overlap pixels
+    return min(length, -(-(length + (count - 1) * overlap) // count))
+
+
+def rois_from_conf(spec):
+    """
+    Builds the regions of interest of a folder (the "roi" entry of FOLDER_DETAILS)
+        [[x, y], ...]                                 same polygon for every lane
+        {"lane_1.jpg": [[x, y], ...], "*": ...}       per lane (image name), "*" for the others
+        {"lane_1.jpg": {"polygon": [...], "tiles": [2, 1]}}
+    :param spec:
+    :return: rois: {name: Roi}
+    """
+    if not spec:
+        return {}
+    if isinstance(spec, list):
+        spec = {"*": spec}
+    rois = {}
+    for name, lane in spec.items():
+        if isinstance(lane, dict):
+            rois[name] = Roi(lane["polygon"], tiles=lane.get("tiles", (1, 1)), overlap=lane.get("overlap", 32))
+        else:
+            rois[name] = Roi(lane)
+    return rois
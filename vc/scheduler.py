@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Decision:
+    """
+        Lane turned (or kept) green by the scheduler
+    """
+    __slots__ = ("lane", "count", "reason", "changed", "timestamp")
+
+    def __init__(self, lane, count, reason, changed, timestamp):
+        self.lane = lane
+        self.count = count
+        self.reason = reason  # count | max_wait | min_green
+        self.changed = changed
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return repr((self.lane, self.count, self.reason, self.changed))
+
+
+class LaneScheduler:
+    """
+        Picks the lane to turn green from an indexed max-heap of the latest vehicle counts.
+        update() and decide() are O(log n): counts are sifted in place instead of re-sorting every lane.
+        Fairness: the green lane is held for min_green seconds, and a lane kept red for max_wait seconds
+        goes green next whatever its count (lanes are kept in the order they last were green, oldest first).
+    """
+
+    def __init__(self, lanes=(), min_green=0.0, max_wait=None, clock=time.monotonic):
+        """
+        :param lanes: lanes known upfront (others are added on their first update)
+        :param min_green: seconds a lane stays green before the scheduler may switch
+        :param max_wait: seconds a lane may wait before it is forced green, None waits on the counts only
+        :param clock: time source of the fairness constraints
+        """
+        self.min_green = min_green
+        self.max_wait = max_wait
+        self.clock = clock
+        self.green = None
+        self.green_since = None
+        self.decisions = 0
+        self.switches = 0
+        self.forced = 0
+        self._heap = []  # lanes, highest count first
+        self._pos = {}  # lane -> index in the heap
+        self._counts = {}
+        self._order = {}  # lane -> insertion order, ties go to the first lane
+        self._red_since = OrderedDict()  # lane -> when it turned red, oldest first
+        self._lock = threading.Lock()
+        for lane in lanes:
+            self.add_lane(lane)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __repr__(self):
+        return repr((self.green, len(self._heap), self.decisions))
+
+    def add_lane(self, lane, count=0, now=None):
+        """
+        Adds a lane, red from now on
+        :param lane:
+        :param count:
+        :param now:
+        :return: None
+        """
+        with self._lock:
+            if lane in self._pos:
+                return
+            self._counts[lane] = count
+            self._order[lane] = len(self._order)
+            self._red_since[lane] = self.clock() if now is None else now
+            self._heap.append(lane)
+            self._pos[lane] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+
+    def update(self, lane, count, now=None):
+        """
+        Sets the latest vehicle count of a lane
+        :param lane:
+        :param count:
+        :param now:
+        :return: None
+        """
+        if lane not in self._pos:
+            self.add_lane(lane, count, now)
+            return
+        with self._lock:
+            previous = self._counts[lane]
+            self._counts[lane] = count
+            i = self._pos[lane]
+            if count > previous:
+                self._sift_up(i)
+            elif count < previous:
+                self._sift_down(i)
+
+    def count(self, lane):
+        return self._counts[lane]
+
+    def top(self):
+        """
+        Lane with the highest count
+        :return: lane or None
+        """
+        return self._heap[0] if self._heap else None
+
+    def waited(self, lane, now=None):
+        """
+        Seconds a lane has been red (0 for the green lane)
+        :param lane:
+        :param now:
+        :return: seconds: float
+        """
+        if lane == self.green:
+            return 0.0
+        return (self.clock() if now is None else now) - self._red_since[lane]
+
+    def decide(self, now=None):
+        """
+        Picks the green lane: the current one during min_green, else the lane waiting past max_wait,
+        else the lane with the highest count
+        :param now:
+        :return: decision: Decision or None when no lane is known
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            if not self._heap:
+                return None
+            self.decisions += 1
+            if self.green is not None and now - self.green_since < self.min_green:
+                return Decision(self.green, self._counts[self.green], "min_green", False, now)
+            lane, reason = self._heap[0], "count"
+            if self.max_wait is not None:
+                oldest = next(iter(self._red_since), None)
+                if oldest is not None and now - self._red_since[oldest] >= self.max_wait:
+                    lane, reason = oldest, "max_wait"
+                    self.forced += 1
+            changed = lane != self.green
+            if changed:
+                self._switch(lane, now)
+            return Decision(lane, self._counts[lane], reason, changed, now)
+
+    def ranking(self):
+        """
+        Every lane, the green one first and the others by count (O(n log n), for the payloads listing all lanes)
+        :return: lanes[]
+        """
+        with self._lock:
+            others = sorted((lane for lane in self._heap if lane != self.green), key=self._rank)
+        return ([self.green] if self.green is not None else []) + others
+
+    def stats(self):
+        return {
+            "LANES": len(self._heap),
+            "GREEN": self.green,
+            "DECISIONS": self.decisions,
+            "SWITCHES": self.switches,
+            "FORCED": self.forced,
+        }
+
+    # Helpers
+    def _switch(self, lane, now):
+        if self.green is not None:
+            self._red_since[self.green] = now  # Back of the waiting order
+        self._red_since.pop(lane, None)
+        self.green = lane
+        self.green_since = now
+        self.switches += 1
+
+    def _rank(self, lane):
+        return -self._counts[lane], self._order[lane]
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i]] = i
+        self._pos[heap[j]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self._rank(self._heap[i]) >= self._rank(self._heap[parent]):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        n = len(self._heap)
+        while True:
+            first, left = i, 2 * i + 1
+            for child in (left, left + 1):
+                if child < n and self._rank(self._heap[child]) < self._rank(self._heap[first]):
+                    first = child
+            if first == i:
+                break
+            self._swap(i, first)
+            i = first
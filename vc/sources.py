@@ -0,0 +1,206 @@
+import glob
+import os.path
+import re
+import time
+
+import cv2
+
+
+class Frame:
+    """
+        A single frame travelling through the pipeline
+    """
+    __slots__ = ("lane", "seq", "timestamp", "name", "path", "img", "vehicle_boxes", "vehicle_count")
+
+    def __init__(self, lane, seq, name, path=None, img=None):
+        self.lane = lane
+        self.seq = seq
+        self.timestamp = time.time()
+        self.name = name
+        self.path = path
+        self.img = img
+        self.vehicle_boxes = None
+        self.vehicle_count = None
+
+    def __repr__(self):
+        return repr((self.lane, self.seq, self.name, self.vehicle_count))
+
+
+class FrameSource:
+    """
+        Base class of the frame sources, iterating yields Frame objects until the source is exhausted
+    """
+
+    def __init__(self, lane, interval=0.0):
+        """
+        :param lane: lane name reported on every frame
+        :param interval: minimum seconds between two frames (0 reads as fast as possible)
+        """
+        self.lane = lane
+        self.interval = interval
+        self._seq = 0
+        self._closed = False
+
+    def __iter__(self):
+        last = 0.0
+        try:
+            while not self._closed:
+                if self.interval:
+                    wait = last + self.interval - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                    last = time.monotonic()
+                item = self.read()
+                if item is None:
+                    break
+                name, path, img = item
+                self._seq += 1
+                yield Frame(self.lane, self._seq, name, path=path, img=img)
+        finally:
+            # Also reached when the consumer closes the generator before the source is exhausted
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        self._release()
+
+    def read(self):
+        """
+        Reads the next raw frame
+        :return: (name, path, img) or None when exhausted
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Stops the iteration, safe to call from another thread
+        :return: None
+        """
+        self._closed = True
+
+    def _release(self):
+        pass
+
+
+class ImageFolderSource(FrameSource):
+    """
+        Yields the jpeg images of a folder (decoding is left to the pipeline)
+    """
+
+    def __init__(self, lane, path, loop=False, interval=0.0):
+        super().__init__(lane, interval)
+        if not os.path.isdir(path):
+            raise NotADirectoryError(f"Please check {path} in conf.json")
+        self.path = path
+        self.loop = loop
+        self._files = sorted(glob.glob(f"{path}/*.jpg"), key=lambda f: int(re.sub('\\D', '', f) or 0))
+        self._i = 0
+
+    def read(self):
+        if self._i >= len(self._files):
+            if not self.loop or not self._files:
+                return None
+            self._i = 0
+        path = self._files[self._i]
+        self._i += 1
+        return os.path.basename(path), path, None
+
+
+class CaptureSource(FrameSource):
+    """
+        Yields frames decoded by cv2.VideoCapture (V4L2 device index, RTSP/HTTP url or video file)
+    """
+
+    def __init__(self, lane, device, loop=False, interval=0.0, reconnect=False):
+        super().__init__(lane, interval)
+        self.device = device
+        self.loop = loop
+        self.reconnect = reconnect
+        self._capture = self._open()
+
+    def _open(self):
+        capture = cv2.VideoCapture(self.device)
+        if not capture.isOpened():
+            raise IOError(f"Unable to open capture {self.device}")
+        return capture
+
+    def read(self):
+        ok, img = self._capture.read()
+        if not ok and (self.loop or self.reconnect):
+            self._capture.release()
+            self._capture = self._open()
+            ok, img = self._capture.read()
+        if not ok:
+            return None
+        return f"{self.lane}_{self._seq + 1}", None, img
+
+    def _release(self):
+        self._capture.release()
+
+
+class VideoFileSource(CaptureSource):
+    """
+        Yields the frames of a video file
+    """
+
+    def __init__(self, lane, path, loop=False, interval=0.0):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Please check {path} in conf.json")
+        super().__init__(lane, path, loop=loop, interval=interval)
+
+
+class ReplaySource(FrameSource):
+    """
+        File based camera stand-in: follows a manifest file listing one image path per line.
+        Lines appended to the manifest are picked up while the source runs, an 'EOF' line ends it.
+    """
+
+    def __init__(self, lane, manifest, interval=0.0, poll=0.05):
+        super().__init__(lane, interval)
+        self.manifest = manifest
+        self.poll = poll
+        self._f = open(manifest, "r")
+
+    def read(self):
+        while not self._closed:
+            line = self._f.readline()
+            if not line:
+                time.sleep(self.poll)
+                continue
+            path = line.strip()
+            if path == "EOF":
+                return None
+            if path:
+                return os.path.basename(path), path, None
+        return None
+
+    def _release(self):
+        self._f.close()
+
+
+SOURCE_TYPES = {
+    "folder": lambda lane, spec: ImageFolderSource(lane, spec["path"], loop=spec.get("loop", False),
+                                                   interval=spec.get("interval", 0.0)),
+    "video": lambda lane, spec: VideoFileSource(lane, spec["path"], loop=spec.get("loop", False),
+                                                interval=spec.get("interval", 0.0)),
+    "capture": lambda lane, spec: CaptureSource(lane, spec["device"], interval=spec.get("interval", 0.0),
+                                                reconnect=spec.get("reconnect", True)),
+    "replay": lambda lane, spec: ReplaySource(lane, spec["path"], interval=spec.get("interval", 0.0)),
+}
+
+
+def open_source(lane, spec):
+    """
+    Creates the frame source described by a STREAMS entry of conf.json
+    :param lane:
+    :param spec: {"type": folder | video | capture | replay, ...}
+    :return: source: FrameSource
+    """
+    try:
+        factory = SOURCE_TYPES[spec["type"]]
+    except KeyError:
+        raise ValueError(f"Unknown source type {spec.get('type')} for {lane}, expected one of {list(SOURCE_TYPES)}")
+    return factory(lane, spec)
@@ -0,0 +1,335 @@
+import sys
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# OpenCV trackers refining the boxes between keyframes (KCF and MOSSE need opencv-contrib-python)
+VISUAL_TRACKERS = {"kcf": "TrackerKCF_create", "mosse": "TrackerMOSSE_create", "mil": "TrackerMIL_create"}
+
+
+def iou_matrix(a, b):
+    """
+    Intersection over union of every pair of boxes
+    :param a: (N, 4) x, y, w, h
+    :param b: (M, 4) x, y, w, h
+    :return: iou: np.ndarray (N, M)
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(1, -1, 4)
+    w = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    h = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def centroid_distance(a, b):
+    """
+    Distance between the centres of every pair of boxes, relative to the size of the boxes of a
+    :param a: (N, 4)
+    :param b: (M, 4)
+    :return: distance: np.ndarray (N, M)
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    ca = a[:, :2] + a[:, 2:] / 2
+    cb = b[:, :2] + b[:, 2:] / 2
+    scale = np.sqrt(np.maximum(a[:, 2] * a[:, 3], 1.0))
+    return np.linalg.norm(ca[:, None] - cb[None], axis=2) / scale[:, None]
+
+
+def greedy_match(scores, threshold, rows=None, cols=None):
+    """
+    Pairs rows and columns by decreasing score, each at most once
+    :param scores: (N, M), higher is better
+    :param threshold: lowest score of a pair
+    :param rows: candidate rows (all by default)
+    :param cols: candidate columns (all by default)
+    :return: [(row, col)]
+    """
+    rows = np.arange(scores.shape[0]) if rows is None else np.asarray(rows, dtype=int)
+    cols = np.arange(scores.shape[1]) if cols is None else np.asarray(cols, dtype=int)
+    if not len(rows) or not len(cols):
+        return []
+    sub = scores[np.ix_(rows, cols)]
+    i, j = np.nonzero(sub >= threshold)
+    order = np.argsort(-sub[i, j], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for r, c in zip(rows[i[order]], cols[j[order]]):
+        if r not in used_rows and c not in used_cols:
+            used_rows.add(r)
+            used_cols.add(c)
+            pairs.append((int(r), int(c)))
+    return pairs
+
+
+def visual_tracker_factory(kind):
+    """
+    Constructor of an OpenCV tracker
+    :param kind: kcf | mosse | mil, None for none
+    :return: factory or None when the tracker is not available in this OpenCV build
+    """
+    if kind is None:
+        return None
+    if kind not in VISUAL_TRACKERS:
+        raise ValueError(f"Unknown tracker {kind}, expected one of {tuple(VISUAL_TRACKERS)}")
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        factory = getattr(module, VISUAL_TRACKERS[kind], None)
+        if factory is not None:
+            return factory
+    sys.stderr.write(f"Tracker {kind} is not available in this OpenCV build, following the motion only\n")
+    return None
+
+
+class Track:
+    """
+        A vehicle followed across the frames of a lane
+    """
+    __slots__ = ("id", "box", "anchor", "velocity", "hits", "misses", "confidence", "first_seen", "last_seen",
+                 "side", "visual")
+
+    def __init__(self, track_id, box, now, side=None):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float64)
+        self.anchor = self.box.copy()  # Box of the last detection
+        self.velocity = np.zeros(2)  # Pixels per second
+        self.hits = 1
+        self.misses = 0
+        self.confidence = 1.0
+        self.first_seen = now
+        self.last_seen = now
+        self.side = side
+        self.visual = None
+
+    def __repr__(self):
+        return repr((self.id, self.box.astype(int).tolist(), self.hits, round(self.confidence, 2)))
+
+    def centre(self):
+        return self.box[:2] + self.box[2:] / 2
+
+    def speed(self):
+        return float(np.hypot(*self.velocity))
+
+
+class LaneTracker:
+    """
+        Follows the vehicles of a lane between keyframes: the network only runs every keyframe_interval frames,
+        or earlier when the confidence of the tracks drops, boxes are carried over in between (constant
+        velocity, refined by an OpenCV tracker when one is set).
+        Detections are associated with the tracks by IoU, then by centroid distance for the fast movers.
+        Stationary tracks give the queue length, tracks crossing the stop line (or leaving) the flow rate.
+    """
+
+    def __init__(self, keyframe_interval=10, iou_threshold=0.3, max_distance=1.0, max_misses=2, min_hits=2,
+                 min_confidence=0.5, decay=0.95, line=None, queue_speed=20.0, window=60.0, tracker=None,
+                 clock=time.monotonic):
+        """
+        :param keyframe_interval: frames between two detections (1 detects every frame)
+        :param iou_threshold: lowest IoU associating a detection with a track
+        :param max_distance: largest centroid distance (in track sizes) associating the leftovers
+        :param max_misses: keyframes a track may go undetected before it is dropped
+        :param min_hits: detections before a track counts for the queue and the flow
+        :param min_confidence: mean track confidence under which the next frame is a keyframe
+        :param decay: confidence kept per predicted frame (a failed OpenCV tracker drops it to 0)
+        :param line: y of the stop line in frame pixels, None counts the tracks leaving as the flow
+        :param queue_speed: pixels per second under which a vehicle is queued
+        :param window: seconds the flow rate is averaged over
+        :param tracker: kcf | mosse | mil, OpenCV tracker refining the boxes between keyframes
+        :param clock: time source when update() is not given a timestamp
+        """
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.min_confidence = min_confidence
+        self.decay = decay
+        self.line = line
+        self.queue_speed = queue_speed
+        self.window = window
+        self.clock = clock
+        self._factory = visual_tracker_factory(tracker)
+        self.tracks = []
+        self._next_id = 0
+        self._since_keyframe = None
+        self._last = None
+        self._flow = deque()  # Timestamps of the vehicles that crossed (or left)
+        self.frames = 0
+        self.keyframes = 0
+        self.crossed = 0
+
+    def __repr__(self):
+        return repr((len(self.tracks), self.frames, self.keyframes))
+
+    def update(self, detect, img, timestamp=None):
+        """
+        Moves the tracks to img, detecting the vehicles when it is a keyframe
+        :param detect: callable img -> (vehicle_boxes, vehicle_count), e.g. VehicleDetector.detect_vehicles
+        :param img:
+        :param timestamp: seconds, of the frame (defaults to the clock)
+        :return: vehicle_boxes: np.ndarray int32 (N, 4), vehicle_count: int (confirmed tracks only)
+        """
+        now = self.clock() if timestamp is None else timestamp
+        dt = 0.0 if self._last is None else max(now - self._last, 0.0)
+        self._last = now
+        self.frames += 1
+        self._predict(img, dt)
+        if self.needs_keyframe():
+            boxes, _ = detect(img)
+            self._correct(img, np.asarray(boxes, dtype=np.float64).reshape(-1, 4), now)
+            self.keyframes += 1
+            self._since_keyframe = 0
+        else:
+            self._since_keyframe += 1
+        self._leave(img.shape, now)
+        self._cross(now)
+        boxes = self.boxes(confirmed=True)
+        return boxes, len(boxes)
+
+    def needs_keyframe(self):
+        """
+        Whether the next frame goes through the network
+        :return: bool
+        """
+        if self._since_keyframe is None or self._since_keyframe + 1 >= self.keyframe_interval:
+            return True
+        return bool(self.tracks) and self.confidence() < self.min_confidence
+
+    def confidence(self):
+        """
+        Mean confidence of the tracks (1 without tracks)
+        :return: float
+        """
+        return float(np.mean([t.confidence for t in self.tracks])) if self.tracks else 1.0
+
+    def boxes(self, confirmed=False):
+        """
+        Current box of every track
+        :param confirmed: only the tracks detected at least min_hits times
+        :return: np.ndarray int32 (N, 4)
+        """
+        tracks = [t for t in self.tracks if t.hits >= self.min_hits] if confirmed else self.tracks
+        if not tracks:
+            return np.zeros((0, 4), dtype=np.int32)
+        return np.round([t.box for t in tracks]).astype(np.int32)
+
+    def queue_length(self):
+        """
+        Confirmed vehicles standing (slower than queue_speed)
+        :return: int
+        """
+        return sum(1 for t in self.tracks if t.hits >= self.min_hits and t.speed() < self.queue_speed)
+
+    def flow_rate(self, now=None):
+        """
+        Vehicles per minute that crossed the stop line (or left the frame) over the last window seconds
+        :param now:
+        :return: float
+        """
+        now = self._last if now is None else now
+        while self._flow and now - self._flow[0] > self.window:
+            self._flow.popleft()
+        return len(self._flow) * 60.0 / self.window
+
+    def stats(self):
+        """
+        Returns the frames seen, the share that went through the network and the lane signals
+        :return: stats: dict
+        """
+        return {
+            "FRAMES": self.frames,
+            "KEYFRAMES": self.keyframes,
+            "DETECT_RATE": self.keyframes / self.frames if self.frames else 0.0,
+            "TRACKS": len(self.tracks),
+            "QUEUE_LENGTH": self.queue_length(),
+            "FLOW_RATE": self.flow_rate() if self._last is not None else 0.0,
+            "CROSSED": self.crossed,
+        }
+
+    # Helpers
+    def _predict(self, img, dt):
+        for track in self.tracks:
+            if track.visual is not None:
+                ok, rect = track.visual.update(img)
+                if ok:
+                    track.box = np.asarray(rect, dtype=np.float64)
+                    track.confidence *= self.decay
+                    continue
+                track.visual = None
+                track.confidence = 0.0
+            track.box[:2] += track.velocity * dt
+            track.confidence *= self.decay
+
+    def _correct(self, img, detections, now):
+        predicted = np.array([t.box for t in self.tracks]).reshape(-1, 4)
+        pairs = greedy_match(iou_matrix(predicted, detections), self.iou_threshold)
+        # Fast movers no longer overlap their prediction, the closest leftovers are paired by their centres
+        rows = sorted(set(range(len(self.tracks))) - {r for r, _ in pairs})
+        cols = sorted(set(range(len(detections))) - {c for _, c in pairs})
+        if rows and cols:
+            distance = centroid_distance(predicted, detections)
+            pairs += greedy_match(-distance, -self.max_distance, rows, cols)
+        matched = set()
+        for r, c in pairs:
+            track = self.tracks[r]
+            elapsed = now - track.last_seen
+            if elapsed > 0:
+                measured = (detections[c, :2] - track.anchor[:2]) / elapsed
+                track.velocity = measured if track.hits == 1 else (track.velocity + measured) / 2
+            track.box = detections[c].copy()
+            track.anchor = track.box.copy()
+            track.hits += 1
+            track.misses = 0
+            track.confidence = 1.0
+            track.last_seen = now
+            self._start_visual(track, img)
+            matched.add(r)
+        kept = []
+        for r, track in enumerate(self.tracks):
+            if r not in matched:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue  # Lost, not counted in the flow (it may still be standing in the frame)
+            kept.append(track)
+        for c in sorted(set(range(len(detections))) - {c for _, c in pairs}):
+            track = Track(self._next_id, detections[c], now)
+            self._next_id += 1
+            track.side = self._side(track)
+            self._start_visual(track, img)
+            kept.append(track)
+        self.tracks = kept
+
+    def _start_visual(self, track, img):
+        if self._factory is None:
+            return
+        track.visual = self._factory()
+        track.visual.init(img, tuple(int(v) for v in track.box))
+
+    def _leave(self, shape, now):
+        # Tracks carried out of the frame
+        height, width = shape[:2]
+        kept = []
+        for track in self.tracks:
+            x, y, w, h = track.box
+            if x + w <= 0 or y + h <= 0 or x >= width or y >= height:
+                if self.line is None and track.hits >= self.min_hits:
+                    self._flow.append(now)
+                    self.crossed += 1
+            else:
+                kept.append(track)
+        self.tracks = kept
+
+    def _side(self, track):
+        return None if self.line is None else bool(track.centre()[1] >= self.line)
+
+    def _cross(self, now):
+        if self.line is None:
+            return
+        for track in self.tracks:
+            side = self._side(track)
+            if track.side is not None and side != track.side and track.hits >= self.min_hits:
+                self._flow.append(now)
+                self.crossed += 1
+            track.side = side
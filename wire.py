@@ -0,0 +1,113 @@
+import binascii
+import json
+import struct
+import timeit
+
+# Frame layout (little endian):
+#   header: magic u8, version u8, flags u8, seq u8, count u8
+#   count * lane: lane id u8 (image INDEX), vehicle count u16, position u8
+#   crc16-ccitt u16 over everything before it (when FLAG_CRC is set)
+MAGIC = 0xA5
+VERSION = 1
+FLAG_CRC = 0x01
+HEADER = struct.Struct("<BBBBB")
+LANE = struct.Struct("<BHB")
+CRC = struct.Struct("<H")
+
+
+def crc16(data: bytes):
+    """
+    CRC-16/CCITT-FALSE of data
+    :param data:
+    :return: crc: int
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_group(data: dict, seq=0, crc=True):
+    """
+    Encodes a Group.serialise payload to the compact binary frame
+    :param data: {"DATA": [{"INDEX", "VEHICLE_COUNT", "POSITION", ...}], "COUNT"}
+    :param seq: wraps at 256
+    :param crc: appends a crc16 of the frame
+    :return: frame: bytes
+    """
+    lanes = data["DATA"]
+    frame = bytearray(HEADER.pack(MAGIC, VERSION, FLAG_CRC if crc else 0, seq & 0xFF, len(lanes)))
+    for lane in lanes:
+        frame += LANE.pack(lane["INDEX"], min(lane["VEHICLE_COUNT"], 0xFFFF), lane["POSITION"])
+    if crc:
+        frame += CRC.pack(crc16(frame))
+    return bytes(frame)
+
+
+def frame_size(count, crc=True):
+    """
+    Size in bytes of a frame carrying count lanes
+    :param count:
+    :param crc:
+    :return: size: int
+    """
+    return HEADER.size + count * LANE.size + (CRC.size if crc else 0)
+
+
+def decode_group(frame: bytes):
+    """
+    Reference decoder of encode_group (mirrors the arduino side)
+    :param frame:
+    :return: {"DATA": [{"INDEX", "VEHICLE_COUNT", "POSITION"}], "COUNT", "SEQ"}
+    """
+    if len(frame) < HEADER.size:
+        raise ValueError(f"Frame too short: {len(frame)} bytes")
+    magic, version, flags, seq, count = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unknown frame magic/version {magic:#x}/{version}")
+    expected = frame_size(count, flags & FLAG_CRC)
+    if len(frame) != expected:
+        raise ValueError(f"Frame size {len(frame)} does not match {expected} for {count} lanes")
+    if flags & FLAG_CRC:
+        (crc,) = CRC.unpack_from(frame, expected - CRC.size)
+        if crc != crc16(frame[:expected - CRC.size]):
+            raise ValueError("Frame crc mismatch")
+    lanes = [
+        dict(zip(("INDEX", "VEHICLE_COUNT", "POSITION"), LANE.unpack_from(frame, HEADER.size + i * LANE.size)))
+        for i in range(count)
+    ]
+    return {"DATA": lanes, "COUNT": count, "SEQ": seq}
+
+
+def benchmark(lanes=4, baudrate=9600, number=10000):
+    """
+    Compares size, encode time and time on the wire of the json and binary formats
+    :param lanes:
+    :param baudrate:
+    :param number: encodes per timing
+    :return: results: dict
+    """
+    data = {
+        "DATA": [
+            {"PATH": f"src/demo_images/set_2/lane_{i + 1}.jpg", "VEHICLE_COUNT": 10 + i, "INDEX": i, "POSITION": i}
+            for i in range(lanes)
+        ],
+        "COUNT": lanes,
+    }
+    encoders = {
+        "json": lambda: json.dumps(data).encode("ascii"),
+        "binary": lambda: encode_group(data, crc=False),
+        "binary_crc": lambda: encode_group(data, crc=True),
+    }
+    results = {}
+    for name, encode in encoders.items():
+        size = len(encode())
+        results[name] = {
+            "BYTES": size,
+            "ENCODE_US": timeit.timeit(encode, number=number) / number * 1e6,
+            # 8N1: 10 bits on the wire per byte
+            "WIRE_MS": size * 10 / baudrate * 1000,
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in benchmark().items():
+        print(name, result)